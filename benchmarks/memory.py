@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""Measure the per-node memory footprint of TreeFuse's providers.
+
+This builds a tree of ``--nodes`` files (spread over directories of
+``--fanout`` entries, each file with ``--file-size`` bytes of content), and
+reports how much memory each provider holds for it, per node, as measured by
+``tracemalloc``::
+
+    $ python -m benchmarks.memory --nodes 1000000
+
+Content is counted too: pass ``--file-size 0`` to measure only metadata.
+"""
+import argparse
+import gc
+import os
+import tempfile
+import tracemalloc
+from typing import Callable, Iterator, Tuple
+
+import treelib
+
+from treefuse import FrozenTreeProvider, SQLiteProvider, compile_sqlite
+from treefuse.treefuse import TreelibProvider
+
+
+def generate_paths(
+    nodes: int, fanout: int, file_size: int
+) -> Iterator[Tuple[str, bytes]]:
+    """Yield ``(path, content)`` for ``nodes`` files."""
+    for number in range(nodes):
+        directories = []
+        remaining = number // fanout
+        while remaining:
+            directories.append(f"d{remaining % fanout}")
+            remaining //= fanout
+        path = "/".join(directories + [f"file{number}.txt"])
+        # Distinct content for each file, so none of it is shared
+        yield path, number.to_bytes(8, "little") * (file_size // 8)
+
+
+def build_tree(nodes: int, fanout: int, file_size: int) -> treelib.Tree:
+    tree = treelib.Tree()
+    root = tree.create_node("root")
+    directories = {"": root}
+    for path, content in generate_paths(nodes, fanout, file_size):
+        parent, _, name = path.rpartition("/")
+        if parent not in directories:
+            ancestor = ""
+            for component in parent.split("/"):
+                child = f"{ancestor}/{component}".lstrip("/")
+                if child not in directories:
+                    directories[child] = tree.create_node(
+                        component, parent=directories[ancestor]
+                    )
+                ancestor = child
+        tree.create_node(name, parent=directories[parent], data=content)
+    return tree
+
+
+def measure(build: Callable[[], object]) -> Tuple[int, int]:
+    """Return the memory retained by, and peak usage of, ``build()``."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        result = build()
+        gc.collect()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return after - before, peak - before
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=100000)
+    parser.add_argument("--fanout", type=int, default=100)
+    parser.add_argument("--file-size", type=int, default=64)
+    args = parser.parse_args()
+    shape = (args.nodes, args.fanout, args.file_size)
+
+    def treelib_provider() -> object:
+        return TreelibProvider(build_tree(*shape))
+
+    def frozen_from_tree() -> object:
+        return FrozenTreeProvider(build_tree(*shape))
+
+    def frozen_from_paths() -> object:
+        return FrozenTreeProvider(generate_paths(*shape))
+
+    directory = tempfile.TemporaryDirectory()
+    database = os.path.join(directory.name, "tree.sqlite")
+
+    def sqlite_from_paths() -> object:
+        # (SQLite's own allocations, such as its page cache, aren't traced;
+        # they're bounded by its cache size rather than the tree's)
+        compile_sqlite(generate_paths(*shape), database)
+        return SQLiteProvider(database)
+
+    print(f"{'provider':<32}{'bytes/node':>12}{'peak bytes/node':>18}")
+    for name, build in [
+        ("TreelibProvider", treelib_provider),
+        ("FrozenTreeProvider (from tree)", frozen_from_tree),
+        ("FrozenTreeProvider (from paths)", frozen_from_paths),
+        ("SQLiteProvider (from paths)", sqlite_from_paths),
+    ]:
+        retained, peak = measure(build)
+        print(
+            f"{name:<32}{retained / args.nodes:>12.1f}"
+            f"{peak / args.nodes:>18.1f}"
+        )
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+"""Benchmark TreeFuse's filesystem operations against synthetic trees.
+
+The in-process tier calls ``TreeFuseFS.getattr``, ``readdir``, ``open``,
+``read`` and ``release`` directly (as python-fuse would), so it needs no FUSE
+mount and measures only TreeFuse and its providers.  TreeFuseFS's negative
+lookup and child stat caches are disabled, so that repeated passes measure
+the providers' lookups rather than cache hits.  Trees have every
+combination of the given ``--depth``, ``--fanout`` and ``--file-size``: each
+directory has ``fanout`` children, and files are ``depth`` levels deep.
+
+With ``--mounted``, each tree is also mounted (which needs FUSE), and timed
+under ``find``, ``ls -lR`` and parallel ``cat``.
+
+Results are written as JSON (to ``--output``, or stdout); pass a previous run's
+results as ``--baseline`` to report (and exit non-zero on) regressions.
+Run it as a module from the root of the checkout, so that it benchmarks the
+checkout's ``treefuse``::
+
+    $ python -m benchmarks.operations --output before.json
+    $ git checkout new-release
+    $ python -m benchmarks.operations --baseline before.json
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import stat
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from unittest import mock
+
+import treelib
+
+import treefuse
+from treefuse import FrozenTreeProvider, SnapshotProvider, compile_snapshot
+from treefuse import TreeFuseProvider, treefuse_main
+from treefuse.treefuse import TreeFuseFS, TreelibProvider
+
+READ_SIZE = 128 * 1024
+
+Result = Dict[str, Any]
+
+
+def generate_files(
+    depth: int, fanout: int, file_size: int
+) -> Iterator[Tuple[str, bytes]]:
+    """Yield ``(path, content)`` for each file of a synthetic tree."""
+    content = bytes(range(256)) * (file_size // 256) + bytes(file_size % 256)
+    for position in itertools.product(range(fanout), repeat=depth):
+        directories = [f"dir{number}" for number in position[:-1]]
+        path = "/".join(directories + [f"file{position[-1]}"])
+        yield path, content
+
+
+def build_provider(
+    kind: str, depth: int, fanout: int, file_size: int, workdir: str
+) -> TreeFuseProvider:
+    files = generate_files(depth, fanout, file_size)
+    if kind == "treelib":
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        directories = {"": root}
+        for path, content in files:
+            parent, _, name = path.rpartition("/")
+            ancestor = ""
+            for component in parent.split("/") if parent else []:
+                child = f"{ancestor}/{component}".lstrip("/")
+                if child not in directories:
+                    directories[child] = tree.create_node(
+                        component, parent=directories[ancestor]
+                    )
+                ancestor = child
+            tree.create_node(name, parent=directories[parent], data=content)
+        return TreelibProvider(tree)
+    if kind == "frozen":
+        return FrozenTreeProvider(files)
+    if kind == "snapshot":
+        path = os.path.join(workdir, f"{depth}-{fanout}-{file_size}.snapshot")
+        compile_snapshot(files, path)
+        return SnapshotProvider(path)
+    raise ValueError(f"Unknown provider: {kind}")
+
+
+def walk(fs: TreeFuseFS) -> Tuple[List[str], List[str]]:
+    """Return the paths of every directory and file in ``fs``."""
+    directories, files = [], []
+    pending = ["/"]
+    while pending:
+        directory = pending.pop()
+        directories.append(directory)
+        for entry in fs.readdir(directory, 0):
+            if entry.name in (".", ".."):
+                continue
+            path = os.path.join(directory, entry.name)
+            if stat.S_ISDIR(fs.getattr(path).st_mode):
+                pending.append(path)
+            else:
+                files.append(path)
+    return directories, files
+
+
+def in_process_operations(
+    fs: TreeFuseFS, directories: List[str], files: List[str]
+) -> Dict[str, Tuple[int, Callable[[], None]]]:
+    """Return each operation's name, mapped to (op count, one pass of it)."""
+    paths = directories + files
+    missing = [path + ".missing" for path in files]
+
+    def getattr_() -> None:
+        for path in paths:
+            fs.getattr(path)
+
+    def getattr_missing() -> None:
+        for path in missing:
+            fs.getattr(path)
+
+    def readdir() -> None:
+        for path in directories:
+            for _ in fs.readdir(path, 0):
+                pass
+
+    def open_read_release() -> None:
+        for path in files:
+            fh = fs.open(path, os.O_RDONLY)
+            offset = 0
+            while True:
+                chunk = fs.read(path, READ_SIZE, offset, fh)
+                if not len(chunk):
+                    break
+                offset += len(chunk)
+            fs.release(path, os.O_RDONLY, fh)
+
+    return {
+        "getattr": (len(paths), getattr_),
+        "getattr_missing": (len(missing), getattr_missing),
+        "readdir": (len(directories), readdir),
+        "open_read_release": (len(files), open_read_release),
+    }
+
+
+def time_passes(function: Callable[[], None], repeat: int) -> List[float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarise(times: List[float], ops: int, **fields: Any) -> Result:
+    best = min(times)
+    return dict(
+        fields,
+        ops=ops,
+        seconds_min=best,
+        seconds_median=statistics.median(times),
+        ns_per_op=best / max(ops, 1) * 1e9,
+    )
+
+
+def mount(provider: TreeFuseProvider, mountpoint: str) -> None:
+    """Mount ``provider`` at ``mountpoint``, returning once it's mounted."""
+    process = multiprocessing.Process(target=treefuse_main, args=(provider,))
+    with mock.patch("sys.argv", ["benchmark", mountpoint]):
+        process.start()
+    # python-fuse daemonises, so the process exits once the mount is up.
+    # (Poll it: join() waits on a pipe which the daemon inherits.)
+    deadline = time.monotonic() + 10
+    while process.is_alive() or not os.path.ismount(mountpoint):
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Failed to mount {mountpoint}")
+        time.sleep(0.05)
+
+
+def unmount(mountpoint: str) -> None:
+    command = shutil.which("fusermount") or shutil.which("fusermount3")
+    if command is not None:
+        subprocess.check_call([command, "-u", mountpoint])
+    else:
+        subprocess.check_call(["umount", mountpoint])
+
+
+def mounted_operations(
+    mountpoint: str, files: List[str], workers: int
+) -> Dict[str, Tuple[int, Callable[[], None]]]:
+    def run(*command: str) -> Callable[[], None]:
+        return lambda: subprocess.run(
+            command, check=True, stdout=subprocess.DEVNULL
+        )
+
+    def cat(path: str) -> None:
+        with open(os.path.join(mountpoint, path.lstrip("/")), "rb") as f:
+            while f.read(READ_SIZE):
+                pass
+
+    def parallel_cat() -> None:
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            list(executor.map(cat, files))
+
+    return {
+        "find": (1, run("find", mountpoint)),
+        "ls_lR": (1, run("ls", "-lR", mountpoint)),
+        "parallel_cat": (len(files), parallel_cat),
+    }
+
+
+def run_benchmarks(args: argparse.Namespace) -> List[Result]:
+    results = []
+    if args.mounted and not os.path.exists("/dev/fuse"):
+        print("FUSE is unavailable: skipping mounted tier", file=sys.stderr)
+        args.mounted = False
+    with tempfile.TemporaryDirectory() as workdir:
+        for kind, depth, fanout, file_size in itertools.product(
+            args.provider, args.depth, args.fanout, args.file_size
+        ):
+            shape = dict(
+                provider=kind, depth=depth, fanout=fanout, file_size=file_size
+            )
+            print(f"Benchmarking {shape}", file=sys.stderr)
+            provider = build_provider(kind, depth, fanout, file_size, workdir)
+            fs = TreeFuseFS(
+                provider=provider, negative_cache_size=0, stat_children_ttl=0
+            )
+            directories, files = walk(fs)
+            operations = in_process_operations(fs, directories, files)
+            for operation, (ops, function) in operations.items():
+                times = time_passes(function, args.repeat)
+                results.append(
+                    summarise(
+                        times,
+                        ops,
+                        tier="in-process",
+                        operation=operation,
+                        **shape,
+                    )
+                )
+
+            if not args.mounted:
+                continue
+            mountpoint = tempfile.mkdtemp(dir=workdir)
+            mount(provider, mountpoint)
+            try:
+                operations = mounted_operations(
+                    mountpoint, files, args.workers
+                )
+                for operation, (ops, function) in operations.items():
+                    times = time_passes(function, args.repeat)
+                    results.append(
+                        summarise(
+                            times,
+                            ops,
+                            tier="mounted",
+                            operation=operation,
+                            **shape,
+                        )
+                    )
+            finally:
+                unmount(mountpoint)
+    return results
+
+
+def result_key(result: Result) -> Tuple[Any, ...]:
+    return tuple(
+        result[field]
+        for field in (
+            "tier",
+            "provider",
+            "depth",
+            "fanout",
+            "file_size",
+            "operation",
+        )
+    )
+
+
+def find_regressions(
+    results: List[Result], baseline: List[Result], threshold: float
+) -> List[str]:
+    """Describe each result more than ``threshold`` slower than baseline."""
+    previous = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result_key(result))
+        if before is None:
+            continue
+        ratio = result["ns_per_op"] / before["ns_per_op"]
+        if ratio > 1 + threshold:
+            regressions.append(
+                f"{result_key(result)}: {before['ns_per_op']:.0f}ns"
+                f" -> {result['ns_per_op']:.0f}ns per op ({ratio:.2f}x)"
+            )
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--depth", type=int, nargs="+", default=[2, 3])
+    parser.add_argument("--fanout", type=int, nargs="+", default=[10, 30])
+    parser.add_argument(
+        "--file-size", type=int, nargs="+", default=[1024, 256 * 1024]
+    )
+    parser.add_argument(
+        "--provider",
+        nargs="+",
+        choices=["treelib", "frozen", "snapshot"],
+        default=["treelib", "frozen", "snapshot"],
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="how many times to time each operation (the best is reported)",
+    )
+    parser.add_argument(
+        "--mounted",
+        action="store_true",
+        help="also benchmark mounted filesystems (needs FUSE)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="the number of concurrent readers for parallel_cat",
+    )
+    parser.add_argument("--output", help="write results to this file")
+    parser.add_argument("--baseline", help="compare with these results")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="how much slower than baseline counts as a regression",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    results = run_benchmarks(args)
+    report = {
+        "metadata": {
+            "treefuse": treefuse.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = find_regressions(
+                results, json.load(baseline)["results"], args.threshold
+            )
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""Tests for `treefuse.archive`."""
+
+import errno
+import io
+import json
+import os
+import stat
+import tarfile
+import zipfile
+from unittest import mock
+
+import pytest
+
+from treefuse import ArchiveProvider, FileContent
+from treefuse.archive import ArchiveError, _MemberContent
+from treefuse.content import BlockCache
+from treefuse.snapshot import SnapshotProvider, compile_snapshot
+from treefuse.treefuse import TreeFuseFS
+
+LARGE = bytes(range(256)) * 1000
+
+MEMBERS = {
+    "dir/small": b"small content",
+    "dir/sub/large": LARGE,
+    "top": b"top content",
+}
+
+
+def read_content(node):
+    return bytes(node.content.read(0, node.content.size))
+
+
+def write_tar(path, mode="w"):
+    with tarfile.open(path, mode) as archive:
+        directory = tarfile.TarInfo("./dir")
+        directory.type = tarfile.DIRTYPE
+        directory.mode = 0o750
+        archive.addfile(directory)
+        for name, data in MEMBERS.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o755 if name == "top" else 0o644
+            info.mtime = 1000000000
+            archive.addfile(info, io.BytesIO(data))
+        link = tarfile.TarInfo("link")
+        link.type = tarfile.LNKTYPE
+        link.linkname = "top"
+        archive.addfile(link)
+        symlink = tarfile.TarInfo("symlink")
+        symlink.type = tarfile.SYMTYPE
+        symlink.linkname = "top"
+        archive.addfile(symlink)
+        escape = tarfile.TarInfo("../escape")
+        archive.addfile(escape, io.BytesIO(b""))
+        empty = tarfile.TarInfo("empty")
+        empty.type = tarfile.DIRTYPE
+        archive.addfile(empty)
+
+
+def write_zip(path, compression):
+    with zipfile.ZipFile(path, "w", compression) as archive:
+        for name, data in MEMBERS.items():
+            archive.writestr(name, data)
+
+
+@pytest.fixture(
+    params=["tar", "tar.gz", "tar.xz", "zip-stored", "zip-deflated"]
+)
+def archive(request, tmp_path):
+    path = tmp_path / ("archive." + request.param)
+    if request.param == "zip-stored":
+        write_zip(path, zipfile.ZIP_STORED)
+    elif request.param == "zip-deflated":
+        write_zip(path, zipfile.ZIP_DEFLATED)
+    else:
+        write_tar(path, "w:" + request.param[4:])
+    return path
+
+
+class TestArchiveProvider:
+    def test_serves_members(self, archive):
+        provider = ArchiveProvider(archive, block_size=4096)
+
+        assert [node.name for node in provider.children_for("/")] == (
+            ["dir", "top"]
+            if archive.suffix.startswith(".zip")
+            else ["dir", "link", "top"]
+        )
+        assert provider.is_directory("/dir/sub")
+        for name, data in MEMBERS.items():
+            node = provider.lookup_path("/" + name)
+            assert node.stat.st_size == len(data)
+            assert read_content(node) == data
+        provider.close()
+
+    def test_reads(self, archive):
+        provider = ArchiveProvider(archive, block_size=4096)
+        fs = TreeFuseFS(provider=provider)
+
+        fh = fs.open("/dir/sub/large", os.O_RDONLY)
+        assert bytes(fs.read("/dir/sub/large", 100, 10000, fh)) == (
+            LARGE[10000:10100]
+        )
+        # Backwards, across a block boundary
+        assert bytes(fs.read("/dir/sub/large", 10, 4090, fh)) == (
+            LARGE[4090:4100]
+        )
+        assert bytes(fs.read("/dir/sub/large", 100, len(LARGE) - 10, fh)) == (
+            LARGE[-10:]
+        )
+        assert fs.read("/dir/sub/large", 100, len(LARGE), fh) == b""
+        assert fs.getattr("/missing") == -errno.ENOENT
+        provider.close()
+
+    def test_stored_members_are_read_in_place(self, tmp_path):
+        path = tmp_path / "archive.tar"
+        write_tar(path)
+
+        node = ArchiveProvider(path).lookup_path("/dir/sub/large")
+
+        assert isinstance(node.content, FileContent)
+        assert node.content.path == str(path)
+
+    def test_compressed_members_are_cached(self, tmp_path):
+        path = tmp_path / "archive.zip"
+        write_zip(path, zipfile.ZIP_DEFLATED)
+        cache = BlockCache()
+        provider = ArchiveProvider(path, block_size=4096, block_cache=cache)
+        content = provider.lookup_path("/dir/sub/large").content
+        assert isinstance(content, _MemberContent)
+
+        assert bytes(content.read(10000, 10)) == LARGE[10000:10010]
+        # The blocks decompressed to reach it were cached too
+        assert len(cache) == 3
+        provider.close()
+        assert bytes(content.read(0, 10)) == LARGE[:10]
+
+    def test_tar_attributes(self, tmp_path):
+        path = tmp_path / "archive.tar"
+        write_tar(path)
+        provider = ArchiveProvider(path)
+
+        top = provider.lookup_path("/top").stat
+        assert stat.S_IMODE(top.st_mode) == 0o555
+        assert top.st_mtime == 1000000000
+        assert stat.S_IMODE(provider.lookup_path("/dir").stat.st_mode) == (
+            0o550
+        )
+        assert read_content(provider.lookup_path("/link")) == b"top content"
+        # Symbolic links, members outside the archive and empty directories
+        # aren't served
+        for missing in ["/symlink", "/escape", "/empty"]:
+            assert provider.lookup_path(missing) is None
+
+    def test_members_are_constructed_lazily(self, archive):
+        provider = ArchiveProvider(archive)
+
+        # Kept in arrays, rather than as a stat and content for each member
+        assert provider._stats == {}
+        assert provider._other_content == {}
+        assert provider.lookup_path("/dir/sub/large").stat.st_size == len(
+            LARGE
+        )
+        assert read_content(provider.lookup_path("/top")) == b"top content"
+        provider.close()
+
+    def test_snapshot(self, archive, tmp_path):
+        provider = ArchiveProvider(archive)
+        compile_snapshot(provider, tmp_path / "archive.snapshot")
+        provider.close()
+
+        snapshot = SnapshotProvider(tmp_path / "archive.snapshot")
+        fs = TreeFuseFS(provider=snapshot)
+        for name, data in MEMBERS.items():
+            path = "/" + name
+            fh = fs.open(path, os.O_RDONLY)
+            assert bytes(fs.read(path, len(data), 0, fh)) == data
+            assert fs.getattr(path).st_mtime == (
+                provider.lookup_path(path).stat.st_mtime
+            )
+        snapshot.close()
+
+    def test_index_is_reused(self, tmp_path, monkeypatch):
+        path = tmp_path / "archive.tar"
+        write_tar(path)
+        ArchiveProvider(path)
+        assert os.path.exists(str(path) + ".treefuse-index")
+
+        def scan(*args):
+            raise AssertionError("rescanned")
+
+        monkeypatch.setattr(ArchiveProvider, "_scan", scan)
+        provider = ArchiveProvider(path)
+
+        assert read_content(provider.lookup_path("/top")) == b"top content"
+
+    def test_stale_index_is_rebuilt(self, tmp_path):
+        path = tmp_path / "archive.zip"
+        index = tmp_path / "index"
+        write_zip(path, zipfile.ZIP_STORED)
+        ArchiveProvider(path, index_path=index)
+        with zipfile.ZipFile(path, "a") as archive:
+            archive.writestr("new", b"new content")
+
+        provider = ArchiveProvider(path, index_path=index)
+
+        assert read_content(provider.lookup_path("/new")) == b"new content"
+
+    def test_corrupt_index_is_rebuilt(self, tmp_path):
+        path = tmp_path / "archive.tar"
+        write_tar(path)
+        (tmp_path / "archive.tar.treefuse-index").write_bytes(b"{")
+
+        provider = ArchiveProvider(path)
+
+        assert provider.lookup_path("/top") is not None
+
+    @pytest.mark.parametrize(
+        "change",
+        [
+            lambda index: index["members"][0].pop(),
+            lambda index: index["members"][0].__setitem__(4, "0"),
+            lambda index: index["members"][0].__setitem__(2, 1 << 16),
+            lambda index: index["members"].append(None),
+            lambda index: index.__setitem__("members", {}),
+            lambda index: index.__setitem__("compression", "zstd"),
+        ],
+    )
+    def test_invalid_index_is_rebuilt(self, tmp_path, change):
+        path = tmp_path / "archive.tar"
+        index_path = tmp_path / "archive.tar.treefuse-index"
+        write_tar(path)
+        ArchiveProvider(path)
+        index = json.loads(index_path.read_text())
+        change(index)
+        index_path.write_text(json.dumps(index))
+
+        provider = ArchiveProvider(path)
+
+        assert read_content(provider.lookup_path("/top")) == b"top content"
+        assert provider.lookup_path("/dir/small").stat.st_size == len(
+            b"small content"
+        )
+
+    def test_index_mode_follows_umask(self, tmp_path):
+        path = tmp_path / "archive.tar"
+        write_tar(path)
+        umask = os.umask(0o027)
+        try:
+            with mock.patch("os.umask", side_effect=AssertionError):
+                ArchiveProvider(path)
+        finally:
+            os.umask(umask)
+
+        index_path = tmp_path / "archive.tar.treefuse-index"
+        assert stat.S_IMODE(os.stat(index_path).st_mode) == 0o640
+
+    def test_without_persisted_index(self, tmp_path):
+        path = tmp_path / "archive.tar"
+        write_tar(path)
+
+        ArchiveProvider(path, persist_index=False)
+
+        assert os.listdir(tmp_path) == ["archive.tar"]
+
+    def test_not_an_archive(self, tmp_path):
+        path = tmp_path / "archive.tar"
+        path.write_bytes(b"not an archive" * 100)
+
+        with pytest.raises(ArchiveError):
+            ArchiveProvider(path)
+
+    def test_invalid_block_size(self, tmp_path):
+        with pytest.raises(ValueError):
+            ArchiveProvider(tmp_path / "archive.tar", block_size=0)
@@ -0,0 +1,141 @@
+"""Tests for `treefuse.blobs`."""
+
+import hashlib
+import pickle
+
+import pytest
+import treelib
+
+from treefuse import Blob, BlobStore
+from treefuse.treefuse import TreelibProvider
+
+
+class TestBlobStore:
+    def test_identical_content_is_stored_once(self):
+        store = BlobStore()
+
+        first = store.add(b"content")
+        second = store.add(bytearray(b"content"))
+        other = store.add(b"other")
+
+        assert first is second
+        assert isinstance(first, Blob)
+        assert first == b"content"
+        assert first.digest == hashlib.sha256(b"content").hexdigest()
+        assert store.refcount(first.digest) == 2
+        assert len(store) == 2
+        assert store.size == len(b"contentother")
+        assert other.digest in store
+
+    def test_release(self):
+        store = BlobStore()
+        blob = store.add(b"content")
+        store.add(b"content")
+
+        store.release(blob)
+        assert store.get(blob.digest) is blob
+        store.release(blob.digest)
+
+        assert blob.digest not in store
+        assert store.refcount(blob.digest) == 0
+        with pytest.raises(KeyError):
+            store.release(blob)
+
+    def test_adding_a_blob(self):
+        store = BlobStore()
+        blob = store.add(b"content")
+
+        assert store.add(blob) is blob
+        assert store.refcount(blob.digest) == 2
+
+    def test_blob_from_another_store(self):
+        blob = BlobStore().add(b"content")
+        store = BlobStore("sha1")
+
+        added = store.add(blob)
+
+        assert added is not blob
+        assert added.digest == hashlib.sha1(b"content").hexdigest()
+
+    def test_pickle(self):
+        blob = BlobStore().add(b"content")
+
+        unpickled = pickle.loads(pickle.dumps(blob))
+
+        assert unpickled == b"content"
+        assert unpickled.digest == blob.digest
+
+    def test_digest_of(self):
+        store = BlobStore()
+
+        assert store.digest_of(b"x") == hashlib.sha256(b"x").hexdigest()
+        assert len(store) == 0
+
+    def test_unknown_algorithm(self):
+        with pytest.raises(ValueError):
+            BlobStore("not-a-hash")
+
+
+class TestTreelibProviderBlobStore:
+    @pytest.fixture
+    def tree(self):
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        dir1 = tree.create_node("dir1", parent=root)
+        tree.create_node("a", parent=dir1, data=b"same")
+        tree.create_node("b", parent=root, data=(bytearray(b"same"), None))
+        tree.create_node("c", parent=root, data=b"other")
+        return tree
+
+    def test_content_is_deduplicated(self, tree):
+        store = BlobStore()
+        provider = TreelibProvider(tree, blob_store=store)
+
+        a = provider.lookup_path("/dir1/a").content
+        assert a is provider.lookup_path("/b").content
+        assert store.refcount(a.digest) == 2
+        assert len(store) == 2
+
+    def test_mutations_are_refcounted(self, tree):
+        store = BlobStore()
+        provider = TreelibProvider(tree, blob_store=store)
+        digest = store.digest_of(b"same")
+
+        provider.add_node("/", "d", b"same")
+        assert store.refcount(digest) == 3
+        provider.replace_node("/d", b"new")
+        assert store.refcount(digest) == 2
+        provider.remove_node("/dir1")
+        assert store.refcount(digest) == 1
+        with pytest.raises(ValueError):
+            provider.add_node("/missing", "e", b"same")
+        assert store.refcount(digest) == 1
+
+        # The old tree's references are released, the new tree's added
+        provider.swap_tree(treelib.Tree(tree, deep=True))
+        assert len(store) == 3
+        assert all(store.refcount(d) == 1 for d in store._blobs)
+
+    def test_swap_tree_with_identical_content(self, tree):
+        provider = TreelibProvider(tree, blob_store=BlobStore())
+        new_tree = treelib.Tree()
+        root = new_tree.create_node("root")
+        dir1 = new_tree.create_node("dir1", parent=root)
+        new_tree.create_node("a", parent=dir1, data=b"same")
+        new_tree.create_node("b", parent=root, data=(b"same", None))
+        new_tree.create_node("c", parent=root, data=b"other")
+
+        # b's data is a new tuple, so is reported even though its content
+        # isn't new
+        assert provider.swap_tree(new_tree) == ["/b"]
+
+    def test_non_buffer_content_is_kept(self):
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        tree.create_node("file", parent=root, data="not bytes")
+        store = BlobStore()
+
+        provider = TreelibProvider(tree, blob_store=store)
+
+        assert provider.lookup_path("/file").content == "not bytes"
+        assert len(store) == 0
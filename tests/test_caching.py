@@ -0,0 +1,328 @@
+"""Tests for `treefuse.caching`."""
+
+import collections
+import errno
+import os
+import time
+
+import pytest
+
+from treefuse import (
+    CachingProvider,
+    ProviderContent,
+    TreeFuseContent,
+    TreeFuseNode,
+    TreeFuseProvider,
+    TreeFuseStat,
+)
+from treefuse.caching import _ENTRY_NBYTES, _PAGE_SIZE
+from treefuse.treefuse import TreeFuseFS
+
+
+class _InventoryProvider(TreeFuseProvider):
+    """A stub of an expensive provider, which counts calls into it."""
+
+    def __init__(self, files):
+        self.files = dict(files)
+        self.calls = collections.Counter()
+
+    def children_for(self, path):
+        self.calls["children_for"] += 1
+        if path != "/":
+            return []
+        return [
+            TreeFuseNode(
+                name, ProviderContent(self, "/" + name), is_directory=False
+            )
+            for name in self.files
+        ]
+
+    def stat_children(self, path):
+        self.calls["stat_children"] += 1
+        if path != "/":
+            return []
+        return [
+            (name, TreeFuseStat.for_file_stat(st_size=len(content)))
+            for name, content in self.files.items()
+        ]
+
+    def is_directory(self, path):
+        self.calls["is_directory"] += 1
+        return path == "/"
+
+    def lookup_path(self, path):
+        self.calls["lookup_path"] += 1
+        if path == "/":
+            return TreeFuseNode("root", None, is_directory=True)
+        name = path.lstrip("/")
+        if name not in self.files:
+            return None
+        return TreeFuseNode(
+            name, ProviderContent(self, path), is_directory=False
+        )
+
+    def size_of(self, path):
+        self.calls["size_of"] += 1
+        return len(self.files[path.lstrip("/")])
+
+    def read_range(self, path, offset, size):
+        self.calls["read_range"] += 1
+        return self.files[path.lstrip("/")][offset:offset + size]
+
+
+class _DirectoryProvider(TreeFuseProvider):
+    """A stub of a provider of one large directory, which seeks cheaply."""
+
+    def __init__(self, count):
+        self.names = ["file{:06}".format(i) for i in range(count)]
+        self.offsets = []
+
+    def children_for(self, path):
+        return self.iter_children(path)
+
+    def iter_children(self, path, offset=0):
+        self.offsets.append(offset)
+        return (
+            TreeFuseNode(name, b"", is_directory=False)
+            for name in self.names[offset:]
+        )
+
+    def is_directory(self, path):
+        return path == "/"
+
+    def lookup_path(self, path):
+        return None
+
+
+class _CountingContent(TreeFuseContent):
+    def __init__(self, data):
+        self.data = data
+        self.reads = 0
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def read(self, offset, size):
+        self.reads += 1
+        return self.data[offset:offset + size]
+
+
+@pytest.fixture
+def inner():
+    return _InventoryProvider({"a": b"a content", "b": b"b content"})
+
+
+class TestCachingProvider:
+    def test_lookups_are_cached(self, inner):
+        provider = CachingProvider(inner)
+
+        for _ in range(3):
+            assert provider.lookup_path("/a").name == "a"
+            assert provider.is_directory("/")
+            assert [c.name for c in provider.children_for("/")] == ["a", "b"]
+            assert provider.size_of("/a") == 9
+
+        assert inner.calls == {
+            "lookup_path": 1,
+            "is_directory": 1,
+            "children_for": 1,
+            "size_of": 1,
+        }
+        assert provider.stats["lookup_path"].hits == 2
+        assert provider.stats["lookup_path"].misses == 1
+
+    def test_missing_paths_are_not_cached(self, inner):
+        provider = CachingProvider(inner)
+
+        assert provider.lookup_path("/missing") is None
+        assert provider.lookup_path("/missing") is None
+
+        assert inner.calls["lookup_path"] == 2
+
+    def test_content_reads_through_cache(self, inner):
+        provider = CachingProvider(inner)
+        fs = TreeFuseFS(provider=provider)
+
+        for _ in range(3):
+            fh = fs.open("/a", os.O_RDONLY)
+            assert fs.read("/a", 4, 2, fh) == b"cont"
+
+        assert inner.calls["read_range"] == 1
+        assert provider.stats["content"].hits == 2
+        # (Plus the node looked up by open)
+        assert provider.nbytes == 4 + _ENTRY_NBYTES + len("a")
+
+    def test_iter_children(self, inner):
+        provider = CachingProvider(inner)
+
+        assert [c.name for c in provider.iter_children("/", 1)] == ["b"]
+        assert [c.name for c in provider.iter_children("/", 0)] == ["a", "b"]
+        assert inner.calls["children_for"] == 1
+
+    def test_listings_are_cached_in_pages(self):
+        inner = _DirectoryProvider(_PAGE_SIZE * 3 + 10)
+        provider = CachingProvider(inner)
+
+        children = provider.iter_children("/", _PAGE_SIZE * 2 + 5)
+        assert next(children).name == inner.names[_PAGE_SIZE * 2 + 5]
+        # Only the page reached has been fetched
+        assert inner.offsets == [_PAGE_SIZE * 2]
+        assert len(list(children)) == _PAGE_SIZE + 4
+        assert [c.name for c in provider.children_for("/")] == inner.names
+        # Each iterator is continued across the pages which aren't cached, and
+        # the pages which are are reused
+        assert inner.offsets == [_PAGE_SIZE * 2, 0]
+        assert len(provider) == 4
+
+    def test_listings_count_towards_max_bytes(self):
+        inner = _DirectoryProvider(10)
+        provider = CachingProvider(inner, max_bytes=_ENTRY_NBYTES * 5)
+
+        assert len(list(provider.children_for("/"))) == 10
+
+        assert len(provider) == 0
+        provider = CachingProvider(inner)
+        list(provider.children_for("/"))
+        assert provider.nbytes == 10 * (_ENTRY_NBYTES + len("file000000"))
+
+    def test_content_of_nodes_is_cached(self):
+        content = _CountingContent(b"generated content")
+        inner = _InventoryProvider({})
+        inner.lookup_path = lambda path: TreeFuseNode(
+            "generated", content, is_directory=False
+        )
+        provider = CachingProvider(inner)
+
+        for _ in range(3):
+            node = provider.lookup_path("/generated")
+            assert node.content.size == 17
+            assert bytes(node.content.read(0, 9)) == b"generated"
+
+        assert content.reads == 1
+        assert provider.stats["content"].hits == 2
+
+    def test_content_which_is_not_a_buffer(self, inner):
+        inner.lookup_path = lambda path: TreeFuseNode(
+            "text", "not a buffer", is_directory=False
+        )
+        provider = CachingProvider(inner)
+        fs = TreeFuseFS(provider=provider)
+
+        assert provider.lookup_path("/text").content == "not a buffer"
+        fh = fs.open("/text", os.O_RDONLY)
+        assert fs.read("/text", 4, 0, fh) == -errno.EILSEQ
+        assert provider.nbytes == _ENTRY_NBYTES + len("text")
+
+    def test_stat_children(self, inner):
+        provider = CachingProvider(inner)
+
+        assert [name for name, _ in provider.stat_children("/")] == ["a", "b"]
+        provider.stat_children("/")
+        assert inner.calls["stat_children"] == 1
+
+        inner.files["c"] = b"c content"
+        provider.invalidate("/c")
+
+        assert [name for name, _ in provider.stat_children("/")] == [
+            "a",
+            "b",
+            "c",
+        ]
+        assert inner.calls["stat_children"] == 2
+
+    def test_max_entries_evicts_lru(self, inner):
+        provider = CachingProvider(inner, max_entries=2)
+
+        provider.lookup_path("/a")
+        provider.lookup_path("/b")
+        provider.lookup_path("/a")
+        provider.lookup_path("/")
+
+        assert len(provider) == 2
+        assert provider.stats["lookup_path"].evictions == 1
+        provider.lookup_path("/a")
+        assert inner.calls["lookup_path"] == 3
+        provider.lookup_path("/b")
+        assert inner.calls["lookup_path"] == 4
+
+    def test_max_bytes_evicts_content(self, inner):
+        provider = CachingProvider(inner, max_bytes=10)
+
+        provider.read_range("/a", 0, 6)
+        provider.read_range("/b", 0, 6)
+
+        assert provider.nbytes == 6
+        assert provider.stats["content"].evictions == 1
+        provider.read_range("/b", 0, 6)
+        assert inner.calls["read_range"] == 2
+
+    def test_oversized_content_is_not_cached(self, inner):
+        provider = CachingProvider(inner, max_bytes=4)
+
+        provider.read_range("/a", 0, 9)
+
+        assert len(provider) == 0
+
+    def test_ttl(self, inner):
+        provider = CachingProvider(inner, ttl=0.05)
+
+        provider.lookup_path("/a")
+        provider.lookup_path("/a")
+        time.sleep(0.1)
+        provider.lookup_path("/a")
+
+        assert inner.calls["lookup_path"] == 2
+
+    def test_invalidate(self, inner):
+        provider = CachingProvider(inner)
+        provider.lookup_path("/a")
+        provider.lookup_path("/b")
+        provider.children_for("/")
+
+        inner.files["c"] = b"c content"
+        provider.invalidate("/c")
+        provider.invalidate("/a")
+
+        assert [c.name for c in provider.children_for("/")] == ["a", "b", "c"]
+        provider.lookup_path("/a")
+        provider.lookup_path("/b")
+        assert inner.calls["lookup_path"] == 3
+
+    def test_invalidate_tree(self, inner):
+        provider = CachingProvider(inner)
+        provider.lookup_path("/")
+        provider.lookup_path("/a")
+        provider.read_range("/b", 0, 4)
+
+        provider.invalidate_tree("/")
+
+        assert len(provider) == 0
+        assert provider.nbytes == 0
+
+    def test_clear(self, inner):
+        provider = CachingProvider(inner)
+        provider.lookup_path("/a")
+        provider.read_range("/a", 0, 4)
+
+        provider.clear()
+
+        assert len(provider) == 0
+        assert provider.nbytes == 0
+
+    def test_invalid_max_entries(self, inner):
+        with pytest.raises(ValueError):
+            CachingProvider(inner, max_entries=0)
+
+    def test_provider_changes_invalidate(self, inner):
+        provider = CachingProvider(inner)
+        changes = []
+        provider.add_change_callback(changes.append)
+        provider.lookup_path("/a")
+        provider.children_for("/")
+
+        inner.files["c"] = b"c content"
+        inner.notify_change("/c")
+
+        assert [c.name for c in provider.children_for("/")] == ["a", "b", "c"]
+        assert changes == ["/c"]
@@ -0,0 +1,198 @@
+"""Tests for `treefuse.content`."""
+
+import os
+
+import pytest
+import treelib
+
+from treefuse import CompressedContent, FileContent
+from treefuse.content import CODECS, BlockCache, MappingCache
+from treefuse.treefuse import TreeFuseFS, TreelibProvider
+
+
+@pytest.fixture
+def backing_file(tmp_path):
+    path = tmp_path / "backing"
+    path.write_bytes(b"0123456789")
+    return path
+
+
+class TestMappingCache:
+    def test_view_is_cached(self, backing_file):
+        cache = MappingCache()
+
+        assert cache.view(str(backing_file)) == b"0123456789"
+        assert cache.view(str(backing_file)) == b"0123456789"
+        assert len(cache) == 1
+
+    def test_empty_file(self, tmp_path):
+        path = tmp_path / "empty"
+        path.write_bytes(b"")
+
+        assert MappingCache().view(str(path)) is None
+
+    def test_evicts_least_recently_used(self, tmp_path):
+        cache = MappingCache(max_mappings=2)
+        paths = []
+        for name in ["a", "b", "c"]:
+            path = tmp_path / name
+            path.write_bytes(name.encode())
+            paths.append(str(path))
+
+        cache.view(paths[0])
+        cache.view(paths[1])
+        cache.view(paths[0])
+        cache.view(paths[2])
+
+        assert list(cache._mappings) == [paths[0], paths[2]]
+
+    def test_eviction_with_outstanding_view(self, tmp_path):
+        cache = MappingCache(max_mappings=1)
+        path_a, path_b = tmp_path / "a", tmp_path / "b"
+        path_a.write_bytes(b"a content")
+        path_b.write_bytes(b"b content")
+
+        view = cache.view(str(path_a))
+        cache.view(str(path_b))
+
+        assert len(cache) == 1
+        assert view == b"a content"
+
+    def test_invalid_max_mappings(self):
+        with pytest.raises(ValueError):
+            MappingCache(max_mappings=0)
+
+
+class TestFileContent:
+    def test_whole_file(self, backing_file):
+        content = FileContent(backing_file)
+
+        assert content.size == 10
+        assert content.read(0, 4) == b"0123"
+        assert content.read(8, 4) == b"89"
+        assert content.read(20, 4) == b""
+
+    def test_range(self, backing_file):
+        content = FileContent(backing_file, offset=2, length=5)
+
+        assert content.size == 5
+        assert content.read(0, 100) == b"23456"
+        assert content.read(3, 100) == b"56"
+        assert content.read(5, 100) == b""
+
+    def test_offset_only(self, backing_file):
+        content = FileContent(backing_file, offset=7)
+
+        assert content.size == 3
+        assert content.read(0, 100) == b"789"
+
+    def test_size_does_not_read(self, backing_file):
+        cache = MappingCache()
+        content = FileContent(backing_file, mapping_cache=cache)
+
+        assert content.size == 10
+        assert len(cache) == 0
+
+    def test_invalid_arguments(self, backing_file):
+        with pytest.raises(ValueError):
+            FileContent(backing_file, offset=-1)
+        with pytest.raises(ValueError):
+            FileContent(backing_file, length=-1)
+
+    def test_served_by_treefusefs(self, backing_file):
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        tree.create_node(
+            "file", parent=root, data=FileContent(backing_file, offset=1)
+        )
+        fs = TreeFuseFS(provider=TreelibProvider(tree))
+
+        assert fs.getattr("/file").st_size == 9
+        fh = fs.open("/file", os.O_RDONLY)
+        assert fs.read("/file", 3, 2, fh) == b"345"
+        fs.release("/file", os.O_RDONLY, fh)
+
+
+class TestBlockCache:
+    def test_evicts_least_recently_used(self):
+        cache = BlockCache(max_bytes=10)
+        cache.put("a", b"aaaa")
+        cache.put("b", b"bbbb")
+        assert cache.get("a") == b"aaaa"
+
+        cache.put("c", b"cccc")
+
+        assert cache.get("b") is None
+        assert cache.get("a") == b"aaaa"
+        assert cache.get("c") == b"cccc"
+
+    def test_keeps_block_larger_than_max_bytes(self):
+        cache = BlockCache(max_bytes=2)
+        cache.put("a", b"aaaa")
+
+        assert cache.get("a") == b"aaaa"
+
+    def test_invalid_max_bytes(self):
+        with pytest.raises(ValueError):
+            BlockCache(max_bytes=0)
+
+
+class TestCompressedContent:
+    data = bytes(range(256)) * 40
+
+    @pytest.mark.parametrize("codec", CODECS)
+    def test_read(self, codec):
+        content = CompressedContent.compress(
+            self.data, codec=codec, block_size=1000
+        )
+
+        assert content.size == len(self.data)
+        assert content.read(0, 10) == self.data[:10]
+        assert content.read(990, 20) == self.data[990:1010]
+        assert content.read(500, 5000) == self.data[500:5500]
+        assert content.read(10000, 1000) == self.data[10000:]
+        assert content.read(len(self.data), 10) == b""
+
+    def test_compresses(self):
+        content = CompressedContent.compress(self.data, level=9)
+
+        assert len(content.data) < len(self.data) // 10
+
+    def test_empty(self):
+        content = CompressedContent.compress(b"")
+
+        assert content.size == 0
+        assert content.read(0, 10) == b""
+
+    def test_decompresses_only_overlapping_blocks(self):
+        cache = BlockCache()
+        content = CompressedContent.compress(
+            self.data, block_size=1000, block_cache=cache
+        )
+
+        content.read(2500, 1000)
+
+        assert len(cache) == 2
+        assert cache.get((content._key, 2)) == self.data[2000:3000]
+        assert cache.get((content._key, 3)) == self.data[3000:4000]
+
+    def test_invalid_arguments(self):
+        with pytest.raises(ValueError):
+            CompressedContent.compress(self.data, codec="rot13")
+        with pytest.raises(ValueError):
+            CompressedContent.compress(self.data, block_size=0)
+
+    def test_served_by_treefusefs(self):
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        tree.create_node(
+            "file",
+            parent=root,
+            data=CompressedContent.compress(self.data, block_size=1000),
+        )
+        fs = TreeFuseFS(provider=TreelibProvider(tree))
+
+        assert fs.getattr("/file").st_size == len(self.data)
+        fh = fs.open("/file", os.O_RDONLY)
+        assert fs.read("/file", 1500, 800, fh) == self.data[800:2300]
+        fs.release("/file", os.O_RDONLY, fh)
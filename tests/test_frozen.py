@@ -0,0 +1,156 @@
+"""Tests for `treefuse.frozen`."""
+
+import errno
+import os
+import stat
+from unittest import mock
+
+import pytest
+import treelib
+
+from treefuse import FileContent, FrozenTreeProvider, TreeFuseStat
+from treefuse.treefuse import TreeFuseFS, TreelibProvider
+
+
+@pytest.fixture
+def tree():
+    tree = treelib.Tree()
+    root = tree.create_node("root")
+    dir1 = tree.create_node("dir1", parent=root)
+    tree.create_node("dirchild", parent=dir1, data=b"dirchild content")
+    tree.create_node(
+        "rootchild",
+        parent=root,
+        data=(b"rootchild content", TreeFuseStat.for_file(mode=0o755)),
+    )
+    tree.create_node("empty", parent=root)
+    return tree
+
+
+class TestFrozenTreeProvider:
+    def test_lookup_path(self, tree):
+        provider = FrozenTreeProvider(tree)
+
+        assert provider.lookup_path("/").name == "root"
+        assert provider.lookup_path("/dir1").is_directory is True
+        node = provider.lookup_path("/dir1/dirchild")
+        assert node.name == "dirchild"
+        assert node.is_directory is False
+        assert node.content == b"dirchild content"
+        assert provider.lookup_path("/empty").content == b""
+        assert provider.lookup_path("/missing") is None
+        assert provider.lookup_path("/rootchild/missing") is None
+
+    def test_matches_treelib_provider(self, tree):
+        frozen = FrozenTreeProvider(tree)
+        fs = TreeFuseFS(provider=frozen)
+        expected_fs = TreeFuseFS(provider=TreelibProvider(tree))
+
+        for path in ["/", "/dir1", "/dir1/dirchild", "/rootchild", "/empty"]:
+            st, expected = fs.getattr(path), expected_fs.getattr(path)
+            assert (st.st_mode, st.st_nlink, st.st_size) == (
+                expected.st_mode,
+                expected.st_nlink,
+                expected.st_size,
+            )
+        assert fs.getattr("/missing") == -errno.ENOENT
+        fh = fs.open("/rootchild", os.O_RDONLY)
+        assert fs.read("/rootchild", 4, 10, fh) == b"cont"
+
+    def test_children_are_sorted(self, tree):
+        provider = FrozenTreeProvider(tree)
+
+        assert [node.name for node in provider.children_for("/")] == [
+            "dir1",
+            "empty",
+            "rootchild",
+        ]
+        assert [node.name for node in provider.iter_children("/", 2)] == [
+            "rootchild"
+        ]
+        assert list(provider.children_for("/rootchild")) == []
+        assert list(provider.children_for("/missing")) == []
+
+    def test_readdir_is_lazy(self):
+        provider = FrozenTreeProvider(
+            "dir/file{:04}".format(i) for i in range(1000)
+        )
+        fs = TreeFuseFS(provider=provider)
+
+        with mock.patch.object(
+            provider, "_node", wraps=provider._node
+        ) as m_node:
+            entries = fs.readdir("/dir", 0)
+            names = [next(entries).name for _ in range(12)]
+
+        assert names[2:] == ["file{:04}".format(i) for i in range(10)]
+        # One for /dir itself, and one for each child we consumed
+        assert m_node.call_count == 11
+
+    def test_first_duplicate_wins(self):
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        tree.create_node("file", parent=root, data=b"first")
+        tree.create_node("file", parent=root, data=b"second")
+
+        provider = FrozenTreeProvider(tree)
+
+        assert len(provider) == 2
+        assert provider.lookup_path("/file").content == b"first"
+
+    def test_from_paths(self, tmp_path):
+        backing = tmp_path / "backing"
+        backing.write_bytes(b"on disk")
+        dir_stat = TreeFuseStat.for_directory(mode=0o700)
+        provider = FrozenTreeProvider(
+            [
+                "a/b/empty",
+                ("a/b/c", b"c content"),
+                ("a", (None, dir_stat)),
+                ("d/ünïcode", FileContent(str(backing))),
+            ]
+        )
+
+        assert len(provider) == 7
+        assert provider.is_directory("/a/b")
+        assert not provider.is_directory("/a/b/c")
+        assert provider.lookup_path("/a").stat is dir_stat
+        assert provider.lookup_path("/a/b/c").content == b"c content"
+        assert provider.size_of("/a/b/c") == 9
+        fs = TreeFuseFS(provider=provider)
+        assert fs.getattr("/d/ünïcode").st_size == 7
+        fh = fs.open("/d/ünïcode", os.O_RDONLY)
+        assert fs.read("/d/ünïcode", 100, 0, fh) == b"on disk"
+
+    def test_stats_are_packed(self, tree):
+        provider = FrozenTreeProvider(tree)
+
+        st = provider.lookup_path("/rootchild").stat
+        assert st.st_mode == stat.S_IFREG | 0o755
+        assert st.st_size == 17
+        assert provider._stats == {}
+
+    def test_other_stats_are_kept(self):
+        st = TreeFuseStat.for_file(keep_cache=True)
+        provider = FrozenTreeProvider([("file", (b"content", st))])
+
+        assert provider.lookup_path("/file").stat is st
+
+    def test_link_counts_are_kept(self):
+        st = TreeFuseStat.for_file_stat(st_nlink=3)
+        provider = FrozenTreeProvider([("file", (b"content", st))])
+
+        assert provider.lookup_path("/file").stat.st_nlink == 3
+
+    def test_identical_content_is_packed_once(self):
+        provider = FrozenTreeProvider(
+            [("a", b"same"), ("b", bytearray(b"same")), ("c", b"other")]
+        )
+
+        assert len(provider._content) == len(b"sameother")
+        assert provider.lookup_path("/b").content == b"same"
+        assert provider.lookup_path("/c").content == b"other"
+
+    def test_empty_tree(self):
+        with pytest.raises(ValueError):
+            FrozenTreeProvider(treelib.Tree())
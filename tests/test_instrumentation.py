@@ -0,0 +1,147 @@
+"""Tests for `treefuse.instrumentation`."""
+
+import errno
+import json
+import os
+from unittest import mock
+
+import pytest
+import treelib
+
+from treefuse import Instrumentation
+from treefuse.instrumentation import LATENCY_BUCKETS, STATS_FILE
+from treefuse.treefuse import TreeFuseFS, TreelibProvider
+
+
+@pytest.fixture
+def tree():
+    tree = treelib.Tree()
+    root = tree.create_node("root")
+    dir1 = tree.create_node("dir1", parent=root)
+    tree.create_node("dirchild", parent=dir1, data=b"dirchild content")
+    tree.create_node("rootchild", parent=root, data=b"rootchild content")
+    return tree
+
+
+class TestInstrumentation:
+    def test_record(self):
+        instrumentation = Instrumentation()
+
+        instrumentation.record("read", 0.002, nbytes=10)
+        instrumentation.record("read", 5.0, error="EIO")
+        instrumentation.record("lookup_path", 0.0, provider=True)
+
+        stats = instrumentation.operations()["read"]
+        assert stats.calls == 2
+        assert stats.errors == {"EIO": 1}
+        assert stats.bytes == 10
+        assert stats.max_seconds == 5.0
+        assert stats.histogram[LATENCY_BUCKETS.index(0.005)] == 1
+        assert stats.histogram[-1] == 1
+        assert instrumentation.provider_calls()["lookup_path"].calls == 1
+
+    def test_reset(self):
+        instrumentation = Instrumentation()
+        instrumentation.record("read", 0.1)
+
+        instrumentation.reset()
+
+        assert instrumentation.operations() == {}
+
+    def test_operations_are_recorded(self, tree):
+        instrumentation = Instrumentation()
+        fs = TreeFuseFS(
+            provider=TreelibProvider(tree), instrumentation=instrumentation
+        )
+
+        fs.getattr("/rootchild")
+        fs.getattr("/missing")
+        fh = fs.open("/rootchild", os.O_RDONLY)
+        fs.read("/rootchild", 100, 0, fh)
+        fs.release("/rootchild", os.O_RDONLY, fh)
+        list(fs.readdir("/", 0))
+
+        operations = instrumentation.operations()
+        assert operations["getattr"].calls == 2
+        assert operations["getattr"].errors == {"ENOENT": 1}
+        assert operations["read"].bytes == 17
+        assert operations["open"].calls == operations["release"].calls == 1
+        assert operations["readdir"].calls == 1
+        provider_calls = instrumentation.provider_calls()
+        # getattr (twice), open and readdir (of the directory itself)
+        assert provider_calls["lookup_path"].calls == 4
+        assert provider_calls["stat_children"].calls == 1
+
+    def test_exceptions_are_recorded(self, tree):
+        instrumentation = Instrumentation()
+        fs = TreeFuseFS(
+            provider=TreelibProvider(tree), instrumentation=instrumentation
+        )
+
+        def fail(path):
+            raise OSError(errno.EIO, "failed")
+
+        fs._provider.provider.lookup_path = fail
+        with pytest.raises(OSError):
+            fs.getattr("/rootchild")
+
+        assert instrumentation.operations()["getattr"].errors == {"EIO": 1}
+        provider_calls = instrumentation.provider_calls()
+        assert provider_calls["lookup_path"].errors == {"EIO": 1}
+
+    def test_disabled_by_default(self, tree):
+        fs = TreeFuseFS(provider=TreelibProvider(tree))
+
+        assert fs.instrumentation is None
+        assert fs.getattr.__func__ is TreeFuseFS.getattr
+
+
+class TestStatsFile:
+    def test_stats_file(self, tree):
+        fs = TreeFuseFS(provider=TreelibProvider(tree), stats_file=True)
+        fs.getattr("/missing")
+
+        assert fs.getattr("/.treefuse").st_mode & 0o040000
+        assert [entry.name for entry in fs.readdir("/.treefuse", 0)] == [
+            ".",
+            "..",
+            "stats",
+        ]
+        fh = fs.open(STATS_FILE, os.O_RDONLY)
+        assert fh.direct_io is True
+        assert fh.keep_cache is False
+        stats = json.loads(bytes(fs.read(STATS_FILE, 1 << 20, 0, fh)))
+        assert stats["operations"]["getattr"]["errors"] == {"ENOENT": 1}
+        assert "lookup_path" in stats["provider"]
+
+    def test_rendered_when_read(self, tree):
+        fs = TreeFuseFS(provider=TreelibProvider(tree), stats_file=True)
+        render = mock.Mock(wraps=fs.instrumentation.render)
+        fs.instrumentation.render = render
+
+        assert fs.getattr(STATS_FILE).st_size == 0
+        fh = fs.open(STATS_FILE, os.O_RDONLY)
+        assert render.call_count == 0
+
+        start = bytes(fs.read(STATS_FILE, 16, 0, fh))
+        rest = bytes(fs.read(STATS_FILE, 1 << 20, 16, fh))
+        assert render.call_count == 1
+        json.loads(start + rest)
+        size = len(start + rest)
+        for _ in range(3):
+            assert fs.getattr(STATS_FILE).st_size == size
+        assert render.call_count == 1
+
+        # Reading from the start again renders it afresh
+        again = bytes(fs.read(STATS_FILE, 1 << 20, 0, fh))
+        assert render.call_count == 2
+        assert json.loads(again)["operations"]["getattr"]["calls"] > (
+            json.loads(start + rest)["operations"]["getattr"]["calls"]
+        )
+
+    def test_not_listed_in_root(self, tree):
+        fs = TreeFuseFS(provider=TreelibProvider(tree), stats_file=True)
+
+        assert ".treefuse" not in [entry.name for entry in fs.readdir("/", 0)]
+        assert fs.getattr("/.treefuse/missing") == -errno.ENOENT
+        assert fs.getattr("/dir1/dirchild").st_size == 16
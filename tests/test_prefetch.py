@@ -0,0 +1,212 @@
+"""Tests for `treefuse.prefetch`."""
+
+import concurrent.futures
+import os
+import threading
+
+import pytest
+
+from treefuse import (
+    PrefetchingProvider,
+    ProviderContent,
+    TreeFuseNode,
+    TreeFuseProvider,
+    TreeFuseStat,
+)
+from treefuse.treefuse import TreeFuseFS
+
+
+class _GeneratingProvider(TreeFuseProvider):
+    """A stub of a provider which generates content, recording its reads."""
+
+    def __init__(self, files):
+        self.files = dict(files)
+        self.reads = []
+        self._lock = threading.Lock()
+
+    def _node(self, name):
+        if name == "buffer":
+            return TreeFuseNode(name, b"in memory", is_directory=False)
+        return TreeFuseNode(
+            name, ProviderContent(self, "/" + name), is_directory=False
+        )
+
+    def children_for(self, path):
+        if path != "/":
+            return []
+        return [self._node(name) for name in self.files]
+
+    def stat_children(self, path):
+        if path != "/":
+            return []
+        return [
+            (name, TreeFuseStat.for_file_stat(st_size=self.size_of(name)))
+            for name in self.files
+        ]
+
+    def is_directory(self, path):
+        return path == "/"
+
+    def size_of(self, path):
+        name = path.lstrip("/")
+        return 9 if name == "buffer" else len(self.files[name])
+
+    def lookup_path(self, path):
+        if path == "/":
+            return TreeFuseNode("root", None, is_directory=True)
+        name = path.lstrip("/")
+        return self._node(name) if name in self.files else None
+
+    def read_range(self, path, offset, size):
+        with self._lock:
+            self.reads.append((path, offset, size))
+        content = self.files[path.lstrip("/")]
+        if isinstance(content, Exception):
+            raise content
+        return content[offset:offset + size]
+
+
+def wait_for_prefetches(provider):
+    with provider._lock:
+        futures = [chunk.future for chunk in provider._chunks.values()]
+    concurrent.futures.wait(futures)
+
+
+def read_file(fs, path, size, offset=0):
+    fh = fs.open(path, os.O_RDONLY)
+    try:
+        return bytes(fs.read(path, size, offset, fh))
+    finally:
+        fs.release(path, os.O_RDONLY, fh)
+
+
+@pytest.fixture
+def inner():
+    return _GeneratingProvider(
+        {
+            "a": bytes(range(32)),
+            "b": b"b data",
+            "buffer": None,
+        }
+    )
+
+
+@pytest.fixture
+def provider(inner):
+    provider = PrefetchingProvider(inner, chunk_size=8, readahead=2)
+    yield provider
+    provider.close()
+
+
+class TestPrefetchingProvider:
+    def test_readdir_prefetches_files(self, inner, provider):
+        fs = TreeFuseFS(provider=provider)
+
+        list(fs.readdir("/", 0))
+        wait_for_prefetches(provider)
+        assert sorted(inner.reads) == [("/a", 0, 8), ("/b", 0, 8)]
+        inner.reads.clear()
+
+        assert read_file(fs, "/b", 100) == b"b data"
+        assert read_file(fs, "/a", 4, offset=2) == bytes(range(2, 6))
+        assert provider.stats.hits == 2
+        # Neither read was sequential (b's read reached its end)
+        assert inner.reads == []
+
+    def test_max_siblings(self, inner):
+        provider = PrefetchingProvider(inner, chunk_size=8, max_siblings=1)
+
+        list(provider.iter_children("/"))
+        wait_for_prefetches(provider)
+
+        assert len(inner.reads) == 1
+        provider.close()
+
+    def test_resumed_readdir_does_not_prefetch(self, inner, provider):
+        fs = TreeFuseFS(provider=provider, stat_children_ttl=0)
+
+        # (After ".", "..", and "a")
+        assert [entry.name for entry in fs.readdir("/", 3)] == [
+            "b",
+            "buffer",
+        ]
+        assert list(provider.iter_children("/", 1))
+
+        assert provider.stats.prefetched == 0
+
+    def test_sequential_reads_read_ahead(self, inner, provider):
+        content = provider.lookup_path("/a").content
+
+        assert bytes(content.read(0, 8)) == bytes(range(8))
+        wait_for_prefetches(provider)
+        assert sorted(inner.reads) == [
+            ("/a", 0, 8),
+            ("/a", 8, 8),
+            ("/a", 16, 8),
+        ]
+        inner.reads.clear()
+
+        assert bytes(content.read(8, 8)) == bytes(range(8, 16))
+        assert bytes(content.read(16, 4)) == bytes(range(16, 20))
+        wait_for_prefetches(provider)
+
+        assert provider.stats.hits == 2
+        assert provider.stats.misses == 1
+        # Only the chunk beyond those already prefetched was read
+        assert inner.reads == [("/a", 24, 8)]
+        # ...and the chunk which was read to its end was dropped
+        assert ("/a", 1) not in provider._chunks
+
+    def test_random_reads_dont_read_ahead(self, inner, provider):
+        content = provider.lookup_path("/a").content
+
+        content.read(16, 4)
+        content.read(4, 4)
+
+        assert provider.stats.prefetched == 0
+
+    def test_max_bytes(self, inner):
+        inner.files.update((f"file{n}", b"x" * 8) for n in range(10))
+        provider = PrefetchingProvider(inner, chunk_size=8, max_bytes=16)
+
+        list(provider.iter_children("/"))
+        wait_for_prefetches(provider)
+
+        assert provider.nbytes <= 16
+        assert len(provider._chunks) <= 2
+        assert provider.stats.prefetched - provider.stats.wasted <= 2
+        provider.close()
+
+    def test_changes_drop_prefetched_content(self, inner, provider):
+        changes = []
+        provider.add_change_callback(changes.append)
+        list(provider.iter_children("/"))
+        wait_for_prefetches(provider)
+
+        inner.files["b"] = b"new content"
+        inner.notify_change("/b")
+
+        assert changes == ["/b"]
+        assert ("/b", 0) not in provider._chunks
+        content = provider.lookup_path("/b").content
+        assert bytes(content.read(0, 100)) == b"new content"
+
+    def test_failed_prefetch_is_read_directly(self, inner, provider):
+        inner.files["b"] = OSError("failed")
+        list(provider.iter_children("/"))
+        wait_for_prefetches(provider)
+
+        content = provider.lookup_path("/b").content
+        with pytest.raises(OSError):
+            content.read(0, 8)
+
+    def test_buffer_content_is_not_wrapped(self, provider):
+        node = provider.lookup_path("/buffer")
+
+        assert node.content == b"in memory"
+
+    def test_invalid_arguments(self, inner):
+        with pytest.raises(ValueError):
+            PrefetchingProvider(inner, workers=0)
+        with pytest.raises(ValueError):
+            PrefetchingProvider(inner, chunk_size=0)
@@ -0,0 +1,143 @@
+"""Tests for `treefuse.profiling`."""
+
+import marshal
+import os
+import threading
+import time
+
+import pytest
+import treelib
+
+from treefuse import Profiler
+from treefuse.treefuse import TreeFuseFS, TreelibProvider
+
+
+@pytest.fixture
+def tree():
+    tree = treelib.Tree()
+    root = tree.create_node("root")
+    dir1 = tree.create_node("dir1", parent=root)
+    tree.create_node("dirchild", parent=dir1, data=b"dirchild content")
+    tree.create_node("rootchild", parent=root, data=b"rootchild content")
+    return tree
+
+
+def read_file(fs, path):
+    fh = fs.open(path, os.O_RDONLY)
+    content = bytes(fs.read(path, 100, 0, fh))
+    fs.release(path, os.O_RDONLY, fh)
+    return content
+
+
+def profiled_functions(path):
+    # What pstats.Stats would load (but it refuses to load empty profiles)
+    stats = marshal.loads(path.read_bytes())
+    return {function for _, _, function in stats}
+
+
+class TestProfiler:
+    def test_invalid_arguments(self, tmp_path):
+        with pytest.raises(ValueError):
+            Profiler(tmp_path / "out", mode="tracing")
+        with pytest.raises(ValueError):
+            Profiler(tmp_path / "out", operations=["write"])
+
+    def test_cprofile(self, tree, tmp_path):
+        output = tmp_path / "treefuse.prof"
+        profiler = Profiler(output, dump_signal=None)
+        fs = TreeFuseFS(provider=TreelibProvider(tree), profiler=profiler)
+
+        assert read_file(fs, "/rootchild") == b"rootchild content"
+        assert [entry.name for entry in fs.readdir("/", 0)] == [
+            ".",
+            "..",
+            "dir1",
+            "rootchild",
+        ]
+        profiler.write()
+
+        functions = profiled_functions(output)
+        assert {"lookup_path", "read", "iter_children"} <= functions
+
+    def test_profile_per_thread(self, tree, tmp_path):
+        profiler = Profiler(tmp_path / "treefuse.prof", dump_signal=None)
+        fs = TreeFuseFS(provider=TreelibProvider(tree), profiler=profiler)
+        idents = set()
+
+        def getattr():
+            idents.add(threading.get_ident())
+            fs.getattr("/rootchild")
+
+        # Each call in a new thread, as python-fuse makes them
+        for _ in range(20):
+            thread = threading.Thread(target=getattr)
+            thread.start()
+            thread.join()
+
+        assert len(profiler._profiles) == len(idents)
+
+    def test_operations(self, tree, tmp_path):
+        output = tmp_path / "treefuse.prof"
+        profiler = Profiler(output, operations=["open"], dump_signal=None)
+        fs = TreeFuseFS(provider=TreelibProvider(tree), profiler=profiler)
+
+        assert fs.getattr.__func__ is TreeFuseFS.getattr
+        read_file(fs, "/rootchild")
+        list(fs.readdir("/", 0))
+        profiler.write()
+
+        functions = profiled_functions(output)
+        assert "lookup_path" in functions
+        assert "iter_children" not in functions
+
+    def test_slow_threshold(self, tree, tmp_path):
+        output = tmp_path / "treefuse.prof"
+        profiler = Profiler(output, slow_threshold=0.05, dump_signal=None)
+        provider = TreelibProvider(tree)
+        fs = TreeFuseFS(provider=provider, profiler=profiler)
+        list(fs.readdir("/", 0))
+        profiler.write()
+        assert profiled_functions(output) == set()
+
+        def slow_lookup_path(path):
+            time.sleep(0.1)
+            return TreelibProvider.lookup_path(provider, path)
+
+        provider.lookup_path = slow_lookup_path
+        fs.getattr("/dir1/dirchild")
+        profiler.write()
+
+        functions = profiled_functions(output)
+        assert "slow_lookup_path" in functions
+        assert "iter_children" not in functions
+
+    def test_sampling(self, tree, tmp_path):
+        output = tmp_path / "treefuse.folded"
+        profiler = Profiler(
+            output, mode="sampling", sample_interval=0.001, dump_signal=None
+        )
+        provider = TreelibProvider(tree)
+        fs = TreeFuseFS(provider=provider, profiler=profiler)
+
+        def slow_lookup_path(path):
+            time.sleep(0.05)
+            return TreelibProvider.lookup_path(provider, path)
+
+        provider.lookup_path = slow_lookup_path
+        profiler.start()
+        fs.getattr("/rootchild")
+        profiler.stop()
+
+        lines = output.read_text().splitlines()
+        assert lines
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            assert stack.startswith("getattr;")
+            assert int(count) > 0
+        assert any("slow_lookup_path" in line for line in lines)
+
+    def test_disabled_by_default(self, tree):
+        fs = TreeFuseFS(provider=TreelibProvider(tree))
+
+        assert fs.profiler is None
+        assert fs.read.__func__ is TreeFuseFS.read
@@ -0,0 +1,266 @@
+"""Tests for `treefuse.progressive`."""
+
+import errno
+import os
+import queue
+import stat
+import threading
+import time
+
+import pytest
+import treelib
+
+from treefuse import ProgressiveProvider, TreeFuseStat
+from treefuse.treefuse import TreeFuseFS
+
+
+def queue_producer(entries):
+    """Yield what's put on ``entries``, until ``None`` is."""
+    while True:
+        entry = entries.get()
+        if entry is None:
+            return
+        yield entry
+
+
+class TestProgressiveProvider:
+    def test_serves_produced_entries(self):
+        provider = ProgressiveProvider(
+            ["dir/file", ("top", b"top content")],
+            wait_timeout=10,
+            listing_timeout=10,
+        )
+
+        assert [node.name for node in provider.children_for("/")] == [
+            "dir",
+            "top",
+        ]
+        assert provider.finished
+        assert provider.is_directory("/dir")
+        assert not provider.is_directory("/top")
+        assert provider.lookup_path("/top").content == b"top content"
+        assert provider.lookup_path("/missing") is None
+
+    def test_starts_with_tree(self):
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        tree.create_node("initial", parent=root, data=b"initial")
+        entries = queue.Queue()
+        provider = ProgressiveProvider(
+            queue_producer(entries), tree=tree, wait_timeout=10
+        )
+
+        # Existing nodes are served without waiting
+        assert provider.lookup_path("/initial").content == b"initial"
+        entries.put(None)
+
+    def test_lookups_wait_for_entries(self):
+        entries = queue.Queue()
+        provider = ProgressiveProvider(
+            queue_producer(entries), wait_timeout=10
+        )
+        fs = TreeFuseFS(provider=provider)
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(fs.getattr("/dir/file"))
+        )
+        thread.start()
+
+        entries.put(("dir/file", b"content"))
+        thread.join()
+
+        assert results[0].st_size == 7
+        entries.put(None)
+
+    def test_listings_wait_for_completion(self):
+        entries = queue.Queue()
+        provider = ProgressiveProvider(
+            queue_producer(entries), wait_timeout=10, listing_timeout=10
+        )
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(
+                [node.name for node in provider.children_for("/dir")]
+            )
+        )
+        entries.put("dir/first")
+        thread.start()
+
+        entries.put("dir/second")
+        provider.lookup_path("/dir/second")
+        assert results == []
+        provider.mark_complete("/dir")
+        thread.join()
+
+        assert results == [["first", "second"]]
+        entries.put(None)
+
+    def test_listings_do_not_wait_by_default(self):
+        entries = queue.Queue()
+        provider = ProgressiveProvider(
+            queue_producer(entries), wait_timeout=60
+        )
+        entries.put("dir/first")
+        provider.lookup_path("/dir/first")
+
+        start = time.monotonic()
+        assert [node.name for node in provider.children_for("/dir")] == [
+            "first"
+        ]
+        assert time.monotonic() - start < 1
+        entries.put(None)
+
+    def test_max_waiting(self):
+        entries = queue.Queue()
+        provider = ProgressiveProvider(
+            queue_producer(entries), wait_timeout=60, max_waiting=1
+        )
+        thread = threading.Thread(
+            target=lambda: provider.lookup_path("/waiting")
+        )
+        thread.start()
+        while provider._waiting < 1:
+            time.sleep(0.01)
+
+        # The lookup over the limit fails without waiting
+        start = time.monotonic()
+        assert provider.lookup_path("/missing") is None
+        assert time.monotonic() - start < 1
+
+        entries.put(None)
+        thread.join()
+        assert provider._waiting == 0
+
+    def test_complete_directories_do_not_wait(self):
+        entries = queue.Queue()
+        provider = ProgressiveProvider(
+            queue_producer(entries), wait_timeout=60
+        )
+        provider.add_entry("dir/file")
+        provider.mark_complete("/dir")
+
+        assert provider.lookup_path("/dir/missing") is None
+        assert provider.lookup_path("/dir/file/child") is None
+        entries.put(None)
+
+    def test_timeout(self):
+        entries = queue.Queue()
+        provider = ProgressiveProvider(
+            queue_producer(entries), wait_timeout=0.01
+        )
+        fs = TreeFuseFS(provider=provider)
+
+        assert fs.getattr("/missing") == -errno.ENOENT
+        # Listing what there is so far
+        assert [entry.name for entry in fs.readdir("/", 0)] == [".", ".."]
+        entries.put(None)
+
+    def test_populate_on_demand(self):
+        populated = []
+
+        def populate(path):
+            populated.append(path)
+            if path == "/":
+                return [("dir", (None, TreeFuseStat.for_directory()))]
+            return [("file", b"content")]
+
+        provider = ProgressiveProvider(populate=populate, wait_timeout=60)
+
+        assert provider.lookup_path("/dir/file").content == b"content"
+        assert [node.name for node in provider.children_for("/dir")] == [
+            "file"
+        ]
+        assert provider.lookup_path("/dir/missing") is None
+        assert populated == ["/", "/dir"]
+
+    def test_directory_stats(self):
+        provider = ProgressiveProvider(
+            [
+                ("dir", (None, TreeFuseStat.for_directory(0o700))),
+                ("dir/file", b"first"),
+                ("dir/file", b"duplicate"),
+            ]
+        )
+        provider.children_for("/")
+
+        node = provider.lookup_path("/dir")
+        assert node.is_directory
+        assert stat.S_IMODE(node.stat.st_mode) == 0o700
+        assert provider.lookup_path("/dir/file").content == b"first"
+
+    def test_empty_directory_stat(self):
+        provider = ProgressiveProvider(
+            [("empty", (None, TreeFuseStat.for_directory()))]
+        )
+
+        assert provider.lookup_path("/empty").is_directory
+        assert list(provider.children_for("/empty")) == []
+
+    def test_finished_lookups_do_not_lock(self):
+        provider = ProgressiveProvider(
+            ["dir/file"], wait_timeout=60, listing_timeout=60
+        )
+        provider.children_for("/")
+        assert provider.finished
+
+        class Unlockable:
+            def __enter__(self):
+                raise AssertionError("_condition taken")
+
+        provider._condition = Unlockable()
+        assert provider.lookup_path("/dir/file") is not None
+        assert provider.lookup_path("/dir/missing") is None
+        assert [node.name for node in provider.children_for("/dir")] == [
+            "file"
+        ]
+
+    def test_stat_without_mode(self):
+        provider = ProgressiveProvider(
+            [("file", (b"content", TreeFuseStat(st_mode=None)))]
+        )
+        provider.children_for("/")
+
+        node = provider.lookup_path("/file")
+        assert not node.is_directory
+        assert node.content == b"content"
+        assert provider.lookup_path("/file/missing") is None
+
+    def test_producer_error(self):
+        def producer():
+            yield "file"
+            raise RuntimeError("failed")
+
+        provider = ProgressiveProvider(
+            producer(), wait_timeout=60, listing_timeout=60
+        )
+
+        assert [node.name for node in provider.children_for("/")] == ["file"]
+        assert isinstance(provider.error, RuntimeError)
+
+    def test_producer_is_started_once_per_process(self, monkeypatch):
+        entries = queue.Queue()
+        provider = ProgressiveProvider(
+            queue_producer(entries), wait_timeout=0
+        )
+        starts = []
+        monkeypatch.setattr(
+            threading.Thread, "start", lambda thread: starts.append(thread)
+        )
+
+        provider.lookup_path("/")
+        provider.lookup_path("/other")
+        assert len(starts) == 1
+        monkeypatch.setattr(os, "getpid", lambda: -1)
+        provider.lookup_path("/")
+
+        assert len(starts) == 2
+
+    def test_invalid_arguments(self):
+        with pytest.raises(ValueError):
+            ProgressiveProvider(wait_timeout=-1)
+        with pytest.raises(ValueError):
+            ProgressiveProvider(listing_timeout=-1)
+        with pytest.raises(ValueError):
+            ProgressiveProvider(max_waiting=-1)
+        with pytest.raises(ValueError):
+            ProgressiveProvider(tree=treelib.Tree())
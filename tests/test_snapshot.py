@@ -0,0 +1,149 @@
+"""Tests for `treefuse.snapshot`."""
+
+import errno
+import os
+import stat
+from unittest import mock
+
+import pytest
+import treelib
+
+from treefuse import (
+    FileContent,
+    FrozenTreeProvider,
+    ProviderContent,
+    TreeFuseStat,
+)
+from treefuse.snapshot import SnapshotError, SnapshotProvider, compile_snapshot
+from treefuse.treefuse import TreeFuseFS
+
+
+@pytest.fixture
+def tree(tmp_path):
+    backing = tmp_path / "backing"
+    backing.write_bytes(b"0123456789")
+    tree = treelib.Tree()
+    root = tree.create_node("root")
+    dir1 = tree.create_node("dir1", parent=root)
+    tree.create_node("dirchild", parent=dir1, data=b"dirchild content")
+    tree.create_node(
+        "rootchild",
+        parent=root,
+        data=(
+            b"rootchild content",
+            TreeFuseStat.for_file_stat(st_uid=1000, st_mtime=1.5),
+        ),
+    )
+    tree.create_node(
+        "ondisk", parent=root, data=FileContent(str(backing), offset=2)
+    )
+    tree.create_node("view", parent=root, data=memoryview(b"view content"))
+    return tree
+
+
+@pytest.fixture
+def snapshot(tmp_path, tree):
+    path = tmp_path / "tree.snapshot"
+    compile_snapshot(tree, path)
+    return path
+
+
+class TestSnapshotProvider:
+    def test_matches_source(self, tree, snapshot):
+        provider = SnapshotProvider(snapshot)
+        expected = FrozenTreeProvider(tree)
+
+        assert len(provider) == len(expected) == 6
+        for path in ["/", "/dir1", "/dir1/dirchild", "/rootchild", "/view"]:
+            node, expected_node = (
+                provider.lookup_path(path),
+                expected.lookup_path(path),
+            )
+            assert node.name == expected_node.name
+            assert node.is_directory == expected_node.is_directory
+            assert bytes(node.content) == bytes(expected_node.content)
+        assert [node.name for node in provider.children_for("/")] == [
+            "dir1",
+            "ondisk",
+            "rootchild",
+            "view",
+        ]
+        assert provider.lookup_path("/missing") is None
+
+    def test_serves_filesystem(self, snapshot):
+        fs = TreeFuseFS(provider=SnapshotProvider(snapshot))
+
+        assert fs.getattr("/view").st_size == 12
+        assert fs.getattr("/ondisk").st_size == 8
+        assert fs.getattr("/missing") == -errno.ENOENT
+        fh = fs.open("/ondisk", os.O_RDONLY)
+        assert fs.read("/ondisk", 4, 1, fh) == b"3456"
+
+    def test_unpacked_stats(self, snapshot):
+        st = SnapshotProvider(snapshot).lookup_path("/rootchild").stat
+
+        assert (st.st_uid, st.st_mtime, st.st_size) == (1000, 1.5, None)
+        assert st.keep_cache is None
+
+    def test_generated_content_is_stored(self, tmp_path):
+        source = FrozenTreeProvider([("file", b"generated")])
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        tree.create_node(
+            "file", parent=root, data=ProviderContent(source, "/file")
+        )
+        path = tmp_path / "tree.snapshot"
+
+        compile_snapshot(tree, path)
+
+        node = SnapshotProvider(path).lookup_path("/file")
+        assert node.content == b"generated"
+
+    def test_unstorable_content(self, tmp_path):
+        with pytest.raises(TypeError):
+            compile_snapshot([("file", object())], tmp_path / "tree.snapshot")
+        assert os.listdir(tmp_path) == []
+
+    def test_mode_follows_umask(self, tmp_path, tree):
+        umask = os.umask(0o027)
+        try:
+            # (Without changing the process's umask, even briefly)
+            with mock.patch("os.umask", side_effect=AssertionError):
+                compile_snapshot(tree, tmp_path / "tree.snapshot")
+        finally:
+            os.umask(umask)
+
+        assert stat.S_IMODE(os.stat(tmp_path / "tree.snapshot").st_mode) == (
+            0o640
+        )
+
+    def test_recompiling_leaves_mapping_intact(self, tmp_path, snapshot):
+        provider = SnapshotProvider(snapshot)
+
+        compile_snapshot([("new", b"new content")], snapshot)
+
+        assert provider.lookup_path("/dir1/dirchild").content == (
+            b"dirchild content"
+        )
+        assert SnapshotProvider(snapshot).lookup_path("/new").content == (
+            b"new content"
+        )
+
+    def test_close(self, snapshot):
+        provider = SnapshotProvider(snapshot)
+        content = provider.lookup_path("/view").content
+
+        provider.close()
+
+        assert content == b"view content"
+        content.release()
+
+    @pytest.mark.parametrize(
+        "data", [b"", b"not a snapshot" * 100, b"TFSNAPSH" + bytes(200)]
+    )
+    def test_invalid_snapshots(self, tmp_path, data):
+        path = tmp_path / "invalid"
+        path.write_bytes(data)
+
+        with pytest.raises(SnapshotError):
+            SnapshotProvider(path)
@@ -0,0 +1,335 @@
+"""Tests for `treefuse.sqlite`."""
+
+import errno
+import os
+import stat
+import threading
+from unittest import mock
+
+import psutil
+import pytest
+import treelib
+
+from treefuse import (
+    FileContent,
+    FrozenTreeProvider,
+    ProviderContent,
+    SQLiteProvider,
+    TreeFuseContent,
+    TreeFuseStat,
+    compile_sqlite,
+)
+from treefuse.sqlite import _BATCH_SIZE, SQLiteTreeError
+from treefuse.treefuse import TreeFuseFS
+
+from .test_treefuse import mount_tree  # noqa: F401 (a fixture)
+
+
+def read_content(node):
+    content = node.content
+    if isinstance(content, TreeFuseContent):
+        return bytes(content.read(0, content.size))
+    return bytes(content)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    backing = tmp_path / "backing"
+    backing.write_bytes(b"0123456789")
+    tree = treelib.Tree()
+    root = tree.create_node("root")
+    dir1 = tree.create_node(
+        "dir1", parent=root, data=(None, TreeFuseStat.for_directory(0o700))
+    )
+    tree.create_node("dirchild", parent=dir1, data=b"dirchild content")
+    tree.create_node(
+        "rootchild",
+        parent=root,
+        data=(
+            b"rootchild content",
+            TreeFuseStat.for_file_stat(
+                st_uid=1000, st_mtime=1.5, st_ino=42, st_dev=7
+            ),
+        ),
+    )
+    tree.create_node(
+        "ondisk", parent=root, data=FileContent(str(backing), offset=2)
+    )
+    tree.create_node("empty", parent=root)
+    return tree
+
+
+@pytest.fixture
+def database(tmp_path, tree):
+    path = tmp_path / "tree.sqlite"
+    compile_sqlite(tree, path)
+    return path
+
+
+@pytest.fixture
+def provider(database):
+    provider = SQLiteProvider(database)
+    yield provider
+    provider.close()
+
+
+class TestSQLiteProvider:
+    def test_matches_frozen_provider(self, tree, provider):
+        expected = FrozenTreeProvider(tree)
+
+        for path in ["/", "/dir1", "/dir1/dirchild", "/rootchild", "/empty"]:
+            node, expected_node = (
+                provider.lookup_path(path),
+                expected.lookup_path(path),
+            )
+            assert node.name == expected_node.name
+            assert node.is_directory == expected_node.is_directory
+            assert node.stat.st_mode == expected_node.stat.st_mode
+            if not node.is_directory:
+                assert read_content(node) == read_content(expected_node)
+        assert [node.name for node in provider.children_for("/")] == [
+            "dir1",
+            "empty",
+            "ondisk",
+            "rootchild",
+        ]
+        assert provider.lookup_path("/missing") is None
+        assert provider.lookup_path("/dir1/missing/deeper") is None
+        assert list(provider.children_for("/rootchild")) == []
+
+    def test_serves_filesystem(self, provider):
+        fs = TreeFuseFS(provider=provider)
+
+        assert stat.S_IMODE(fs.getattr("/dir1").st_mode) == 0o700
+        assert fs.getattr("/rootchild").st_size == 17
+        assert fs.getattr("/ondisk").st_size == 8
+        assert fs.getattr("/empty").st_size == 0
+        assert fs.getattr("/missing") == -errno.ENOENT
+        fh = fs.open("/rootchild", os.O_RDONLY)
+        assert bytes(fs.read("/rootchild", 7, 10, fh)) == b"content"
+        fh = fs.open("/ondisk", os.O_RDONLY)
+        assert bytes(fs.read("/ondisk", 4, 1, fh)) == b"3456"
+
+    def test_stats(self, provider):
+        st = provider.lookup_path("/rootchild").stat
+
+        assert (st.st_uid, st.st_mtime, st.st_size) == (1000, 1.5, 17)
+        assert (st.st_ino, st.st_dev) == (42, 7)
+        assert st.keep_cache is None
+        assert provider.size_of("/dir1/dirchild") == 16
+
+    def test_stat_children(self, provider):
+        children = dict(provider.stat_children("/"))
+
+        assert sorted(children) == ["dir1", "empty", "ondisk", "rootchild"]
+        assert stat.S_ISDIR(children["dir1"].st_mode)
+        assert children["ondisk"].st_size == 8
+        assert children["rootchild"].st_size == 17
+
+    def test_stat_children_is_one_query(self, tmp_path, monkeypatch):
+        path = tmp_path / "tree.sqlite"
+        count = _BATCH_SIZE * 2 + 1
+        compile_sqlite(("dir/{:05}".format(i) for i in range(count)), path)
+        provider = SQLiteProvider(path)
+        statements = []
+        open_connection = provider._open
+
+        def traced_open():
+            connection = open_connection()
+            connection.set_trace_callback(statements.append)
+            return connection
+
+        monkeypatch.setattr(provider, "_open", traced_open)
+        provider.close()
+
+        children = provider.stat_children("/dir")
+
+        assert len(children) == count
+        assert len([s for s in statements if "ORDER BY" in s]) == 1
+
+    @pytest.mark.parametrize("blob_io", [True, False])
+    def test_range_reads(self, tmp_path, blob_io, monkeypatch):
+        content = bytes(range(256)) * 64
+        path = tmp_path / "tree.sqlite"
+        compile_sqlite([("file", content)], path)
+        provider = SQLiteProvider(path)
+        if not blob_io:
+            monkeypatch.setattr(provider, "_blob_io", False)
+        elif not provider._blob_io:
+            pytest.skip("sqlite3 doesn't support blob I/O")
+
+        node = provider.lookup_path("/file")
+
+        assert node.content.size == len(content)
+        assert bytes(node.content.read(1000, 100)) == content[1000:1100]
+        assert bytes(node.content.read(len(content) - 10, 100)) == (
+            content[-10:]
+        )
+        assert node.content.read(len(content), 100) == b""
+
+    def test_large_directory_is_listed_in_batches(self, tmp_path):
+        names = ["file{:05}".format(i) for i in range(_BATCH_SIZE * 2 + 10)]
+        path = tmp_path / "tree.sqlite"
+        compile_sqlite(("dir/" + name for name in names), path)
+        provider = SQLiteProvider(path)
+
+        assert [node.name for node in provider.children_for("/dir")] == names
+        assert [
+            node.name for node in provider.iter_children("/dir", _BATCH_SIZE)
+        ] == names[_BATCH_SIZE:]
+
+    def test_entries(self, tmp_path):
+        path = tmp_path / "tree.sqlite"
+        compile_sqlite(
+            [
+                ("a/b/file", b"content"),
+                "a/other",
+                ("a/b/file", b"duplicate"),
+                ("a", (None, TreeFuseStat.for_directory(0o700))),
+                ("a/empty", b""),
+                ("a/empty", b"not empty"),
+                "a/other",
+                ("a/other", b"given later"),
+            ],
+            path,
+        )
+        provider = SQLiteProvider(path)
+
+        assert read_content(provider.lookup_path("/a/b/file")) == b"content"
+        assert provider.is_directory("/a/b")
+        assert not provider.is_directory("/a/other")
+        assert stat.S_IMODE(provider.lookup_path("/a").stat.st_mode) == 0o700
+        # Data given after a node is added without any is used, but empty
+        # files' content isn't replaced
+        assert read_content(provider.lookup_path("/a/empty")) == b""
+        assert provider.lookup_path("/a/empty").stat.st_size == 0
+        assert read_content(provider.lookup_path("/a/other")) == b"given later"
+
+    def test_generated_content_is_stored(self, tmp_path):
+        source = FrozenTreeProvider([("file", b"generated")])
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        tree.create_node(
+            "file", parent=root, data=ProviderContent(source, "/file")
+        )
+        path = tmp_path / "tree.sqlite"
+
+        compile_sqlite(tree, path)
+
+        node = SQLiteProvider(path).lookup_path("/file")
+        assert read_content(node) == b"generated"
+
+    def test_unstorable_content(self, tmp_path):
+        with pytest.raises(TypeError):
+            compile_sqlite([("file", object())], tmp_path / "tree.sqlite")
+        assert os.listdir(tmp_path) == []
+
+    def test_mode_follows_umask(self, tmp_path, tree):
+        umask = os.umask(0o027)
+        try:
+            # (Without changing the process's umask, even briefly)
+            with mock.patch("os.umask", side_effect=AssertionError):
+                compile_sqlite(tree, tmp_path / "tree.sqlite")
+        finally:
+            os.umask(umask)
+
+        assert stat.S_IMODE(os.stat(tmp_path / "tree.sqlite").st_mode) == (
+            0o640
+        )
+
+    def test_recompiling_leaves_provider_intact(self, database, provider):
+        compile_sqlite([("new", b"new content")], database)
+
+        assert read_content(provider.lookup_path("/dir1/dirchild")) == (
+            b"dirchild content"
+        )
+        assert SQLiteProvider(database).lookup_path("/new") is not None
+
+    def test_connection_pool(self, provider):
+        results = []
+        barrier = threading.Barrier(4)
+
+        def lookup():
+            barrier.wait()
+            for _ in range(10):
+                results.append(provider.lookup_path("/dir1/dirchild").name)
+
+        threads = [threading.Thread(target=lookup) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == ["dirchild"] * 40
+        assert 1 <= len(provider._connections) <= 4
+        provider.close()
+        assert provider._connections == []
+        assert provider.lookup_path("/dir1").is_directory
+
+    def test_max_connections(self, database):
+        provider = SQLiteProvider(database, max_connections=1)
+        results = []
+
+        def lookup():
+            results.append(provider.lookup_path("/rootchild").name)
+
+        with provider._connection():
+            # The only connection is in use, so this waits for it
+            thread = threading.Thread(target=lookup)
+            thread.start()
+            thread.join(0.1)
+            assert results == []
+        thread.join()
+
+        assert results == ["rootchild"]
+        assert len(provider._connections) == 1
+        with pytest.raises(ValueError):
+            SQLiteProvider(database, max_connections=0)
+
+    def test_connections_are_reopened_after_fork(self, provider, monkeypatch):
+        provider.lookup_path("/")
+        monkeypatch.setattr(os, "getpid", lambda: -1)
+
+        provider.lookup_path("/")
+
+        assert len(provider._connections) == 1
+
+    def test_mounted_connections_are_bounded(
+        self, tmp_path, tmp_path_factory, mount_tree  # noqa: F811
+    ):
+        # (Not in tmp_path, which the filesystem is mounted over)
+        database = tmp_path_factory.mktemp("database") / "tree.sqlite"
+        compile_sqlite(
+            (("file{}".format(i), b"content") for i in range(50)), database
+        )
+
+        mount_tree(SQLiteProvider(database, max_connections=4))
+        for _ in range(5):
+            for i in range(50):
+                assert (tmp_path / "file{}".format(i)).read_bytes() == (
+                    b"content"
+                )
+
+        opened = 0
+        for process in psutil.process_iter():
+            if process.pid == os.getpid():
+                continue
+            try:
+                files = process.open_files()
+            except psutil.Error:
+                continue
+            opened += sum(file.path == str(database) for file in files)
+        # (Plus the connection which checked the database before the fork)
+        assert 1 <= opened <= 5
+
+    @pytest.mark.parametrize("data", [b"", b"not a database" * 100])
+    def test_invalid_databases(self, tmp_path, data):
+        path = tmp_path / "invalid"
+        path.write_bytes(data)
+
+        with pytest.raises(SQLiteTreeError):
+            SQLiteProvider(path)
+
+    def test_missing_database(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            SQLiteProvider(tmp_path / "missing")
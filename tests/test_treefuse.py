@@ -18,20 +18,42 @@ TODO:
   failures with more granularity.
 """
 
+import array
+import asyncio
+import concurrent.futures
 import errno
+import itertools
+import json
 import multiprocessing
 import os
 import stat
 import subprocess
+import threading
 import time
 import warnings
+from typing import Any, Union
 from unittest import mock
 
 import psutil
 import pytest
 import treelib
 
-from treefuse import TreeFuseStat, treefuse_main
+from treefuse import (
+    AsyncTreeFuseProvider,
+    FileContent,
+    ProviderContent,
+    TreeFuseNode,
+    TreeFuseProvider,
+    TreeFuseStat,
+    treefuse_main,
+)
+from treefuse.treefuse import (
+    AsyncProviderBridge,
+    TreeFuseFS,
+    TreelibProvider,
+    _ReadWriteLock,
+    _stat_for,
+)
 
 
 @pytest.fixture
@@ -47,11 +69,15 @@ def mount_tree(tmp_path):
     process = None
     skip_umount = False
 
-    def _mounter(tree: treelib.Tree) -> None:
+    def _mounter(
+        tree: Union[treelib.Tree, TreeFuseProvider], **options: Any
+    ) -> None:
         nonlocal process, skip_umount
         # Run treefuse_main in a separate process so we can continue test
         # execution in this one
-        process = multiprocessing.Process(target=treefuse_main, args=(tree,))
+        process = multiprocessing.Process(
+            target=treefuse_main, args=(tree,), kwargs=options
+        )
         with mock.patch("sys.argv", ["_test_", str(tmp_path)]):
             process.start()
         # As FUSE initialisation is happening in the background, we wait until
@@ -134,6 +160,54 @@ class TestValidTreesWithoutStat:
 
         assert tmp_path.joinpath("rootchild").read_text() == ""
 
+    def test_buffer_file_tree(self, mount_tree, tmp_path):
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        tree.create_node(
+            "rootchild", parent=root, data=bytearray(b"rootchild content")
+        )
+
+        mount_tree(tree)
+
+        assert (
+            tmp_path.joinpath("rootchild").read_text() == "rootchild content"
+        )
+
+    def test_file_content_tree(self, mount_tree, tmp_path, tmp_path_factory):
+        backing_file = tmp_path_factory.mktemp("backing") / "backing"
+        backing_file.write_bytes(b"xxrootchild contentxx")
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        tree.create_node(
+            "rootchild",
+            parent=root,
+            data=FileContent(backing_file, offset=2, length=17),
+        )
+
+        mount_tree(tree)
+
+        assert (
+            tmp_path.joinpath("rootchild").read_text() == "rootchild content"
+        )
+
+    def test_large_directory(self, mount_tree, tmp_path):
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        dir1 = tree.create_node("dir1", parent=root)
+        names = set()
+        for i in range(5000):
+            name = "file-with-a-longish-name-{}".format(i)
+            names.add(name)
+            tree.create_node(name, parent=root)
+        tree.create_node("dirchild", parent=dir1)
+
+        mount_tree(tree)
+
+        with os.scandir(tmp_path) as entries:
+            listing = {entry.name: entry.is_dir() for entry in entries}
+        assert listing.pop("dir1") is True
+        assert listing == {name: False for name in names}
+
     def test_basic_tree(self, mount_tree, tmp_path):
         """Test we can mount a basic tree structure."""
         tree = treelib.Tree()
@@ -219,3 +293,920 @@ class TestValidTreesWithInvalidNodes:
 
         exception = exc_info.value
         assert errno.EILSEQ == exception.errno
+
+
+class TestTreelibProvider:
+    """In-process tests for ``TreelibProvider``; these don't mount anything."""
+
+    @pytest.fixture
+    def tree(self):
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        dir1 = tree.create_node("dir1", parent=root)
+        tree.create_node("dirchild", parent=dir1, data=b"dirchild content")
+        tree.create_node("rootchild", parent=root, data=b"rootchild content")
+        return tree
+
+    def test_lookup_path(self, tree):
+        provider = TreelibProvider(tree)
+
+        assert provider.lookup_path("/").name == "root"
+        assert provider.lookup_path("/dir1").name == "dir1"
+        node = provider.lookup_path("/dir1/dirchild")
+        assert node.name == "dirchild"
+        assert node.content == b"dirchild content"
+        assert provider.lookup_path("/missing") is None
+        assert provider.lookup_path("/rootchild/missing") is None
+
+    def test_children_for(self, tree):
+        provider = TreelibProvider(tree)
+
+        assert [node.name for node in provider.children_for("/")] == [
+            "dir1",
+            "rootchild",
+        ]
+        assert list(provider.children_for("/rootchild")) == []
+
+    def test_add_node(self, tree):
+        provider = TreelibProvider(tree)
+
+        provider.add_node("/dir1", "newdir")
+        provider.add_node("/dir1/newdir", "newfile", data=b"new content")
+
+        assert provider.lookup_path("/dir1/newdir/newfile").content == (
+            b"new content"
+        )
+        assert [node.name for node in provider.children_for("/dir1")] == [
+            "dirchild",
+            "newdir",
+        ]
+        assert len(tree) == 6
+
+    def test_add_node_errors(self, tree):
+        provider = TreelibProvider(tree)
+
+        with pytest.raises(ValueError):
+            provider.add_node("/missing", "newfile")
+        with pytest.raises(ValueError):
+            provider.add_node("/", "rootchild")
+
+    def test_remove_node(self, tree):
+        provider = TreelibProvider(tree)
+
+        provider.remove_node("/dir1")
+
+        assert provider.lookup_path("/dir1") is None
+        assert provider.lookup_path("/dir1/dirchild") is None
+        assert [node.name for node in provider.children_for("/")] == [
+            "rootchild"
+        ]
+        assert len(tree) == 2
+
+    def test_remove_node_errors(self, tree):
+        provider = TreelibProvider(tree)
+
+        with pytest.raises(ValueError):
+            provider.remove_node("/missing")
+        with pytest.raises(ValueError):
+            provider.remove_node("/")
+
+    def test_replace_node(self, tree):
+        provider = TreelibProvider(tree)
+        changes = []
+        provider.add_change_callback(changes.append)
+
+        provider.replace_node("/rootchild", b"replaced content")
+
+        assert provider.lookup_path("/rootchild").content == (
+            b"replaced content"
+        )
+        assert changes == ["/rootchild"]
+        with pytest.raises(ValueError):
+            provider.replace_node("/missing", b"")
+
+    def test_swap_tree(self, tree):
+        provider = TreelibProvider(tree)
+        changes = []
+        provider.add_change_callback(changes.append)
+        dirchild_data = provider.lookup_path("/dir1/dirchild").content
+
+        new_tree = treelib.Tree()
+        root = new_tree.create_node("root")
+        dir1 = new_tree.create_node("dir1", parent=root)
+        new_tree.create_node("dirchild", parent=dir1, data=dirchild_data)
+        dir2 = new_tree.create_node("dir2", parent=root)
+        new_tree.create_node("dir2child", parent=dir2, data=b"new")
+        new_tree.create_node("rootchild", parent=root, data=b"changed")
+
+        changed = provider.swap_tree(new_tree)
+
+        # Only the top of the added subtree, and the changed file, are
+        # reported: unchanged nodes are not.
+        assert sorted(changed) == ["/dir2", "/rootchild"]
+        assert sorted(changes) == sorted(changed)
+        assert provider.lookup_path("/dir2/dir2child").content == b"new"
+        assert provider.lookup_path("/rootchild").content == b"changed"
+
+        assert provider.swap_tree(tree) == ["/rootchild", "/dir2"]
+        assert provider.lookup_path("/dir2") is None
+
+    def test_swap_tree_reports_kind_changes(self, tree):
+        provider = TreelibProvider(tree)
+
+        rootchild_data = provider.lookup_path("/rootchild").content
+
+        new_tree = treelib.Tree()
+        root = new_tree.create_node("root")
+        new_tree.create_node("dir1", parent=root)
+        new_tree.create_node("rootchild", parent=root, data=rootchild_data)
+
+        assert sorted(provider.swap_tree(new_tree)) == [
+            "/dir1",
+            "/dir1/dirchild",
+        ]
+        assert not provider.is_directory("/dir1")
+
+    def test_is_directory(self, tree):
+        provider = TreelibProvider(tree)
+
+        assert provider.is_directory("/")
+        assert provider.is_directory("/dir1")
+        assert not provider.is_directory("/rootchild")
+        assert provider.lookup_path("/dir1").is_directory is True
+        assert provider.lookup_path("/rootchild").is_directory is False
+
+
+class _StatChildrenProvider(TreelibProvider):
+    """A TreelibProvider which returns its children's stats in one go."""
+
+    def stat_children(self, path):
+        return [
+            (child.name, _stat_for(child, bool(child.is_directory)))
+            for child in self.iter_children(path)
+        ]
+
+
+class TestTreeFuseFS:
+    """In-process tests for ``TreeFuseFS``; these don't mount anything."""
+
+    @pytest.fixture
+    def tree(self):
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        dir1 = tree.create_node("dir1", parent=root)
+        tree.create_node("dirchild", parent=dir1, data=b"dirchild content")
+        tree.create_node("rootchild", parent=root, data=b"rootchild content")
+        return tree
+
+    @pytest.fixture
+    def provider(self, tree):
+        return TreelibProvider(tree)
+
+    @pytest.fixture
+    def stat_provider(self, tree):
+        return _StatChildrenProvider(tree)
+
+    @pytest.fixture
+    def fs(self, provider):
+        return TreeFuseFS(provider=provider)
+
+    def test_getattr_does_not_list_children(self, fs, provider):
+        with mock.patch.object(provider, "children_for") as m_children_for:
+            dir_stat = fs.getattr("/dir1")
+            file_stat = fs.getattr("/rootchild")
+
+        assert stat.S_ISDIR(dir_stat.st_mode)
+        assert stat.S_ISREG(file_stat.st_mode)
+        assert file_stat.st_size == len(b"rootchild content")
+        assert m_children_for.call_count == 0
+
+    def test_getattr_looks_up_path_once(self, fs, provider):
+        with mock.patch.object(
+            provider, "lookup_path", wraps=provider.lookup_path
+        ) as m_lookup_path:
+            fs.getattr("/dir1/dirchild")
+
+        assert m_lookup_path.call_count == 1
+
+    def test_getattr_falls_back_to_provider_is_directory(self, fs, provider):
+        node = TreeFuseNode("dir1", None)
+        with mock.patch.object(provider, "lookup_path", return_value=node):
+            st = fs.getattr("/dir1")
+
+        assert stat.S_ISDIR(st.st_mode)
+
+    def test_getattr_missing(self, fs):
+        assert fs.getattr("/missing") == -errno.ENOENT
+
+    def test_negative_lookups_are_cached(self, fs, provider):
+        with mock.patch.object(
+            provider, "lookup_path", wraps=provider.lookup_path
+        ) as m_lookup_path:
+            for _ in range(3):
+                assert fs.getattr("/.git") == -errno.ENOENT
+                assert fs.open("/.git", os.O_RDONLY) == -errno.ENOENT
+
+        assert m_lookup_path.call_count == 1
+        assert fs._negative_cache.hits == 5
+
+    def test_negative_cache_invalidated_by_mutation(self, fs, provider):
+        assert fs.getattr("/newdir") == -errno.ENOENT
+        assert fs.getattr("/newdir/newfile") == -errno.ENOENT
+
+        provider.add_node("/", "newdir")
+        provider.add_node("/newdir", "newfile", data=b"new")
+
+        assert stat.S_ISDIR(fs.getattr("/newdir").st_mode)
+        assert fs.getattr("/newdir/newfile").st_size == 3
+
+    def test_negative_cache_is_bounded(self, provider):
+        fs = TreeFuseFS(provider=provider, negative_cache_size=2)
+
+        for name in ["a", "b", "c", "b"]:
+            fs.getattr("/" + name)
+
+        assert list(fs._negative_cache._paths) == ["/c", "/b"]
+
+    def test_negative_cache_disabled(self, provider):
+        fs = TreeFuseFS(provider=provider, negative_cache_size=0)
+
+        fs.getattr("/missing")
+
+        assert len(fs._negative_cache) == 0
+
+    def test_readdir(self, fs):
+        entries = list(fs.readdir("/", 0))
+
+        assert [(e.name, e.type, e.offset) for e in entries] == [
+            (".", stat.S_IFDIR, 1),
+            ("..", stat.S_IFDIR, 2),
+            ("dir1", stat.S_IFDIR, 3),
+            ("rootchild", stat.S_IFREG, 4),
+        ]
+
+    @pytest.mark.parametrize("offset", [1, 2, 3, 4])
+    def test_readdir_resumes_from_offset(self, fs, offset):
+        all_entries = [e.name for e in fs.readdir("/", 0)]
+
+        entries = [e.name for e in fs.readdir("/", offset)]
+
+        assert entries == all_entries[offset:]
+
+    def test_readdir_errors(self, fs):
+        assert fs.readdir("/missing", 0) == -errno.ENOENT
+        assert fs.readdir("/rootchild", 0) == -errno.ENOTDIR
+
+    def test_readdir_is_lazy(self, fs, provider):
+        for i in range(1000):
+            provider.add_node("/dir1", "file{}".format(i))
+
+        with mock.patch.object(
+            provider,
+            "_treelib_node_to_treefusenode",
+            wraps=provider._treelib_node_to_treefusenode,
+        ) as m_to_treefusenode:
+            entries = fs.readdir("/dir1", 500)
+            names = [next(entries).name for _ in range(10)]
+
+        assert names == ["file{}".format(i) for i in range(497, 507)]
+        # One for /dir1 itself, and one for each child we consumed
+        assert m_to_treefusenode.call_count == 11
+
+    def test_resumed_readdirs_index_into_directory(self, fs, provider):
+        for i in range(1000):
+            provider.add_node("/dir1", "file{}".format(i))
+
+        names = []
+        with mock.patch.object(
+            provider,
+            "_treelib_node_to_treefusenode",
+            wraps=provider._treelib_node_to_treefusenode,
+        ) as m_to_treefusenode:
+            for offset in range(0, 1003, 100):
+                entries = fs.readdir("/dir1", offset)
+                names.extend(
+                    entry.name for entry in itertools.islice(entries, 100)
+                )
+
+        assert names[3:] == ["file{}".format(i) for i in range(1000)]
+        # One for /dir1 itself per readdir, and one for each child consumed
+        assert m_to_treefusenode.call_count == 11 + 1001
+        # The children were listed once, and their list reused until they
+        # changed
+        children = provider._child_lists["/dir1"]
+        assert [e.name for e in fs.readdir("/dir1", 1002)] == ["file999"]
+        assert provider._child_lists["/dir1"] is children
+        provider.add_node("/dir1", "new")
+        assert "/dir1" not in provider._child_lists
+        assert [e.name for e in fs.readdir("/dir1", 1003)] == ["new"]
+
+    def test_first_readdir_batch_is_lazy(self, fs, provider):
+        for i in range(1000):
+            provider.add_node("/dir1", "file{}".format(i))
+
+        with mock.patch.object(
+            provider,
+            "_treelib_node_to_treefusenode",
+            wraps=provider._treelib_node_to_treefusenode,
+        ) as m_to_treefusenode:
+            entries = fs.readdir("/dir1", 0)
+            names = [next(entries).name for _ in range(12)]
+
+        assert names == [".", "..", "dirchild"] + [
+            "file{}".format(i) for i in range(9)
+        ]
+        # One for /dir1 itself, and one for each child we consumed
+        assert m_to_treefusenode.call_count == 11
+
+    def test_readdir_stats_children_for_getattr(self, stat_provider):
+        fs = TreeFuseFS(provider=stat_provider)
+        list(fs.readdir("/", 0))
+
+        with mock.patch.object(stat_provider, "lookup_path") as m_lookup_path:
+            dir_stat = fs.getattr("/dir1")
+            file_stat = fs.getattr("/rootchild")
+
+        assert stat.S_ISDIR(dir_stat.st_mode)
+        assert stat.S_ISREG(file_stat.st_mode)
+        assert file_stat.st_size == len(b"rootchild content")
+        assert m_lookup_path.call_count == 0
+        assert fs._child_stats.hits == 2
+
+    def test_resumed_readdir_uses_stats_children(self, stat_provider):
+        fs = TreeFuseFS(provider=stat_provider)
+        list(fs.readdir("/", 0))
+
+        with mock.patch.object(
+            stat_provider, "stat_children"
+        ) as m_stat_children:
+            entries = [e.name for e in fs.readdir("/", 3)]
+
+        assert entries == ["rootchild"]
+        assert m_stat_children.call_count == 0
+
+    def test_stat_children_expire(self, stat_provider):
+        fs = TreeFuseFS(provider=stat_provider)
+        list(fs.readdir("/", 0))
+        assert len(fs._child_stats) == 1
+
+        later = time.monotonic() + 2
+        with mock.patch(
+            "treefuse.treefuse.time.monotonic", return_value=later
+        ), mock.patch.object(
+            stat_provider, "lookup_path", wraps=stat_provider.lookup_path
+        ) as m_lookup_path:
+            fs.getattr("/rootchild")
+
+        assert m_lookup_path.call_count == 1
+        assert len(fs._child_stats) == 0
+
+    def test_stat_children_disabled(self, stat_provider):
+        fs = TreeFuseFS(provider=stat_provider, stat_children_ttl=0)
+
+        with mock.patch.object(
+            stat_provider, "stat_children"
+        ) as m_stat_children:
+            entries = [e.name for e in fs.readdir("/", 0)]
+
+        assert entries == [".", "..", "dir1", "rootchild"]
+        assert m_stat_children.call_count == 0
+
+    def test_read(self, fs):
+        assert fs.read("/rootchild", 4, 0) == b"root"
+        assert fs.read("/rootchild", 100, 4) == b"child content"
+        assert fs.read("/rootchild", 4, 100) == b""
+        assert fs.read("/dir1", 4, 0) == -errno.EISDIR
+        assert fs.read("/missing", 4, 0) == -errno.ENOENT
+
+    def test_open_returns_handle_used_by_read(self, fs, provider):
+        fh = fs.open("/dir1/dirchild", os.O_RDONLY)
+        with mock.patch.object(provider, "lookup_path") as m_lookup_path:
+            assert fs.read("/dir1/dirchild", 8, 0, fh) == b"dirchild"
+            assert fs.read("/dir1/dirchild", 100, 9, fh) == b"content"
+            assert fs.flush("/dir1/dirchild", fh) == 0
+            assert fs.release("/dir1/dirchild", os.O_RDONLY, fh) == 0
+
+        assert m_lookup_path.call_count == 0
+
+    def test_open_errors(self, fs):
+        assert fs.open("/missing", os.O_RDONLY) == -errno.ENOENT
+        assert fs.open("/rootchild", os.O_RDWR) == -errno.EACCES
+
+    @pytest.mark.parametrize(
+        "content",
+        [
+            bytearray(b"buffer content"),
+            memoryview(b"buffer content"),
+            memoryview(b"xxbuffer contentxx")[2:-2],
+            array.array("B", b"buffer content"),
+        ],
+    )
+    def test_buffer_content(self, provider, fs, content):
+        provider.add_node("/", "buffer", data=content)
+
+        assert fs.getattr("/buffer").st_size == len(b"buffer content")
+        fh = fs.open("/buffer", os.O_RDONLY)
+        buf = fs.read("/buffer", 6, 0, fh)
+        assert isinstance(buf, memoryview)
+        assert buf == b"buffer"
+        assert fs.read("/buffer", 100, 7, fh) == b"content"
+        fs.release("/buffer", os.O_RDONLY, fh)
+
+    def test_multibyte_buffer_content(self, provider, fs):
+        provider.add_node("/", "buffer", data=array.array("I", [1, 2]))
+
+        assert fs.getattr("/buffer").st_size == 8
+        assert len(fs.read("/buffer", 100, 0)) == 8
+
+    def test_nonbuffer_content(self, provider, fs):
+        provider.add_node("/", "str", data="not bytes!")
+
+        assert fs.read("/str", 100, 0) == -errno.EILSEQ
+
+
+class _GeneratingProvider(TreeFuseProvider):
+    """A provider whose single file's content is generated on demand."""
+
+    SIZE = 10 ** 9
+
+    def __init__(self):
+        self.read_range_calls = []
+
+    def children_for(self, path):
+        if path == "/":
+            return [self.lookup_path("/generated")]
+        return []
+
+    def lookup_path(self, path):
+        if path == "/":
+            return TreeFuseNode("root", None, is_directory=True)
+        if path == "/generated":
+            return TreeFuseNode(
+                "generated", ProviderContent(self, path), is_directory=False
+            )
+        return None
+
+    def size_of(self, path):
+        return self.SIZE
+
+    def read_range(self, path, offset, size):
+        self.read_range_calls.append((offset, size))
+        size = max(min(size, self.SIZE - offset), 0)
+        return bytes(i % 256 for i in range(offset, offset + size))
+
+
+class TestLazyContent:
+    def test_getattr_does_not_read(self):
+        provider = _GeneratingProvider()
+        fs = TreeFuseFS(provider=provider)
+
+        assert fs.getattr("/generated").st_size == _GeneratingProvider.SIZE
+        assert provider.read_range_calls == []
+
+    def test_read_requests_only_the_range(self):
+        provider = _GeneratingProvider()
+        fs = TreeFuseFS(provider=provider)
+
+        fh = fs.open("/generated", os.O_RDONLY)
+        assert fs.read("/generated", 4, 254, fh) == bytes([254, 255, 0, 1])
+
+        assert provider.read_range_calls == [(254, 4)]
+
+    def test_default_size_of_and_read_range(self):
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        tree.create_node("rootchild", parent=root, data=b"rootchild content")
+        provider = TreelibProvider(tree)
+
+        assert provider.size_of("/rootchild") == 17
+        assert provider.read_range("/rootchild", 4, 5) == b"child"
+        assert provider.read_range("/rootchild", 100, 5) == b""
+
+    def test_mount_provider(self, mount_tree, tmp_path):
+        mount_tree(_GeneratingProvider())
+
+        with tmp_path.joinpath("generated").open("rb") as f:
+            assert f.read(4) == bytes([0, 1, 2, 3])
+        assert (
+            tmp_path.joinpath("generated").stat().st_size
+            == _GeneratingProvider.SIZE
+        )
+
+
+class _SlowAsyncProvider(AsyncTreeFuseProvider):
+    """A fake async backend, which takes ``latency`` seconds to respond."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.names = ["file{}".format(i) for i in range(10)]
+
+    async def children_for(self, path):
+        await asyncio.sleep(self.latency)
+        if path == "/":
+            return [await self.lookup_path("/" + name) for name in self.names]
+        return []
+
+    async def lookup_path(self, path):
+        await asyncio.sleep(self.latency)
+        if path == "/":
+            return TreeFuseNode("root", None, is_directory=True)
+        name = path.lstrip("/")
+        if name in self.names:
+            return TreeFuseNode(
+                name, ProviderContent(self, path), is_directory=False
+            )
+        return None
+
+    async def size_of(self, path):
+        return len(path)
+
+    async def read_range(self, path, offset, size):
+        await asyncio.sleep(self.latency)
+        return path.encode()[offset:offset + size]
+
+
+class TestAsyncProvider:
+    @pytest.fixture
+    def fs(self):
+        fs = TreeFuseFS(provider=_SlowAsyncProvider(latency=0.2))
+        yield fs
+        fs._provider.close()
+
+    def test_operations(self, fs):
+        assert isinstance(fs._provider, AsyncProviderBridge)
+        assert stat.S_ISDIR(fs.getattr("/").st_mode)
+        assert fs.getattr("/file1").st_size == len("/file1")
+        assert fs.getattr("/missing") == -errno.ENOENT
+        fh = fs.open("/file1", os.O_RDONLY)
+        assert fs.read("/file1", 4, 1, fh) == b"file"
+        assert [
+            entry.name for entry in fs.readdir("/", 0)
+        ] == [".", ".."] + fs._provider.provider.names
+
+    def test_concurrent_lookups_overlap(self, fs):
+        # Start the loop, so we don't time its startup
+        fs.getattr("/")
+
+        start = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(10) as executor:
+            results = list(
+                executor.map(
+                    fs.getattr, ["/file{}".format(i) for i in range(10)]
+                )
+            )
+        elapsed = time.monotonic() - start
+
+        assert all(stat.S_ISREG(st.st_mode) for st in results)
+        # Serialised, these would take 10 * 0.2s
+        assert elapsed < 1
+
+    def test_close_and_restart(self, fs):
+        fs.getattr("/")
+        fs._provider.close()
+
+        assert stat.S_ISDIR(fs.getattr("/").st_mode)
+
+    def test_is_directory_of_lazy_children(self):
+        class LazyProvider(_SlowAsyncProvider):
+            async def children_for(self, path):
+                return (
+                    TreeFuseNode(name, b"", is_directory=False)
+                    for name in (self.names if path == "/" else [])
+                )
+
+        provider = LazyProvider(latency=0)
+
+        assert asyncio.run(provider.is_directory("/"))
+        assert not asyncio.run(provider.is_directory("/file1"))
+
+    def test_provider_content_needs_bridge(self):
+        content = ProviderContent(_SlowAsyncProvider(latency=0), "/file1")
+
+        with pytest.raises(TypeError):
+            content.read(0, 1)
+
+
+class _SlowProvider(TreelibProvider):
+    """A TreelibProvider whose lookups block for ``latency`` seconds."""
+
+    def __init__(self, tree, latency):
+        super().__init__(tree)
+        self.latency = latency
+
+    def lookup_path(self, path):
+        time.sleep(self.latency)
+        return super().lookup_path(path)
+
+
+class TestThreading:
+    @pytest.fixture
+    def tree(self):
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        for i in range(32):
+            tree.create_node(
+                "file{}".format(i), parent=root, data=b"content"
+            )
+        return tree
+
+    def test_read_write_lock(self):
+        lock = _ReadWriteLock()
+        events = []
+
+        def reader():
+            with lock.read_locked():
+                events.append("read start")
+                time.sleep(0.1)
+                events.append("read end")
+
+        def writer():
+            with lock.write_locked():
+                events.append("write start")
+                time.sleep(0.1)
+                events.append("write end")
+
+        threads = [threading.Thread(target=reader) for _ in range(3)]
+        threads.append(threading.Thread(target=writer))
+        for thread in threads:
+            thread.start()
+            time.sleep(0.01)
+        for thread in threads:
+            thread.join()
+
+        # The readers overlapped one another, and the writer ran alone
+        assert events[:3] == ["read start"] * 3
+        assert events[-2:] == ["write start", "write end"]
+
+    def test_concurrent_mutation_and_lookup(self, tree):
+        provider = TreelibProvider(tree)
+        fs = TreeFuseFS(provider=provider)
+        stop = threading.Event()
+        errors = []
+
+        def mutate():
+            while not stop.is_set():
+                provider.add_node("/", "transient", data=b"x")
+                provider.remove_node("/transient")
+
+        def look_up():
+            try:
+                for _ in range(2000):
+                    assert fs.getattr("/file1").st_size == 7
+                    fs.getattr("/transient")
+                    assert len(list(fs.readdir("/", 0))) in (34, 35)
+            except Exception as exc:  # pragma: no cover
+                errors.append(exc)
+
+        mutator = threading.Thread(target=mutate)
+        mutator.start()
+        readers = [threading.Thread(target=look_up) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        stop.set()
+        mutator.join()
+
+        assert errors == []
+
+    def _time_parallel_getattrs(self, fs):
+        paths = ["/file{}".format(i) for i in range(32)]
+        start = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(32) as executor:
+            results = list(executor.map(fs.getattr, paths))
+        assert all(stat.S_ISREG(st.st_mode) for st in results)
+        return time.monotonic() - start
+
+    def test_provider_workers_scale_throughput(self, tree):
+        provider = _SlowProvider(tree, latency=0.05)
+        one_worker = TreeFuseFS(provider=provider, provider_workers=1)
+        eight_workers = TreeFuseFS(provider=provider, provider_workers=8)
+
+        serial = self._time_parallel_getattrs(one_worker)
+        parallel = self._time_parallel_getattrs(eight_workers)
+        one_worker._provider.close()
+        eight_workers._provider.close()
+
+        # 32 lookups take ~1.6s on one worker, and ~0.2s on eight
+        assert serial >= 32 * 0.05
+        assert parallel < serial / 4
+
+    def test_mounted_parallel_reads(self, mount_tree, tmp_path, tree):
+        mount_tree(tree)
+
+        def read(i):
+            return tmp_path.joinpath("file{}".format(i)).read_bytes()
+
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(read, range(32)))
+
+        assert results == [b"content"] * 32
+
+
+class TestKernelCaching:
+    @pytest.fixture
+    def tree(self):
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        tree.create_node("default", parent=root, data=b"default content")
+        tree.create_node(
+            "cached",
+            parent=root,
+            data=(b"cached content", TreeFuseStat.for_file(keep_cache=True)),
+        )
+        tree.create_node(
+            "uncached",
+            parent=root,
+            data=(
+                b"uncached content",
+                TreeFuseStat.for_file(keep_cache=False),
+            ),
+        )
+        return tree
+
+    def test_timeouts_become_mount_options(self, tree):
+        fs = TreeFuseFS(
+            provider=TreelibProvider(tree),
+            attr_timeout=60,
+            entry_timeout=30.5,
+            negative_timeout=10,
+        )
+
+        assert fs.fuse_args.optdict == {
+            "attr_timeout": "60",
+            "entry_timeout": "30.5",
+            "negative_timeout": "10",
+        }
+
+    def test_no_timeouts_by_default(self, tree):
+        fs = TreeFuseFS(provider=TreelibProvider(tree))
+
+        assert fs.fuse_args.optdict == {}
+
+    @pytest.mark.parametrize(
+        "kernel_cache,expected",
+        [
+            (False, {"default": False, "cached": True, "uncached": False}),
+            (True, {"default": True, "cached": True, "uncached": False}),
+        ],
+    )
+    def test_keep_cache(self, tree, kernel_cache, expected):
+        fs = TreeFuseFS(
+            provider=TreelibProvider(tree), kernel_cache=kernel_cache
+        )
+
+        for name, keep_cache in expected.items():
+            fh = fs.open("/" + name, os.O_RDONLY)
+            assert fh.keep_cache is keep_cache
+            assert fh.direct_io is False
+
+    def test_mounted(self, mount_tree, tmp_path, tree):
+        mount_tree(
+            tree, attr_timeout=60, entry_timeout=60, kernel_cache=True
+        )
+
+        for _ in range(2):
+            assert tmp_path.joinpath("default").read_text() == (
+                "default content"
+            )
+            assert tmp_path.joinpath("cached").read_text() == "cached content"
+
+
+class TestLiveMutation:
+    @pytest.fixture
+    def tree(self):
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        tree.create_node("file", parent=root, data=b"old content")
+        return tree
+
+    def test_changes_invalidate_negative_cache(self, tree):
+        provider = TreelibProvider(tree)
+        fs = TreeFuseFS(provider=provider)
+        assert fs.getattr("/new") == -errno.ENOENT
+
+        provider.add_node("/", "new", data=b"new content")
+
+        assert fs.getattr("/new").st_size == 11
+
+    def test_change_during_failed_lookup_is_not_cached(self, tree):
+        provider = TreelibProvider(tree)
+        fs = TreeFuseFS(provider=provider)
+        lookup_path = provider.lookup_path
+
+        def lookup_then_add(path):
+            node = lookup_path(path)
+            # Added after the lookup found nothing, but before it returns
+            provider.add_node("/", "new", data=b"new content")
+            return node
+
+        with mock.patch.object(provider, "lookup_path", lookup_then_add):
+            assert fs.getattr("/new") == -errno.ENOENT
+
+        assert fs.getattr("/new").st_size == 11
+
+    def test_changes_invalidate_stat_children(self, tree):
+        provider = _StatChildrenProvider(tree)
+        fs = TreeFuseFS(provider=provider)
+        list(fs.readdir("/", 0))
+        assert len(fs._child_stats) == 1
+        assert fs.getattr("/file").st_size == 11
+
+        provider.replace_node("/file", b"newer content")
+
+        assert fs.getattr("/file").st_size == 13
+
+    def test_change_during_stat_children_is_not_cached(self, tree):
+        provider = _StatChildrenProvider(tree)
+        fs = TreeFuseFS(provider=provider)
+        stat_children = provider.stat_children
+
+        def stat_children_then_replace(path):
+            children = stat_children(path)
+            provider.replace_node("/file", b"newer content")
+            return children
+
+        with mock.patch.object(
+            provider, "stat_children", stat_children_then_replace
+        ):
+            list(fs.readdir("/", 0))
+
+        assert fs.getattr("/file").st_size == 13
+
+    def test_changed_content_is_not_kept(self, tree):
+        provider = TreelibProvider(tree)
+        fs = TreeFuseFS(provider=provider, kernel_cache=True)
+        assert fs.open("/file", os.O_RDONLY).keep_cache is True
+
+        provider.replace_node("/file", b"new content")
+
+        fh = fs.open("/file", os.O_RDONLY)
+        assert fh.keep_cache is False
+        assert fs.read("/file", 100, 0, fh) == b"new content"
+        # Only the first open after the change has to drop the kernel's cache
+        assert fs.open("/file", os.O_RDONLY).keep_cache is True
+
+    def test_kernel_invalidation_once_mounted(self, tree):
+        provider = TreelibProvider(tree)
+        on_mount = mock.Mock()
+        fs = TreeFuseFS(provider=provider, on_mount=on_mount)
+
+        with mock.patch.object(fs, "Invalidate") as invalidate:
+            provider.replace_node("/file", b"")
+            invalidate.assert_not_called()
+
+            fs.fsinit()
+            on_mount.assert_called_once_with()
+            provider.replace_node("/file", b"new content")
+            invalidate.assert_called_once_with("/file")
+
+            # Failures to invalidate (e.g. with libfuse 2) are ignored
+            invalidate.side_effect = OSError
+            provider.remove_node("/file")
+
+    def test_mounted(self, mount_tree, tmp_path, tree):
+        provider = TreelibProvider(tree)
+        new_tree = treelib.Tree()
+        root = new_tree.create_node("root")
+        new_tree.create_node("swapped", parent=root, data=b"swapped content")
+
+        def update() -> None:
+            time.sleep(0.5)
+            provider.add_node("/", "added", data=b"added content")
+            time.sleep(0.5)
+            provider.swap_tree(new_tree)
+
+        def on_mount() -> None:
+            threading.Thread(target=update, daemon=True).start()
+
+        mount_tree(provider, on_mount=on_mount)
+
+        added = tmp_path.joinpath("added")
+        swapped = tmp_path.joinpath("swapped")
+        deadline = time.monotonic() + 5
+        while not added.exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert added.read_text() == "added content"
+        while not swapped.exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert swapped.read_text() == "swapped content"
+        # The kernel may cache entries for up to entry_timeout (1s by
+        # default, and not invalidated with libfuse 2)
+        while added.exists() and time.monotonic() < deadline + 2:
+            time.sleep(0.05)
+        assert sorted(os.listdir(tmp_path)) == ["swapped"]
+
+
+class TestStatsFile:
+    def test_mounted(self, mount_tree, tmp_path):
+        tree = treelib.Tree()
+        root = tree.create_node("root")
+        tree.create_node("rootchild", parent=root, data=b"rootchild content")
+        mount_tree(tree, stats_file=True)
+
+        assert tmp_path.joinpath("rootchild").read_bytes() == (
+            b"rootchild content"
+        )
+        stats = json.loads(tmp_path.joinpath(".treefuse/stats").read_text())
+        assert stats["operations"]["read"]["bytes"] > 0
+        assert stats["provider"]["lookup_path"]["calls"] > 0
@@ -4,13 +4,68 @@ TreeFuse is a library for writing FUSE filesystems backed by treelib trees.
 
 This contains the public API: :py:func:`treefuse_main` is the entrypoint for
 CLIs, and :py:class:`TreeFuseStat` is used to specify additional attributes for
-nodes which need it.  (See their documentation for details.)
+nodes which need it.  :py:class:`FileContent` can be used as the content of
+nodes which should be served from a file on disk, and
+:py:class:`CompressedContent` for content which should be held in memory
+compressed.  Filesystems which aren't backed by a treelib tree can implement a
+:py:class:`TreeFuseProvider` to pass to :py:func:`treefuse_main` instead, and
+very large, static trees can be frozen into a compact
+:py:class:`FrozenTreeProvider`, or compiled to a snapshot file (with
+:py:func:`compile_snapshot`) which a :py:class:`SnapshotProvider` serves
+without loading.  Trees too large for memory can be stored in an SQLite
+database (with :py:func:`compile_sqlite`) and served by an
+:py:class:`SQLiteProvider`, and tar and zip archives served in place by an
+:py:class:`ArchiveProvider`.  Trees which take a long time to enumerate can be
+served while they're being populated, by a :py:class:`ProgressiveProvider`.
+(See their documentation for details.)
 """
 
 __author__ = """Daniel Watkins"""
 __email__ = "daniel@daniel-watkins.co.uk"
 __version__ = "1.1.2"
 
-from .treefuse import TreeFuseStat, treefuse_main
+from .archive import ArchiveProvider
+from .blobs import Blob, BlobStore
+from .caching import CachingProvider
+from .content import CompressedContent, FileContent
+from .frozen import FrozenTreeProvider
+from .instrumentation import Instrumentation
+from .prefetch import PrefetchingProvider
+from .profiling import Profiler
+from .progressive import ProgressiveProvider
+from .snapshot import SnapshotProvider, compile_snapshot
+from .sqlite import SQLiteProvider, compile_sqlite
+from .treefuse import (
+    AsyncTreeFuseProvider,
+    ProviderContent,
+    TreeFuseContent,
+    TreeFuseNode,
+    TreeFuseProvider,
+    TreeFuseStat,
+    treefuse_main,
+)
 
-__all__ = ["TreeFuseStat", "treefuse_main"]
+__all__ = [
+    "ArchiveProvider",
+    "AsyncTreeFuseProvider",
+    "Blob",
+    "BlobStore",
+    "CachingProvider",
+    "CompressedContent",
+    "FileContent",
+    "FrozenTreeProvider",
+    "Instrumentation",
+    "PrefetchingProvider",
+    "Profiler",
+    "ProgressiveProvider",
+    "ProviderContent",
+    "SQLiteProvider",
+    "SnapshotProvider",
+    "TreeFuseContent",
+    "TreeFuseNode",
+    "TreeFuseProvider",
+    "TreeFuseStat",
+    "compile_snapshot",
+    "compile_sqlite",
+    "treefuse_main",
+]
@@ -0,0 +1,553 @@
+"""
+``ArchiveProvider``, which serves the members of a tar or zip archive.
+"""
+import bz2
+import gzip
+import itertools
+import json
+import lzma
+import os
+import posixpath
+import stat
+import struct
+import tarfile
+import threading
+import time
+import zipfile
+from array import array
+from collections import OrderedDict
+from io import BufferedIOBase
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from .content import BlockCache, FileContent, _default_block_cache
+from .frozen import FrozenTreeEntry, FrozenTreeProvider, _encode
+from .snapshot import _create_temporary
+from .treefuse import Buffer, TreeFuseContent, TreeFuseStat
+
+_INDEX_VERSION = 1
+
+# Each compression of tar we support: the magic number files compressed with
+# it start with, and how to decompress them
+_TAR_COMPRESSIONS: Dict[str, Tuple[bytes, Callable[[str], BufferedIOBase]]] = {
+    "gz": (b"\x1f\x8b", gzip.GzipFile),
+    "bz2": (b"BZh", bz2.BZ2File),
+    "xz": (b"\xfd7zXZ\x00", lzma.LZMAFile),
+}
+
+# A zip member's local file header, up to the variable-length fields: the
+# lengths of its name and extra field are the last two fields
+_ZIP_LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+
+# How many compressed members' decompressing streams are kept open, so that
+# sequential reads of them continue where the previous read stopped
+_MAX_STREAMS = 16
+
+# An index entry: (path, is_directory, mode, mtime, size, location, stored).
+# location is where the member's data starts, if it's stored uncompressed
+# (so can be read in place), and otherwise how to open it: its offset in a
+# compressed tar's stream, or its name in a zip.
+_Member = Tuple[str, bool, int, float, int, Union[int, str], bool]
+
+
+def _is_int(value: Any, limit: int) -> bool:
+    return type(value) is int and 0 <= value < limit
+
+
+def _is_member(member: Any) -> bool:
+    """Is ``member`` (as loaded from a saved index) a valid ``_Member``?"""
+    if not isinstance(member, list) or len(member) != 7:
+        return False
+    name, is_directory, mode, mtime, size, location, stored = member
+    return (
+        isinstance(name, str)
+        and isinstance(is_directory, bool)
+        and _is_int(mode, 1 << 16)
+        and type(mtime) in (int, float)
+        and _is_int(size, 1 << 63)
+        and (isinstance(location, str) or _is_int(location, 1 << 63))
+        and isinstance(stored, bool)
+    )
+
+
+# ArchiveProvider's flags for each member
+_DIRECTORY = 0x1
+_STORED = 0x2
+
+
+class ArchiveError(Exception):
+    """Raised when a file isn't an archive which can be served."""
+
+
+def _normalise(name: str) -> Optional[str]:
+    """Return the path within the mount of member ``name``, if it has one."""
+    parts = [part for part in name.split("/") if part and part != "."]
+    if not parts or ".." in parts:
+        # The archive's root, or outside it
+        return None
+    return "/".join(parts)
+
+
+def _mode(mode: int) -> int:
+    """Return the permissions to serve for a member's ``mode``."""
+    # Served read-only, whatever the archive says
+    return stat.S_IMODE(mode) & ~0o222
+
+
+def _scan_tar(path: str, compression: Optional[str]) -> Iterator[_Member]:
+    with tarfile.open(path) as archive:
+        # Regular files' index entries, for the hard links to them
+        files: Dict[str, _Member] = {}
+        for member in archive:
+            name = _normalise(member.name)
+            if name is None:
+                continue
+            if member.isdir():
+                mode = _mode(member.mode)
+                yield (name, True, mode, member.mtime, 0, 0, True)
+                continue
+            if member.islnk():
+                target = files.get(_normalise(member.linkname) or "")
+                if target is not None:
+                    yield (name,) + target[1:]
+                continue
+            if not member.isreg() or member.issparse():
+                # Symbolic links, devices, etc., and sparse files (whose data
+                # isn't stored contiguously)
+                continue
+            entry: _Member = (
+                name,
+                False,
+                _mode(member.mode),
+                member.mtime,
+                member.size,
+                member.offset_data,
+                compression is None,
+            )
+            files[name] = entry
+            yield entry
+
+
+def _scan_zip(path: str) -> Iterator[_Member]:
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as raw:
+        for info in archive.infolist():
+            name = _normalise(info.filename)
+            if name is None:
+                continue
+            mode = info.external_attr >> 16 if info.create_system == 3 else 0
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            if info.is_dir():
+                yield (name, True, _mode(mode), mtime, 0, 0, True)
+                continue
+            encrypted = info.flag_bits & 0x1
+            if encrypted or stat.S_IFMT(mode) not in (0, stat.S_IFREG):
+                # Encrypted, or not a regular file (e.g. a symbolic link)
+                continue
+            location: Union[int, str] = info.filename
+            stored = info.compress_type == zipfile.ZIP_STORED
+            if stored:
+                # Find where the data starts, past the local file header
+                raw.seek(info.header_offset)
+                header = _ZIP_LOCAL_HEADER.unpack(
+                    raw.read(_ZIP_LOCAL_HEADER.size)
+                )
+                location = (
+                    info.header_offset
+                    + _ZIP_LOCAL_HEADER.size
+                    + header[-2]
+                    + header[-1]
+                )
+            yield (
+                name,
+                False,
+                _mode(mode),
+                mtime,
+                info.file_size,
+                location,
+                stored,
+            )
+
+
+class _Stream:
+    """A decompressing stream of a member, and how far it has been read."""
+
+    def __init__(self, file: Union[BufferedIOBase, IO[bytes]]):
+        self.file = file
+        self.position = 0
+
+
+class _MemberReader:
+    """Reads compressed members of an archive, in cached blocks."""
+
+    # Distinguishes readers' blocks in shared caches
+    _keys = itertools.count()
+
+    def __init__(
+        self,
+        path: str,
+        compression: Optional[str],
+        block_size: int,
+        block_cache: BlockCache,
+    ):
+        self.path = path
+        self.compression = compression
+        self.block_size = block_size
+        self.block_cache = block_cache
+        self._key = next(self._keys)
+        self._zip: Optional[zipfile.ZipFile] = None
+        self._pid: Optional[int] = None
+        self._streams: "OrderedDict[Union[int, str], _Stream]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _open(
+        self, location: Union[int, str]
+    ) -> Union[BufferedIOBase, IO[bytes]]:
+        """Open a stream of the member at ``location``, from its start."""
+        if isinstance(location, str):
+            with self._lock:
+                # As with ThreadPoolProvider, (re)open lazily, in the process
+                # serving the mount
+                if self._zip is None or self._pid != os.getpid():
+                    self._zip = zipfile.ZipFile(self.path)
+                    self._pid = os.getpid()
+                archive = self._zip
+            return archive.open(location)
+        assert self.compression is not None
+        file = _TAR_COMPRESSIONS[self.compression][1](self.path)
+        # There's no way to seek within a compressed stream but to decompress
+        # everything before the member
+        file.seek(location)
+        return file
+
+    def block(self, location: Union[int, str], size: int, index: int) -> bytes:
+        """Return block ``index`` of the member at ``location``."""
+        key = (self._key, location, index)
+        block = self.block_cache.get(key)
+        if block is not None:
+            return block
+        with self._lock:
+            # Taken while we use it, so that other readers open their own
+            stream = self._streams.pop(location, None)
+        start = index * self.block_size
+        if stream is None or stream.position > start:
+            if stream is not None:
+                stream.file.close()
+            stream = _Stream(self._open(location))
+        try:
+            # Read (and cache) the blocks up to the one we want: sequential
+            # readers will want them next
+            while True:
+                block = stream.file.read(
+                    min(self.block_size, size - stream.position)
+                )
+                self.block_cache.put(
+                    (self._key, location, stream.position // self.block_size),
+                    block,
+                )
+                stream.position += len(block)
+                if stream.position > start or len(block) < self.block_size:
+                    break
+        except BaseException:
+            stream.file.close()
+            raise
+        with self._lock:
+            self._streams[location] = stream
+            while len(self._streams) > _MAX_STREAMS:
+                _, evicted = self._streams.popitem(last=False)
+                evicted.file.close()
+        return block
+
+    def close(self) -> None:
+        with self._lock:
+            streams = list(self._streams.values())
+            self._streams.clear()
+            if self._zip is not None and self._pid == os.getpid():
+                self._zip.close()
+            self._zip = None
+        for stream in streams:
+            stream.file.close()
+
+
+class _MemberContent(TreeFuseContent):
+    """A compressed member of an archive, decompressed as it's read."""
+
+    def __init__(
+        self, reader: _MemberReader, location: Union[int, str], size: int
+    ):
+        self.reader = reader
+        self.location = location
+        self._size = size
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def read(self, offset: int, size: int) -> Buffer:
+        end = min(offset + size, self._size)
+        if offset >= end:
+            return b""
+        block_size = self.reader.block_size
+        first, last = offset // block_size, (end - 1) // block_size
+        blocks = [
+            self.reader.block(self.location, self._size, index)
+            for index in range(first, last + 1)
+        ]
+        start = offset - first * block_size
+        joined = blocks[0] if len(blocks) == 1 else b"".join(blocks)
+        return memoryview(joined)[start:start + end - offset]
+
+
+class ArchiveProvider(FrozenTreeProvider):
+    """A read-only ``TreeFuseProvider`` serving a tar or zip archive.
+
+    The archive is scanned once, for the name, size, mode, modification time
+    and location of each of its members, and nothing is extracted: members
+    are read from the archive as they're read from the mount.  Members'
+    attributes are kept in arrays, and their ``TreeFuseStat``\\ s and content
+    are constructed as they're looked up.
+
+    * Members stored uncompressed (every member of an uncompressed tar, and
+      zip members which are "stored") are served in place, as
+      ``FileContent``.
+    * Compressed members are decompressed as they're read, in blocks of
+      ``block_size`` bytes, which are cached in ``block_cache``.  Sequential
+      reads continue decompressing where the previous read stopped, but
+      reading backwards (or from far into a member) decompresses the member
+      from its start.  Members of compressed (``.tar.gz``, ``.tar.bz2`` or
+      ``.tar.xz``) tars can only be reached by decompressing the archive up
+      to them, so random access to those is slow: prefer zips or
+      uncompressed tars.
+
+    The index built by the scan is saved (as JSON) at ``index_path``, and
+    reused by later mounts of the same archive for as long as the archive's
+    size and modification time are unchanged.  If it can't be saved, the
+    archive is served regardless.
+
+    Directories, regular files and hard links to them are served; other
+    members (e.g. symbolic links) are skipped, as are members whose names
+    lead outside the archive.  Everything is served read-only.
+
+    :param path:
+        The path of the archive.
+    :param index_path:
+        Where to save the index; by default, ``path`` with ``.treefuse-index``
+        appended.
+    :param persist_index:
+        Whether to save (and reuse) the index at all.
+    :param block_size:
+        The size of the blocks compressed members are decompressed in.
+    :param block_cache:
+        The ``BlockCache`` to keep decompressed blocks in; if not given, the
+        cache shared with ``CompressedContent`` is used.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, "os.PathLike[str]"],
+        index_path: Optional[Union[str, "os.PathLike[str]"]] = None,
+        persist_index: bool = True,
+        block_size: int = 64 * 1024,
+        block_cache: Optional[BlockCache] = None,
+    ):
+        if block_size < 1:
+            raise ValueError("block_size must be at least 1")
+        self.path = os.path.abspath(path)
+        self.index_path = (
+            os.path.abspath(index_path)
+            if index_path is not None
+            else self.path + ".treefuse-index"
+        )
+        archive_stat = os.stat(self.path)
+        identity = [archive_stat.st_size, archive_stat.st_mtime_ns]
+
+        index = self._load_index(identity) if persist_index else None
+        if index is None:
+            index = self._scan(identity)
+            if persist_index:
+                self._save_index(index)
+
+        self._reader = _MemberReader(
+            self.path,
+            index["compression"],
+            block_size,
+            block_cache if block_cache is not None else _default_block_cache,
+        )
+        members = index["members"]
+        self._pack(members)
+        super().__init__(self._entries(members))
+
+    def close(self) -> None:
+        """Close the streams which compressed members are read from."""
+        self._reader.close()
+
+    def _scan(self, identity: List[int]) -> Dict[str, Any]:
+        """Scan the archive, returning its index."""
+        compression = None
+        try:
+            if zipfile.is_zipfile(self.path):
+                members = list(_scan_zip(self.path))
+            else:
+                with open(self.path, "rb") as archive:
+                    magic = archive.read(8)
+                for name, (prefix, _) in _TAR_COMPRESSIONS.items():
+                    if magic.startswith(prefix):
+                        compression = name
+                members = list(_scan_tar(self.path, compression))
+        except (tarfile.TarError, zipfile.BadZipFile) as e:
+            raise ArchiveError(f"{self.path}: {e}") from None
+        return {
+            "version": _INDEX_VERSION,
+            "archive": identity,
+            "compression": compression,
+            "members": members,
+        }
+
+    def _load_index(self, identity: List[int]) -> Optional[Dict[str, Any]]:
+        """Load the saved index, if there is one for the archive as it is."""
+        try:
+            with open(self.index_path, "rb") as f:
+                index: Dict[str, Any] = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (
+            not isinstance(index, dict)
+            or index.get("version") != _INDEX_VERSION
+            or index.get("archive") != identity
+        ):
+            return None
+        # Rather than failing to serve a truncated or altered index, rebuild it
+        compression = index.get("compression")
+        members = index.get("members")
+        if (
+            compression is not None
+            and compression not in _TAR_COMPRESSIONS
+            or not isinstance(members, list)
+            or not all(map(_is_member, members))
+        ):
+            return None
+        return index
+
+    def _save_index(self, index: Dict[str, Any]) -> None:
+        directory = os.path.dirname(self.index_path)
+        try:
+            fd, temporary = _create_temporary(directory)
+        except OSError:
+            # e.g. a read-only directory: the next mount scans again
+            return
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(index, f, separators=(",", ":"))
+            os.replace(temporary, self.index_path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def _pack(self, members: List[Any]) -> None:
+        """Store the attributes of ``members`` in arrays."""
+        self._member_modes = array("H", (member[2] for member in members))
+        self._mtimes = array("d", (member[3] for member in members))
+        self._member_sizes = array("q", (member[4] for member in members))
+        self._flags = array(
+            "B",
+            (
+                (_DIRECTORY if member[1] else 0)
+                | (_STORED if member[6] else 0)
+                for member in members
+            ),
+        )
+        # Offsets, or for zip members read by name, the index of the name
+        self._locations = array("q")
+        name_offsets = array("Q", [0])
+        name_chunks: List[bytes] = []
+        for member in members:
+            location = member[5]
+            if isinstance(location, str):
+                encoded = _encode(location)
+                self._locations.append(len(name_chunks))
+                name_chunks.append(encoded)
+                name_offsets.append(name_offsets[-1] + len(encoded))
+            else:
+                self._locations.append(location)
+        self._zip_names = b"".join(name_chunks)
+        self._zip_name_offsets = name_offsets
+
+    def _entries(self, members: List[Any]) -> Iterator[FrozenTreeEntry]:
+        """Generate the ``FrozenTreeProvider`` entries for ``members``.
+
+        Each entry's data is the index of its member, which ``_freeze``
+        replaces.
+        """
+        # Directories are only served if they have children (as TreeFuse
+        # doesn't support empty directories)
+        parents: Set[str] = set()
+        for member in members:
+            parent = posixpath.dirname(member[0])
+            while parent and parent not in parents:
+                parents.add(parent)
+                parent = posixpath.dirname(parent)
+        for number, member in enumerate(members):
+            name, is_directory = member[0], member[1]
+            if not is_directory or name in parents:
+                yield name, number
+
+    def _freeze(
+        self,
+        names: List[str],
+        datas: List[Any],
+        children: List[Dict[str, int]],
+    ) -> "array[int]":
+        temp_ids = super()._freeze(names, [None] * len(datas), children)
+        # Each node's member, or -1 for the directories which aren't members
+        self._member_ids = array(
+            "i",
+            (
+                -1 if datas[temp_id] is None else datas[temp_id]
+                for temp_id in temp_ids
+            ),
+        )
+        for index, number in enumerate(self._member_ids):
+            if number != -1 and not self._is_directory(index):
+                # Our content, from _unpacked_content
+                self._sizes[index] = -1
+        return temp_ids
+
+    def _unpacked_stat(self, index: int) -> Optional[TreeFuseStat]:
+        number = self._member_ids[index]
+        if number == -1:
+            return None
+        mode = self._member_modes[number]
+        if self._flags[number] & _DIRECTORY:
+            return TreeFuseStat.for_directory_stat(
+                st_mode=stat.S_IFDIR | (mode or 0o555),
+                st_mtime=self._mtimes[number],
+            )
+        return TreeFuseStat.for_file_stat(
+            st_mode=stat.S_IFREG | (mode or 0o444),
+            st_size=self._member_sizes[number],
+            st_mtime=self._mtimes[number],
+        )
+
+    def _unpacked_content(self, index: int) -> TreeFuseContent:
+        number = self._member_ids[index]
+        size = self._member_sizes[number]
+        offset = self._locations[number]
+        if self._flags[number] & _STORED:
+            return FileContent(self.path, offset=offset, length=size)
+        location: Union[int, str] = offset
+        if self._reader.compression is None:
+            # A zip member, which is opened by name
+            offsets = self._zip_name_offsets
+            location = self._zip_names[
+                offsets[offset]:offsets[offset + 1]
+            ].decode("utf-8", "surrogateescape")
+        return _MemberContent(self._reader, location, size)
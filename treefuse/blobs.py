@@ -0,0 +1,111 @@
+"""
+``BlobStore``, which stores identical file content once.
+"""
+import hashlib
+import threading
+from typing import Any, Dict, Optional, Tuple, Union
+
+from .treefuse import Buffer
+
+
+class Blob(bytes):
+    """Content stored in a ``BlobStore``.
+
+    This is ``bytes`` (so it can be used as a node's content directly), with
+    the hex digest of the content as :py:attr:`digest`.  The digest depends
+    only on the content, so it can be used to identify content across paths,
+    trees and processes (e.g. as a cache key).
+    """
+
+    digest: str
+
+    def __new__(cls, content: Buffer, digest: str) -> "Blob":
+        blob = super().__new__(cls, content)
+        blob.digest = digest
+        return blob
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return (self.__class__, (bytes(self), self.digest))
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.digest} ({len(self)} bytes)>"
+
+
+class BlobStore:
+    """A content-addressed store, which keeps one copy of identical content.
+
+    :py:meth:`add` returns the ``Blob`` for some content, creating it the
+    first time the content is added, and returning the same ``Blob`` for
+    every later addition of identical content.  Each ``Blob`` is reference
+    counted: :py:meth:`release` drops a reference, and the store forgets the
+    ``Blob`` when none remain.
+
+    Use one while building a tree (using the ``Blob``\\ s as nodes' content),
+    or pass one to ``TreelibProvider``, which adds (and releases) its nodes'
+    content as nodes are added (and removed).
+
+    This is thread-safe.
+
+    :param algorithm:
+        The :py:mod:`hashlib` algorithm to identify content by.
+    """
+
+    def __init__(self, algorithm: str = "sha256"):
+        hashlib.new(algorithm)  # Raises ValueError if it's unsupported
+        self.algorithm = algorithm
+        self._blobs: Dict[str, Blob] = {}
+        self._refcounts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """The number of distinct contents stored."""
+        return len(self._blobs)
+
+    def __contains__(self, digest: object) -> bool:
+        return digest in self._blobs
+
+    @property
+    def size(self) -> int:
+        """The total size of the distinct contents stored."""
+        with self._lock:
+            return sum(len(blob) for blob in self._blobs.values())
+
+    def digest_of(self, content: Buffer) -> str:
+        """Return the digest ``content`` is (or would be) stored under."""
+        if isinstance(content, Blob) and self._blobs.get(content.digest) is (
+            content
+        ):
+            return content.digest
+        return hashlib.new(self.algorithm, content).hexdigest()
+
+    def add(self, content: Buffer) -> Blob:
+        """Add a reference to ``content``, returning its ``Blob``."""
+        digest = self.digest_of(content)
+        with self._lock:
+            blob = self._blobs.get(digest)
+            if blob is None:
+                blob = self._blobs[digest] = Blob(content, digest)
+            self._refcounts[digest] = self._refcounts.get(digest, 0) + 1
+            return blob
+
+    def get(self, digest: str) -> Optional[Blob]:
+        """Return the ``Blob`` stored under ``digest``, if there is one."""
+        return self._blobs.get(digest)
+
+    def refcount(self, digest: str) -> int:
+        """Return the number of references to the ``Blob`` for ``digest``."""
+        return self._refcounts.get(digest, 0)
+
+    def release(self, blob: Union[Blob, str]) -> None:
+        """Drop a reference to ``blob`` (or the ``Blob`` with that digest).
+
+        Raises ``KeyError`` if it isn't stored.
+        """
+        digest = blob if isinstance(blob, str) else blob.digest
+        with self._lock:
+            refcount = self._refcounts[digest] - 1
+            if refcount:
+                self._refcounts[digest] = refcount
+            else:
+                del self._refcounts[digest]
+                del self._blobs[digest]
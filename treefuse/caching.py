@@ -0,0 +1,399 @@
+"""
+``CachingProvider``, which memoises calls into another ``TreeFuseProvider``.
+"""
+import dataclasses
+import itertools
+import os.path
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    cast,
+)
+
+from .content import FileContent
+from .treefuse import (
+    Buffer,
+    ProviderContent,
+    TreeFuseContent,
+    TreeFuseNode,
+    TreeFuseProvider,
+    TreeFuseStat,
+    _rebind_provider_content,
+)
+
+_T = TypeVar("_T")
+
+# Directory listings are cached in pages of this many children, so that
+# listing a large directory doesn't hold all of it at once, and resumed
+# listings only fetch the pages they reach
+_PAGE_SIZE = 1024
+
+# A rough estimate of the memory taken by a cached node or stat (excluding
+# its name and any content held in memory), counted towards max_bytes
+_ENTRY_NBYTES = 256
+
+# The kinds of cached result, and so the keys of CachingProvider.stats
+_KINDS = (
+    "lookup_path",
+    "children_for",
+    "stat_children",
+    "is_directory",
+    "size_of",
+    "content",
+)
+
+
+@dataclass
+class CacheStats:
+    """Counters for one kind of result cached by a ``CachingProvider``."""
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+def _node_nbytes(node: TreeFuseNode) -> int:
+    """Estimate the memory which caching ``node`` holds on to."""
+    nbytes = _ENTRY_NBYTES + len(node.name)
+    content = node._content
+    if content is not None and not isinstance(content, TreeFuseContent):
+        try:
+            nbytes += memoryview(content).nbytes
+        except TypeError:
+            # Not a buffer, so reads of it fail (with EILSEQ) anyway
+            pass
+    return nbytes
+
+
+class _CachedContent(TreeFuseContent):
+    """A node's ``TreeFuseContent``, whose reads are cached."""
+
+    def __init__(
+        self, cache: "CachingProvider", path: str, content: TreeFuseContent
+    ):
+        self.cache = cache
+        self.path = path
+        self.content = content
+
+    @property
+    def size(self) -> int:
+        return self.content.size
+
+    def read(self, offset: int, size: int) -> Buffer:
+        return self.cache._cached(
+            "content",
+            self.path,
+            lambda: self.content.read(offset, size),
+            offset,
+            size,
+            nbytes=lambda content: memoryview(content).nbytes,
+        )
+
+
+@dataclass
+class _CacheEntry:
+    kind: str
+    value: Any
+    path: str
+    expires: Optional[float]
+    nbytes: int
+
+
+class CachingProvider(TreeFuseProvider):
+    """A ``TreeFuseProvider`` which caches the results of another.
+
+    Path lookups, directory listings (and their children's stats), directory
+    checks, sizes and content ranges read from ``provider`` are all cached, in
+    a single cache which is bounded both by number of entries and by the total
+    (estimated) size of the cached results.  When either bound is exceeded,
+    the least recently used entries are evicted.  Listings are cached a page
+    (of 1024 children) at a time, as they're consumed, so that listings
+    resumed part of the way through a large directory fetch only the pages
+    they reach from ``provider.iter_children``.
+
+    Content is cached a range at a time as it's read, whether it's read from
+    ``provider.read_range`` (``ProviderContent``) or from the
+    ``TreeFuseContent`` of a node.  ``FileContent``, which the kernel caches
+    itself, isn't cached.
+
+    Lookups of paths which don't exist are not cached: ``TreeFuseFS``'s
+    negative lookup cache handles those.
+
+    Changes which ``provider`` reports via ``notify_change`` invalidate the
+    affected entries (and are passed on to our own change callbacks).  If its
+    content can change without it doing so, callers must tell us with
+    :py:meth:`invalidate` (or :py:meth:`invalidate_tree`, or
+    :py:meth:`clear`), or set a ``ttl`` to bound how stale results can be.
+
+    :param provider:
+        The provider to cache the results of.  It must be thread-safe.
+    :param max_entries:
+        The maximum number of results to cache.
+    :param max_bytes:
+        The maximum total size of the results to cache: content ranges count
+        their size, and nodes, listings and stats an estimate of theirs
+        (including any content they hold in memory).  Results larger than
+        this are not cached at all.
+    :param ttl:
+        If given, how long (in seconds) a result is cached before it is looked
+        up again.
+    """
+
+    def __init__(
+        self,
+        provider: TreeFuseProvider,
+        max_entries: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: Optional[float] = None,
+    ):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.provider = provider
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stats: Dict[str, CacheStats] = {
+            kind: CacheStats() for kind in _KINDS
+        }
+        self._entries: "OrderedDict[Tuple[Hashable, ...], _CacheEntry]" = (
+            OrderedDict()
+        )
+        # path -> the keys of the entries cached for it
+        self._keys_by_path: Dict[str, Set[Tuple[Hashable, ...]]] = {}
+        self._nbytes = 0
+        # Incremented by every invalidation, so that results computed before
+        # one aren't cached after it
+        self._generation = 0
+        self._lock = threading.Lock()
+        provider.add_change_callback(self._provider_changed)
+
+    def _provider_changed(self, path: str) -> None:
+        self.invalidate_tree(path)
+        self.notify_change(path)
+
+    @property
+    def nbytes(self) -> int:
+        """The total (estimated) size of the results currently cached."""
+        return self._nbytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _cached(
+        self,
+        kind: str,
+        path: str,
+        compute: Callable[[], _T],
+        *key_extra: Hashable,
+        nbytes: Callable[[_T], int] = lambda value: 0,
+        cache_if: Callable[[_T], bool] = lambda value: True,
+    ) -> _T:
+        """Return the cached result for ``kind``/``path``, or compute it.
+
+        ``compute`` is called without the lock held, so concurrent misses for
+        the same key will all call into the wrapped provider.
+        """
+        key = (kind, path) + key_extra
+        stats = self.stats[kind]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires is None or entry.expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    stats.hits += 1
+                    return cast(_T, entry.value)
+                self._remove(key)
+            stats.misses += 1
+            generation = self._generation
+
+        value = compute()
+        if not cache_if(value):
+            return value
+        size = nbytes(value)
+        if size > self.max_bytes:
+            return value
+
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            if generation != self._generation:
+                return value
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _CacheEntry(
+                kind, value, path, expires, size
+            )
+            self._keys_by_path.setdefault(path, set()).add(key)
+            self._nbytes += size
+            while (
+                len(self._entries) > self.max_entries
+                or self._nbytes > self.max_bytes
+            ):
+                evicted_key = next(iter(self._entries))
+                evicted = self._remove(evicted_key)
+                self.stats[evicted.kind].evictions += 1
+        return value
+
+    def _remove(self, key: Tuple[Hashable, ...]) -> _CacheEntry:
+        """Remove ``key`` from the cache; the lock must be held."""
+        entry = self._entries.pop(key)
+        self._nbytes -= entry.nbytes
+        keys = self._keys_by_path[entry.path]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_path[entry.path]
+        return entry
+
+    def invalidate(self, path: str) -> None:
+        """Drop everything cached for ``path``, and its parent's listing.
+
+        Call this when the node at ``path`` is added, removed or changed.
+        """
+        parent = os.path.dirname(path)
+        with self._lock:
+            self._generation += 1
+            for key in list(self._keys_by_path.get(path, ())):
+                self._remove(key)
+            for key in list(self._keys_by_path.get(parent, ())):
+                if key[0] in ("children_for", "stat_children", "is_directory"):
+                    self._remove(key)
+
+    def invalidate_tree(self, path: str) -> None:
+        """Drop everything cached for ``path`` and any path beneath it."""
+        prefix = path.rstrip(os.path.sep) + os.path.sep
+        with self._lock:
+            paths = [
+                cached_path
+                for cached_path in self._keys_by_path
+                if cached_path.startswith(prefix)
+            ]
+        for cached_path in paths:
+            self.invalidate(cached_path)
+        self.invalidate(path)
+
+    def clear(self) -> None:
+        """Drop everything from the cache."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._keys_by_path.clear()
+            self._nbytes = 0
+
+    def _rebind(self, node: TreeFuseNode, path: str) -> TreeFuseNode:
+        """Make ``node``'s content (found at ``path``) read through us."""
+        node = _rebind_provider_content(node, self.provider, self)
+        content = node._content
+        if isinstance(content, TreeFuseContent) and not isinstance(
+            content, (ProviderContent, FileContent)
+        ):
+            node = dataclasses.replace(
+                node, _content=_CachedContent(self, path, content)
+            )
+        return node
+
+    def _page(
+        self, path: str, index: int, source: Callable[[], List[TreeFuseNode]]
+    ) -> List[TreeFuseNode]:
+        return self._cached(
+            "children_for",
+            path,
+            source,
+            index,
+            nbytes=lambda children: sum(map(_node_nbytes, children)),
+        )
+
+    def children_for(self, path: str) -> Iterable[TreeFuseNode]:
+        return self.iter_children(path)
+
+    def iter_children(
+        self, path: str, offset: int = 0
+    ) -> Iterator[TreeFuseNode]:
+        """Iterate over the children of ``path``, a cached page at a time.
+
+        Pages which aren't cached are read from ``provider.iter_children``,
+        continuing from the previous page where we can.
+        """
+        index, skip = divmod(offset, _PAGE_SIZE)
+        # The provider's iterator, and the index of the page it's at
+        children: Optional[Iterator[TreeFuseNode]] = None
+        position = -1
+
+        def fetch() -> List[TreeFuseNode]:
+            nonlocal children, position
+            if children is None or position != index:
+                children = self.provider.iter_children(
+                    path, index * _PAGE_SIZE
+                )
+            position = index + 1
+            return [
+                self._rebind(child, os.path.join(path, child.name))
+                for child in itertools.islice(children, _PAGE_SIZE)
+            ]
+
+        while True:
+            page = self._page(path, index, fetch)
+            yield from itertools.islice(page, skip, None)
+            if len(page) < _PAGE_SIZE:
+                return
+            index, skip = index + 1, 0
+
+    def stat_children(
+        self, path: str
+    ) -> Optional[Iterable[Tuple[str, TreeFuseStat]]]:
+        def compute() -> Optional[List[Tuple[str, TreeFuseStat]]]:
+            children = self.provider.stat_children(path)
+            return None if children is None else list(children)
+
+        return self._cached(
+            "stat_children",
+            path,
+            compute,
+            nbytes=lambda children: sum(
+                _ENTRY_NBYTES + len(name) for name, _ in children or ()
+            ),
+        )
+
+    def is_directory(self, path: str) -> bool:
+        return self._cached(
+            "is_directory", path, lambda: self.provider.is_directory(path)
+        )
+
+    def lookup_path(self, path: str) -> Optional[TreeFuseNode]:
+        def compute() -> Optional[TreeFuseNode]:
+            node = self.provider.lookup_path(path)
+            return None if node is None else self._rebind(node, path)
+
+        return self._cached(
+            "lookup_path",
+            path,
+            compute,
+            nbytes=lambda node: 0 if node is None else _node_nbytes(node),
+            cache_if=lambda node: node is not None,
+        )
+
+    def size_of(self, path: str) -> int:
+        return self._cached(
+            "size_of", path, lambda: self.provider.size_of(path)
+        )
+
+    def read_range(self, path: str, offset: int, size: int) -> Buffer:
+        return self._cached(
+            "content",
+            path,
+            lambda: self.provider.read_range(path, offset, size),
+            offset,
+            size,
+            nbytes=lambda content: memoryview(content).nbytes,
+        )
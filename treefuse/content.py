@@ -0,0 +1,333 @@
+"""
+``TreeFuseContent`` implementations, for content which isn't held in memory
+as a plain buffer.
+"""
+import importlib
+import itertools
+import mmap
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple, Union
+
+from .treefuse import Buffer, TreeFuseContent
+
+
+class MappingCache:
+    """A bounded, least-recently-used cache of read-only file mappings.
+
+    Mappings are shared between every ``FileContent`` referring to the same
+    file (and are ``MAP_SHARED``, so their pages are shared with the page cache
+    and any other process mapping the file).
+
+    :param max_mappings:
+        The maximum number of files to keep mapped at once.  When this is
+        exceeded, the least recently used mapping is closed.  (If a read from
+        it is still in flight, it will instead be unmapped once that read
+        completes.)
+    """
+
+    def __init__(self, max_mappings: int = 256):
+        if max_mappings < 1:
+            raise ValueError("max_mappings must be at least 1")
+        self.max_mappings = max_mappings
+        self._mappings: "OrderedDict[str, mmap.mmap]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._mappings)
+
+    def view(self, path: str) -> Optional[memoryview]:
+        """Return a view of the file at ``path``, mapping it if needed.
+
+        Returns ``None`` if the file is empty (as empty files can't be mapped).
+        """
+        with self._lock:
+            mapping = self._mappings.get(path)
+            if mapping is not None:
+                self._mappings.move_to_end(path)
+                # We take the view under the lock, so the mapping can't be
+                # closed by a concurrent eviction before we have it.
+                return memoryview(mapping)
+
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mappings[path] = mapping
+            while len(self._mappings) > self.max_mappings:
+                _, evicted = self._mappings.popitem(last=False)
+                self._close(evicted)
+            return memoryview(mapping)
+
+    def clear(self) -> None:
+        """Close all mappings."""
+        with self._lock:
+            while self._mappings:
+                _, mapping = self._mappings.popitem()
+                self._close(mapping)
+
+    @staticmethod
+    def _close(mapping: mmap.mmap) -> None:
+        try:
+            mapping.close()
+        except BufferError:
+            # A read still holds a view of this mapping; it will be unmapped
+            # when that view (and so the last reference to it) is released.
+            pass
+
+
+_default_mapping_cache = MappingCache()
+
+
+class FileContent(TreeFuseContent):
+    """File content served from (a range of) a file on disk.
+
+    The file is not read when this is constructed: it's ``mmap``-ed the first
+    time it's read from, and reads are served from views of the mapping.  The
+    file must not be truncated while it's in use.
+
+    :param path:
+        The path of the file on disk.
+    :param offset:
+        The offset within the file at which the content starts.
+    :param length:
+        The length of the content; if not given, the content extends to the
+        end of the file.
+    :param mapping_cache:
+        The ``MappingCache`` to map the file through; if not given, a cache
+        shared by all ``FileContent`` instances is used.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, "os.PathLike[str]"],
+        offset: int = 0,
+        length: Optional[int] = None,
+        mapping_cache: Optional[MappingCache] = None,
+    ):
+        if offset < 0 or (length is not None and length < 0):
+            raise ValueError("offset and length must not be negative")
+        self.path = os.path.abspath(path)
+        self.offset = offset
+        self.length = length
+        self._mapping_cache = (
+            mapping_cache
+            if mapping_cache is not None
+            else _default_mapping_cache
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}({self.path!r}, offset={self.offset},"
+            f" length={self.length})"
+        )
+
+    @property
+    def size(self) -> int:
+        """The size of the content, determined without reading the file."""
+        if self.length is not None:
+            return self.length
+        return max(os.stat(self.path).st_size - self.offset, 0)
+
+    def read(self, offset: int, size: int) -> Buffer:
+        """Return a view of up to ``size`` bytes, starting at ``offset``."""
+        if self.length is not None:
+            size = max(min(size, self.length - offset), 0)
+        view = self._mapping_cache.view(self.path)
+        if view is None or size == 0:
+            return b""
+        start = self.offset + offset
+        return view[start:start + size]
+
+
+# The codecs which CompressedContent supports, each named for the stdlib module
+# implementing it (imported when it's first used, as lzma and bz2 are optional)
+CODECS = ("zlib", "lzma", "bz2")
+
+
+def _codec(name: str) -> Tuple[Callable[..., bytes], Callable[[bytes], bytes]]:
+    """Return the ``compress`` and ``decompress`` functions for ``name``."""
+    if name not in CODECS:
+        raise ValueError(f"codec must be one of {', '.join(CODECS)}")
+    module: Any = importlib.import_module(name)
+    return module.compress, module.decompress
+
+
+class BlockCache:
+    """A bounded, least-recently-used cache of decompressed blocks.
+
+    :param max_bytes:
+        The maximum total size of the blocks to keep.  When this is exceeded,
+        the least recently used blocks are dropped.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        if max_bytes < 1:
+            raise ValueError("max_bytes must be at least 1")
+        self.max_bytes = max_bytes
+        self._blocks: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        """Return the block cached as ``key``, if any."""
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+            return block
+
+    def put(self, key: Hashable, block: bytes) -> None:
+        """Cache ``block`` as ``key``, evicting others if needed."""
+        with self._lock:
+            previous = self._blocks.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._blocks[key] = block
+            self._bytes += len(block)
+            while self._bytes > self.max_bytes and len(self._blocks) > 1:
+                _, evicted = self._blocks.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def clear(self) -> None:
+        """Drop all cached blocks."""
+        with self._lock:
+            self._blocks.clear()
+            self._bytes = 0
+
+
+_default_block_cache = BlockCache()
+
+
+class CompressedContent(TreeFuseContent):
+    """File content held in memory compressed, in fixed-size blocks.
+
+    Each block of ``block_size`` bytes is compressed independently, so a read
+    decompresses only the blocks it overlaps.  Recently decompressed blocks
+    are kept in a ``BlockCache``, so that sequential reads smaller than a
+    block (and reads of the same part of a file by several readers) don't
+    decompress it more than once.
+
+    Build one from uncompressed data with :py:meth:`compress`.
+
+    :param data:
+        The compressed blocks, concatenated.
+    :param block_offsets:
+        The offset of each block within ``data``, followed by the length of
+        ``data``.
+    :param size:
+        The size of the uncompressed content.
+    :param block_size:
+        The uncompressed size of every block but the last.
+    :param codec:
+        The codec the blocks were compressed with: one of ``CODECS``.
+    :param block_cache:
+        The ``BlockCache`` to keep decompressed blocks in; if not given, a
+        cache shared by all ``CompressedContent`` instances is used.
+    """
+
+    # Distinguishes instances' blocks in shared caches (unlike id(), these
+    # aren't reused once an instance is garbage collected)
+    _keys = itertools.count()
+
+    def __init__(
+        self,
+        data: bytes,
+        block_offsets: "array[int]",
+        size: int,
+        block_size: int,
+        codec: str = "zlib",
+        block_cache: Optional[BlockCache] = None,
+    ):
+        if block_size < 1:
+            raise ValueError("block_size must be at least 1")
+        if len(block_offsets) != -(-size // block_size) + 1:
+            raise ValueError("block_offsets doesn't match size")
+        self._decompress = _codec(codec)[1]
+        self.data = data
+        self.block_offsets = block_offsets
+        self.block_size = block_size
+        self.codec = codec
+        self._size = size
+        self._key = next(self._keys)
+        self._block_cache = (
+            block_cache if block_cache is not None else _default_block_cache
+        )
+
+    @classmethod
+    def compress(
+        cls,
+        content: Buffer,
+        codec: str = "zlib",
+        block_size: int = 64 * 1024,
+        block_cache: Optional[BlockCache] = None,
+        **options: Any,
+    ) -> "CompressedContent":
+        """Compress ``content`` with ``codec``, in blocks of ``block_size``.
+
+        Smaller blocks make reads of small ranges cheaper, but compress less
+        well.  Any other keyword arguments (e.g. ``level`` for zlib, or
+        ``preset`` for lzma) are passed to the codec's ``compress``.
+        """
+        if block_size < 1:
+            raise ValueError("block_size must be at least 1")
+        compress = _codec(codec)[0]
+        view = memoryview(content).cast("B")
+        blocks = []
+        block_offsets = array("Q", [0])
+        for start in range(0, len(view), block_size):
+            blocks.append(compress(view[start:start + block_size], **options))
+            block_offsets.append(block_offsets[-1] + len(blocks[-1]))
+        return cls(
+            b"".join(blocks),
+            block_offsets,
+            len(view),
+            block_size,
+            codec,
+            block_cache,
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"<{self.__class__.__name__} {self._size} bytes as"
+            f" {len(self.data)} ({self.codec})>"
+        )
+
+    @property
+    def size(self) -> int:
+        """The size of the uncompressed content."""
+        return self._size
+
+    def _block(self, index: int) -> bytes:
+        key = (self._key, index)
+        block = self._block_cache.get(key)
+        if block is None:
+            start, end = self.block_offsets[index:index + 2]
+            block = self._decompress(self.data[start:end])
+            self._block_cache.put(key, block)
+        return block
+
+    def read(self, offset: int, size: int) -> Buffer:
+        """Return up to ``size`` bytes, starting at ``offset``.
+
+        Only the blocks overlapping the range are decompressed.
+        """
+        end = min(offset + size, self._size)
+        if offset >= end:
+            return b""
+        first, last = offset // self.block_size, (end - 1) // self.block_size
+        start = offset - first * self.block_size
+        if first == last:
+            return memoryview(self._block(first))[start:start + end - offset]
+        parts = [memoryview(self._block(first))[start:]]
+        for index in range(first + 1, last):
+            parts.append(memoryview(self._block(index)))
+        parts.append(
+            memoryview(self._block(last))[:end - last * self.block_size]
+        )
+        return b"".join(parts)
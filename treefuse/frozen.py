@@ -0,0 +1,352 @@
+"""
+``FrozenTreeProvider``, a compact, read-only provider for very large trees.
+"""
+import os.path
+from array import array
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import treelib
+
+from .treefuse import TreeFuseNode, TreeFuseProvider, TreeFuseStat
+
+# Entries which can be passed to FrozenTreeProvider in place of a tree: either
+# a path, or a (path, data) tuple, with data as for treelib nodes' .data
+FrozenTreeEntry = Union[str, Tuple[str, Any]]
+
+# FrozenTreeProvider's per-node columns: arrays, or (in a SnapshotProvider)
+# views of a mapped snapshot
+_Column = Union["array[int]", memoryview]
+
+# The stat fields which FrozenTreeProvider doesn't store in its arrays: nodes
+# with a TreeFuseStat setting any of these keep the TreeFuseStat itself.
+_UNPACKED_STAT_FIELDS = (
+    "st_ino",
+    "st_dev",
+    "st_uid",
+    "st_gid",
+    "st_atime",
+    "st_mtime",
+    "st_ctime",
+)
+
+
+def _encode(name: str) -> bytes:
+    return name.encode("utf-8", "surrogateescape")
+
+
+def _zeros(typecode: str, count: int) -> "array[int]":
+    """Return an array of ``count`` zeroes."""
+    zeros = array(typecode)
+    zeros.frombytes(bytes(zeros.itemsize * count))
+    return zeros
+
+
+def _split_data(data: Any) -> Tuple[Any, Optional[TreeFuseStat]]:
+    """Split a node's ``data`` into its content and stat."""
+    if isinstance(data, tuple):
+        content, st = data
+        return content, st
+    return data, None
+
+
+def _is_packable(st: TreeFuseStat, is_directory: bool) -> bool:
+    """Can ``st`` be recreated from just its mode and the content's size?"""
+    return (
+        st.st_mode is not None
+        # (The link count the recreated stat will have)
+        and getattr(st, "st_nlink", None) == (2 if is_directory else 1)
+        and getattr(st, "st_size", None) is None
+        and getattr(st, "keep_cache", None) is None
+        and getattr(st, "direct_io", None) is None
+        and not any(getattr(st, field, 0) for field in _UNPACKED_STAT_FIELDS)
+    )
+
+
+class FrozenTreeProvider(TreeFuseProvider):
+    """A read-only ``TreeFuseProvider`` which stores its tree in flat arrays.
+
+    ``TreelibProvider`` holds a ``treelib.Node`` (with its own dicts) and index
+    entries for every node, which costs several hundred bytes per node before
+    any content.  This instead freezes the tree into a handful of contiguous
+    arrays, ordered breadth-first so that each directory's children are
+    adjacent (and sorted by name, so that lookups can binary search them):
+
+    * each node's first child and number of children, its mode and its content
+      size and offset are stored in ``array.array``\\ s;
+    * each distinct name is stored once, in a single ``bytes`` (so names which
+      repeat across directories, like ``__init__.py``, are shared);
+    * ``bytes`` and ``bytearray`` content is copied into a single ``bytes``
+      (once for each distinct content, so identical files share it), and
+      served from views of it.
+
+    Other content (e.g. ``FileContent``), and ``TreeFuseStat``\\ s which set
+    more than a mode, are kept as they are, for the nodes which have them.
+    ``TreeFuseNode``\\ s are constructed on demand.
+
+    Directories are listed in name order, rather than the order in which their
+    children were added.  As with ``TreelibProvider``, the first of several
+    children with the same name wins.
+
+    :param source:
+        Either a ``treelib.Tree`` (with nodes' ``data`` interpreted as for
+        ``treefuse_main``), or an iterable of paths, or of ``(path, data)``
+        tuples.  Directories are created for each path's ancestors, so only
+        the files need to be given.  The source isn't referenced once
+        construction is complete.
+    """
+
+    def __init__(
+        self, source: Union[treelib.Tree, Iterable[FrozenTreeEntry]]
+    ):
+        if isinstance(source, treelib.Tree):
+            names, datas, children = self._collect_tree(source)
+        else:
+            names, datas, children = self._collect_entries(source)
+        self._freeze(names, datas, children)
+
+    @staticmethod
+    def _collect_tree(
+        tree: treelib.Tree,
+    ) -> Tuple[List[str], List[Any], List[Dict[str, int]]]:
+        """Collect ``tree``'s nodes into lists, indexed by a temporary ID."""
+        names: List[str] = []
+        datas: List[Any] = []
+        children: List[Dict[str, int]] = []
+        if tree.root is None:
+            raise ValueError("Cannot freeze an empty tree")
+        pending = [(tree.get_node(tree.root), -1)]
+        while pending:
+            node, parent = pending.pop()
+            if parent != -1:
+                siblings = children[parent]
+                if node.tag in siblings:
+                    continue
+                siblings[node.tag] = len(names)
+            current = len(names)
+            names.append(node.tag)
+            datas.append(node.data)
+            children.append({})
+            # Reversed, so that the first child is popped (and wins) first
+            pending.extend(
+                (child, current)
+                for child in reversed(tree.children(node.identifier))
+            )
+        return names, datas, children
+
+    @staticmethod
+    def _collect_entries(
+        entries: Iterable[FrozenTreeEntry],
+    ) -> Tuple[List[str], List[Any], List[Dict[str, int]]]:
+        """Collect ``entries`` into lists, indexed by a temporary ID."""
+        names: List[str] = [""]
+        datas: List[Any] = [None]
+        children: List[Dict[str, int]] = [{}]
+        for entry in entries:
+            if isinstance(entry, tuple):
+                path, data = entry
+            else:
+                path, data = entry, None
+            current = 0
+            components = [part for part in path.split(os.path.sep) if part]
+            for depth, name in enumerate(components):
+                child = children[current].get(name)
+                if child is None:
+                    child = len(names)
+                    children[current][name] = child
+                    names.append(name)
+                    is_leaf = depth == len(components) - 1
+                    datas.append(data if is_leaf else None)
+                    children.append({})
+                elif depth == len(components) - 1 and datas[child] is None:
+                    # e.g. a directory's stat, given after its children
+                    datas[child] = data
+                current = child
+        return names, datas, children
+
+    def _freeze(
+        self,
+        names: List[str],
+        datas: List[Any],
+        children: List[Dict[str, int]],
+    ) -> "array[int]":
+        """Lay the collected nodes out breadth-first in our arrays.
+
+        Returns the temporary ID of each node, in the order of the arrays.
+        """
+        count = len(names)
+        self._first_child: _Column = _zeros("I", count)
+        self._child_count: _Column = _zeros("I", count)
+        self._name_ids: _Column = _zeros("I", count)
+        self._modes: _Column = _zeros("H", count)
+        self._sizes: _Column = _zeros("q", count)
+        self._offsets: _Column = _zeros("Q", count)
+        # Sparse: only for nodes whose content or stat can't be packed
+        self._other_content: Dict[int, Any] = {}
+        self._stats: Dict[int, TreeFuseStat] = {}
+
+        name_ids: Dict[bytes, int] = {}
+        name_offsets = array("Q", [0])
+        name_chunks: List[bytes] = []
+        content_chunks: List[bytes] = []
+        content_offset = 0
+        packed: Dict[bytes, int] = {}
+        directory_mode = TreeFuseStat.for_directory_stat().st_mode
+        file_mode = TreeFuseStat.for_file_stat().st_mode
+
+        temp_ids = array("I")
+        order = deque([0])
+        index = 0
+        next_index = 1
+        while order:
+            temp_id = order.popleft()
+            temp_ids.append(temp_id)
+            encoded = _encode(names[temp_id])
+            name_id = name_ids.get(encoded)
+            if name_id is None:
+                name_id = name_ids[encoded] = len(name_chunks)
+                name_chunks.append(encoded)
+                name_offsets.append(name_offsets[-1] + len(encoded))
+            self._name_ids[index] = name_id
+
+            kids = children[temp_id]
+            is_directory = bool(kids) or index == 0
+            if kids:
+                self._first_child[index] = next_index
+                self._child_count[index] = len(kids)
+                next_index += len(kids)
+                order.extend(kids[name] for name in sorted(kids, key=_encode))
+
+            content, st = _split_data(datas[temp_id])
+            if st is None:
+                self._modes[index] = (
+                    directory_mode if is_directory else file_mode
+                )
+            elif _is_packable(st, is_directory):
+                self._modes[index] = st.st_mode
+            else:
+                self._stats[index] = st
+            if not is_directory:
+                if content is None:
+                    content = b""
+                if isinstance(content, (bytes, bytearray)):
+                    content = bytes(content)
+                    # Identical content is only packed once
+                    offset = packed.get(content)
+                    if offset is None:
+                        offset = packed[content] = content_offset
+                        content_chunks.append(content)
+                        content_offset += len(content)
+                    self._offsets[index] = offset
+                    self._sizes[index] = len(content)
+                else:
+                    self._other_content[index] = content
+                    self._sizes[index] = -1
+            index += 1
+
+        self._names: Union[bytes, memoryview] = b"".join(name_chunks)
+        self._name_offsets: _Column = name_offsets
+        self._content = memoryview(b"".join(content_chunks))
+        return temp_ids
+
+    def __len__(self) -> int:
+        """The number of nodes in the tree, including the root."""
+        return len(self._name_ids)
+
+    def _name(self, index: int) -> bytes:
+        name_id = self._name_ids[index]
+        return bytes(
+            self._names[
+                self._name_offsets[name_id]:self._name_offsets[name_id + 1]
+            ]
+        )
+
+    def _find_child(self, index: int, name: bytes) -> Optional[int]:
+        """Binary search ``index``'s children for one called ``name``."""
+        low = self._first_child[index]
+        high = low + self._child_count[index]
+        while low < high:
+            middle = (low + high) // 2
+            middle_name = self._name(middle)
+            if middle_name < name:
+                low = middle + 1
+            elif middle_name > name:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def _find(self, path: str) -> Optional[int]:
+        """Return the index of the node at ``path``, or ``None``."""
+        index = 0
+        for component in path.split(os.path.sep):
+            if component:
+                child = self._find_child(index, _encode(component))
+                if child is None:
+                    return None
+                index = child
+        return index
+
+    def _is_directory(self, index: int) -> bool:
+        return index == 0 or self._child_count[index] > 0
+
+    def _unpacked_stat(self, index: int) -> Optional[TreeFuseStat]:
+        """Return the stat kept for ``index``, if it couldn't be packed."""
+        return self._stats.get(index)
+
+    def _unpacked_content(self, index: int) -> Any:
+        """Return the content kept for ``index``, which couldn't be packed."""
+        return self._other_content[index]
+
+    def _node(self, index: int) -> TreeFuseNode:
+        """Construct a ``TreeFuseNode`` for the node at ``index``."""
+        is_directory = self._is_directory(index)
+        name = self._name(index).decode("utf-8", "surrogateescape")
+        st = self._unpacked_stat(index)
+        if is_directory:
+            if st is None:
+                st = TreeFuseStat.for_directory_stat(
+                    st_mode=self._modes[index]
+                )
+            return TreeFuseNode(name, None, st, is_directory=True)
+
+        size: Optional[int] = self._sizes[index]
+        if size == -1:
+            # Not packed: getattr will find the size from the content itself
+            content = self._unpacked_content(index)
+            size = None
+        else:
+            offset = self._offsets[index]
+            content = self._content[offset:offset + self._sizes[index]]
+        if st is None:
+            st = TreeFuseStat.for_file_stat(
+                st_mode=self._modes[index], st_size=size
+            )
+        return TreeFuseNode(name, content, st, is_directory=False)
+
+    def children_for(self, path: str) -> Iterator[TreeFuseNode]:
+        return self.iter_children(path)
+
+    def iter_children(
+        self, path: str, offset: int = 0
+    ) -> Iterator[TreeFuseNode]:
+        index = self._find(path)
+        if index is None:
+            return iter(())
+        first = self._first_child[index]
+        last = first + self._child_count[index]
+        return map(self._node, range(first + offset, last))
+
+    def is_directory(self, path: str) -> bool:
+        index = self._find(path)
+        return index is not None and self._is_directory(index)
+
+    def lookup_path(self, path: str) -> Optional[TreeFuseNode]:
+        index = self._find(path)
+        return None if index is None else self._node(index)
+
+    def size_of(self, path: str) -> int:
+        index = self._find(path)
+        if index is not None and self._sizes[index] != -1:
+            return self._sizes[index]
+        return super().size_of(path)
@@ -0,0 +1,450 @@
+"""
+Instrumentation: counts, errors, latencies and bytes served by ``TreeFuseFS``.
+"""
+import bisect
+import errno
+import functools
+import json
+import os.path
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from .treefuse import (
+    Buffer,
+    TreeFuseContent,
+    TreeFuseNode,
+    TreeFuseProvider,
+    TreeFuseStat,
+    _rebind_provider_content,
+)
+
+#: The directory containing the stats file, when it's enabled
+STATS_DIRECTORY = "/.treefuse"
+#: The path of the stats file within the mount, when it's enabled
+STATS_FILE = os.path.join(STATS_DIRECTORY, "stats")
+
+# The upper bounds (in seconds) of the latency histograms' buckets; there is a
+# final bucket for anything slower
+LATENCY_BUCKETS = (
+    0.00001,
+    0.00005,
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+)
+
+
+def _bucket_label(index: int) -> str:
+    if index == len(LATENCY_BUCKETS):
+        return "+Inf"
+    return f"{LATENCY_BUCKETS[index]:g}"
+
+
+@dataclass
+class OperationStats:
+    """What an ``Instrumentation`` has recorded for one kind of call."""
+
+    calls: int = 0
+    #: Calls which failed, by errno name (e.g. ``"ENOENT"``), or by exception
+    #: type for exceptions without an errno
+    errors: Dict[str, int] = field(default_factory=dict)
+    #: Bytes returned, by reads
+    bytes: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    #: The number of calls in each of ``LATENCY_BUCKETS`` (and one more, for
+    #: calls slower than the last bucket)
+    histogram: List[int] = field(
+        default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1)
+    )
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return these stats as a JSON-serialisable dict."""
+        return {
+            "calls": self.calls,
+            "errors": dict(self.errors),
+            "bytes": self.bytes,
+            "total_seconds": self.total_seconds,
+            "max_seconds": self.max_seconds,
+            "histogram": {
+                _bucket_label(index): count
+                for index, count in enumerate(self.histogram)
+            },
+        }
+
+
+class Instrumentation:
+    """Records the calls made to a ``TreeFuseFS``, and to its provider.
+
+    Pass one to ``TreeFuseFS`` (or ``treefuse_main``) as ``instrumentation``
+    to enable instrumentation, and read what has been recorded with
+    :py:meth:`operations` and :py:meth:`provider_calls` (e.g. from a thread
+    started by ``on_mount``), or :py:meth:`as_dict`.  Without one, nothing is
+    recorded, and nothing is added to the cost of serving the filesystem.
+
+    This is thread-safe.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._operations: Dict[str, OperationStats] = {}
+        self._provider_calls: Dict[str, OperationStats] = {}
+        self.started = time.time()
+
+    def record(
+        self,
+        name: str,
+        seconds: float,
+        error: Optional[str] = None,
+        nbytes: int = 0,
+        provider: bool = False,
+    ) -> None:
+        """Record a call to ``name`` (a provider method, if ``provider``)."""
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        table = self._provider_calls if provider else self._operations
+        with self._lock:
+            stats = table.get(name)
+            if stats is None:
+                stats = table[name] = OperationStats()
+            stats.calls += 1
+            if error is not None:
+                stats.errors[error] = stats.errors.get(error, 0) + 1
+            stats.bytes += nbytes
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.histogram[bucket] += 1
+
+    def _copy(self, table: Dict[str, OperationStats]) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                name: OperationStats(
+                    stats.calls,
+                    dict(stats.errors),
+                    stats.bytes,
+                    stats.total_seconds,
+                    stats.max_seconds,
+                    list(stats.histogram),
+                )
+                for name, stats in table.items()
+            }
+
+    def operations(self) -> Dict[str, OperationStats]:
+        """Return a copy of the stats for each filesystem operation."""
+        return self._copy(self._operations)
+
+    def provider_calls(self) -> Dict[str, OperationStats]:
+        """Return a copy of the stats for each provider method."""
+        return self._copy(self._provider_calls)
+
+    def reset(self) -> None:
+        """Forget everything recorded so far."""
+        with self._lock:
+            self._operations.clear()
+            self._provider_calls.clear()
+            self.started = time.time()
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return everything recorded, as a JSON-serialisable dict."""
+        return {
+            "started": self.started,
+            "uptime_seconds": time.time() - self.started,
+            "operations": {
+                name: stats.as_dict()
+                for name, stats in sorted(self.operations().items())
+            },
+            "provider": {
+                name: stats.as_dict()
+                for name, stats in sorted(self.provider_calls().items())
+            },
+        }
+
+    def render(self) -> bytes:
+        """Return everything recorded as JSON, for the stats file."""
+        return json.dumps(self.as_dict(), indent=2).encode() + b"\n"
+
+    def wrap_operation(
+        self, name: str, function: Callable[..., Any]
+    ) -> Callable[..., Any]:
+        """Wrap the filesystem operation ``function``, to record its calls.
+
+        Negative ``int`` results are recorded as errors, as are ``OSError``\\ s
+        (and other exceptions); the size of buffer results is recorded as bytes
+        served.  Iterator results (from ``readdir``) are timed until they are
+        exhausted (or discarded).
+        """
+
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except BaseException as e:
+                self.record(name, time.perf_counter() - start, _error_for(e))
+                raise
+            if isinstance(result, int):
+                error = (
+                    errno.errorcode.get(-result, str(-result))
+                    if result < 0
+                    else None
+                )
+                self.record(name, time.perf_counter() - start, error)
+            elif isinstance(result, Iterator):
+                return self._timed_iterator(name, start, result)
+            else:
+                try:
+                    nbytes = memoryview(result).nbytes
+                except TypeError:
+                    nbytes = 0
+                self.record(name, time.perf_counter() - start, nbytes=nbytes)
+            return result
+
+        return wrapper
+
+    def _timed_iterator(
+        self, name: str, start: float, iterator: Iterator[Any]
+    ) -> Iterator[Any]:
+        error = None
+        try:
+            yield from iterator
+        except BaseException as e:
+            if not isinstance(e, GeneratorExit):
+                error = _error_for(e)
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, error)
+
+
+def _error_for(exception: BaseException) -> str:
+    """Return the name to record ``exception`` under."""
+    number = getattr(exception, "errno", None)
+    if isinstance(number, int) and number in errno.errorcode:
+        return errno.errorcode[number]
+    return type(exception).__name__
+
+
+class InstrumentedProvider(TreeFuseProvider):
+    """A ``TreeFuseProvider`` which times the calls made to another.
+
+    ``TreeFuseFS`` wraps its provider in one of these when it's given an
+    ``Instrumentation``, so that time spent in the provider can be told apart
+    from time spent in TreeFuse.  Iterating over children is included in the
+    time recorded for ``children_for`` and ``iter_children``.
+    """
+
+    def __init__(
+        self, provider: TreeFuseProvider, instrumentation: Instrumentation
+    ):
+        self.provider = provider
+        self.instrumentation = instrumentation
+        provider.add_change_callback(self.notify_change)
+
+    def _timed(self, name: str, function: Callable[..., Any]) -> Any:
+        start = time.perf_counter()
+        error = None
+        try:
+            return function()
+        except BaseException as e:
+            error = _error_for(e)
+            raise
+        finally:
+            self.instrumentation.record(
+                name, time.perf_counter() - start, error, provider=True
+            )
+
+    def _rebind(self, node: TreeFuseNode) -> TreeFuseNode:
+        return _rebind_provider_content(node, self.provider, self)
+
+    def _timed_children(
+        self, name: str, children: Callable[[], Iterable[TreeFuseNode]]
+    ) -> Iterator[TreeFuseNode]:
+        start = time.perf_counter()
+        error = None
+        try:
+            for child in children():
+                yield self._rebind(child)
+        except GeneratorExit:
+            raise
+        except BaseException as e:
+            error = _error_for(e)
+            raise
+        finally:
+            self.instrumentation.record(
+                name, time.perf_counter() - start, error, provider=True
+            )
+
+    def children_for(self, path: str) -> Iterable[TreeFuseNode]:
+        return self._timed_children(
+            "children_for", lambda: self.provider.children_for(path)
+        )
+
+    def iter_children(
+        self, path: str, offset: int = 0
+    ) -> Iterator[TreeFuseNode]:
+        return self._timed_children(
+            "iter_children", lambda: self.provider.iter_children(path, offset)
+        )
+
+    def stat_children(
+        self, path: str
+    ) -> Optional[Iterable[Tuple[str, TreeFuseStat]]]:
+        def stat_children() -> Optional[List[Tuple[str, TreeFuseStat]]]:
+            children = self.provider.stat_children(path)
+            return None if children is None else list(children)
+
+        children: Optional[List[Tuple[str, TreeFuseStat]]] = self._timed(
+            "stat_children", stat_children
+        )
+        return children
+
+    def is_directory(self, path: str) -> bool:
+        return bool(
+            self._timed(
+                "is_directory", lambda: self.provider.is_directory(path)
+            )
+        )
+
+    def lookup_path(self, path: str) -> Optional[TreeFuseNode]:
+        node = self._timed(
+            "lookup_path", lambda: self.provider.lookup_path(path)
+        )
+        return None if node is None else self._rebind(node)
+
+    def size_of(self, path: str) -> int:
+        return int(
+            self._timed("size_of", lambda: self.provider.size_of(path))
+        )
+
+    def read_range(self, path: str, offset: int, size: int) -> Buffer:
+        content: Buffer = self._timed(
+            "read_range",
+            lambda: self.provider.read_range(path, offset, size),
+        )
+        return content
+
+
+class _StatsContent(TreeFuseContent):
+    """The stats file's content, rendered when it's read from its start.
+
+    Each open of the file has its own, so the reads which follow that one see
+    the same rendering.
+    """
+
+    def __init__(self, provider: "StatsFileProvider"):
+        self.provider = provider
+        self._rendered: Optional[bytes] = None
+
+    @property
+    def size(self) -> int:
+        if self._rendered is None:
+            # Not read yet: rather than rendering it, report the last size
+            return self.provider._rendered_size
+        return len(self._rendered)
+
+    def read(self, offset: int, size: int) -> Buffer:
+        rendered = self._rendered
+        if rendered is None or offset == 0:
+            rendered = self.provider.instrumentation.render()
+            self._rendered = rendered
+            self.provider._rendered_size = len(rendered)
+        return memoryview(rendered)[offset:offset + size]
+
+
+class StatsFileProvider(TreeFuseProvider):
+    """A ``TreeFuseProvider`` which adds a stats file to another's tree.
+
+    The file, at ``STATS_FILE`` (``/.treefuse/stats``), contains what
+    ``instrumentation`` has recorded, rendered as JSON when it's read from its
+    start (so lookups of it, and ``getattr``, don't render it).
+    Its directory isn't listed in the root directory (so that it doesn't
+    surprise tools walking the tree), but can be listed itself.
+    ``TreeFuseFS`` adds this when it's passed ``stats_file=True``.
+    """
+
+    def __init__(
+        self, provider: TreeFuseProvider, instrumentation: Instrumentation
+    ):
+        self.provider = provider
+        self.instrumentation = instrumentation
+        # The size of the stats file when it was last rendered
+        self._rendered_size = 0
+        provider.add_change_callback(self.notify_change)
+
+    def _stats_node(self) -> TreeFuseNode:
+        return TreeFuseNode(
+            os.path.basename(STATS_FILE),
+            _StatsContent(self),
+            # The content is rendered afresh as it's read, so it mustn't be
+            # cached, or truncated to the size it had when stat-ed
+            TreeFuseStat.for_file(keep_cache=False, direct_io=True),
+            is_directory=False,
+        )
+
+    def _rebind(self, node: TreeFuseNode) -> TreeFuseNode:
+        return _rebind_provider_content(node, self.provider, self)
+
+    def children_for(self, path: str) -> Iterable[TreeFuseNode]:
+        return self.iter_children(path)
+
+    def iter_children(
+        self, path: str, offset: int = 0
+    ) -> Iterator[TreeFuseNode]:
+        if path == STATS_DIRECTORY:
+            return iter([self._stats_node()][offset:])
+        if path.startswith(STATS_DIRECTORY + os.path.sep):
+            return iter(())
+        return map(self._rebind, self.provider.iter_children(path, offset))
+
+    def stat_children(
+        self, path: str
+    ) -> Optional[Iterable[Tuple[str, TreeFuseStat]]]:
+        if path == STATS_DIRECTORY or path.startswith(
+            STATS_DIRECTORY + os.path.sep
+        ):
+            # Ours, not the provider's: listed via iter_children instead
+            return None
+        return self.provider.stat_children(path)
+
+    def is_directory(self, path: str) -> bool:
+        if path == STATS_DIRECTORY:
+            return True
+        if path.startswith(STATS_DIRECTORY + os.path.sep):
+            return False
+        return self.provider.is_directory(path)
+
+    def lookup_path(self, path: str) -> Optional[TreeFuseNode]:
+        if path == STATS_DIRECTORY:
+            return TreeFuseNode(
+                os.path.basename(STATS_DIRECTORY),
+                None,
+                TreeFuseStat.for_directory(mode=0o555),
+                is_directory=True,
+            )
+        if path == STATS_FILE:
+            return self._stats_node()
+        if path.startswith(STATS_DIRECTORY + os.path.sep):
+            return None
+        node = self.provider.lookup_path(path)
+        return None if node is None else self._rebind(node)
+
+    def size_of(self, path: str) -> int:
+        return self.provider.size_of(path)
+
+    def read_range(self, path: str, offset: int, size: int) -> Buffer:
+        return self.provider.read_range(path, offset, size)
@@ -0,0 +1,411 @@
+"""
+``PrefetchingProvider``, which reads content ahead of the reads which need it.
+"""
+import concurrent.futures
+import dataclasses
+import functools
+import os.path
+import stat
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional, Tuple
+
+from .content import FileContent
+from .treefuse import (
+    Buffer,
+    TreeFuseContent,
+    TreeFuseNode,
+    TreeFuseProvider,
+    TreeFuseStat,
+)
+
+# How many files' read positions we remember, to spot sequential reads
+_MAX_POSITIONS = 1024
+
+# (path, chunk index)
+_ChunkKey = Tuple[str, int]
+
+
+@dataclass
+class PrefetchStats:
+    """Counters for the reads served by a ``PrefetchingProvider``."""
+
+    #: Reads served entirely from prefetched chunks
+    hits: int = 0
+    #: Reads which had to go to the content itself
+    misses: int = 0
+    #: Chunks prefetched
+    prefetched: int = 0
+    #: Prefetched chunks evicted before they were read
+    wasted: int = 0
+
+
+@dataclass
+class _Chunk:
+    """A chunk being (or which has been) prefetched."""
+
+    future: "Future[bytes]"
+    #: What the chunk counts towards max_bytes: chunk_size until it's fetched
+    nbytes: int
+
+
+class _PrefetchedContent(TreeFuseContent):
+    """Content which is read through a ``PrefetchingProvider``."""
+
+    def __init__(
+        self,
+        prefetcher: "PrefetchingProvider",
+        path: str,
+        content: TreeFuseContent,
+    ):
+        self.prefetcher = prefetcher
+        self.path = path
+        self.content = content
+
+    @property
+    def size(self) -> int:
+        return self.content.size
+
+    def read(self, offset: int, size: int) -> Buffer:
+        return self.prefetcher._read(self.path, self.content, offset, size)
+
+
+class PrefetchingProvider(TreeFuseProvider):
+    """A ``TreeFuseProvider`` which prefetches another's content.
+
+    Content which is expensive to produce (generated by the provider's
+    ``read_range``, or any other ``TreeFuseContent``) is otherwise only
+    produced when a read reaches it, so workloads which read many files in
+    turn (``tar``, ``grep -r``, backups) wait for each.  This reads ahead of
+    them, in chunks of ``chunk_size`` bytes, on a pool of ``workers``
+    threads:
+
+    * when a directory listing starts, the first chunk of each of (up to
+      ``max_siblings`` of) its first files is prefetched;
+    * when a file is read sequentially (from its start, or from where the
+      previous read of it ended), the next ``readahead`` chunks are
+      prefetched.
+
+    Reads which are covered by prefetched chunks are served from them (waiting
+    for any which are still being fetched); others read the content directly,
+    as they would have without this.  Prefetched chunks are dropped once a
+    read has reached their end, and are otherwise evicted (least recently used
+    first) to keep their total size within ``max_bytes``: when that's full of
+    chunks still being fetched, no more are prefetched until it isn't.
+
+    Buffer content (already in memory) and ``FileContent`` (which the kernel
+    reads ahead itself) aren't prefetched.  Changes which ``provider`` reports
+    via ``notify_change`` drop what has been prefetched for those paths.
+
+    :param provider:
+        The provider whose content to prefetch.  It must be thread-safe.
+    :param workers:
+        The number of threads to prefetch on.
+    :param max_bytes:
+        The maximum total size of prefetched chunks to hold.
+    :param chunk_size:
+        The size of the chunks to prefetch.
+    :param readahead:
+        The number of chunks to prefetch ahead of sequential reads.
+    :param max_siblings:
+        The maximum number of files to prefetch the start of when their
+        directory is listed; 0 disables this.
+    """
+
+    def __init__(
+        self,
+        provider: TreeFuseProvider,
+        workers: int = 4,
+        max_bytes: int = 64 * 1024 * 1024,
+        chunk_size: int = 128 * 1024,
+        readahead: int = 4,
+        max_siblings: int = 16,
+    ):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        self.provider = provider
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.readahead = readahead
+        self.max_siblings = max_siblings
+        self.stats = PrefetchStats()
+        self._chunks: "OrderedDict[_ChunkKey, _Chunk]" = OrderedDict()
+        self._nbytes = 0
+        # path -> where the last read of it ended
+        self._positions: "OrderedDict[str, int]" = OrderedDict()
+        # Re-entrant, as cancelling a fetch runs _fetched (which takes it)
+        # immediately
+        self._lock = threading.RLock()
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._pid: Optional[int] = None
+        provider.add_change_callback(self._provider_changed)
+
+    @property
+    def nbytes(self) -> int:
+        """The total size of the chunks held (or being fetched)."""
+        return self._nbytes
+
+    def close(self) -> None:
+        """Shut down the prefetching threads, if they have been started."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            if executor is None or self._pid != os.getpid():
+                return
+            # Don't wait for queued prefetches
+            for chunk in list(self._chunks.values()):
+                chunk.future.cancel()
+        executor.shutdown()
+
+    def _provider_changed(self, path: str) -> None:
+        self.invalidate(path)
+        self.notify_change(path)
+
+    def invalidate(self, path: str) -> None:
+        """Drop what has been prefetched for ``path`` and any path beneath it.
+
+        (Fetches still in progress complete, but their chunks are discarded.)
+        """
+        prefix = path.rstrip(os.path.sep) + os.path.sep
+        with self._lock:
+            for key in list(self._chunks):
+                if key[0] == path or key[0].startswith(prefix):
+                    self._remove(key)
+            self._positions.pop(path, None)
+
+    # Prefetching
+
+    def _remove(self, key: _ChunkKey) -> None:
+        """Remove ``key`` from ``_chunks``; the lock must be held."""
+        self._nbytes -= self._chunks.pop(key).nbytes
+
+    def _make_room(self) -> bool:
+        """Evict fetched chunks until there's room for another.
+
+        The lock must be held.  Returns ``False`` if there isn't room, as
+        too many chunks are still being fetched.
+        """
+        if self._nbytes + self.chunk_size <= self.max_bytes:
+            return True
+        for key in list(self._chunks):
+            if self._chunks[key].future.done():
+                self._remove(key)
+                self.stats.wasted += 1
+                if self._nbytes + self.chunk_size <= self.max_bytes:
+                    return True
+        return False
+
+    def _ensure_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """Return our thread pool; the lock must be held."""
+        # As with ThreadPoolProvider, (re)create the pool lazily so its
+        # threads live in the process serving the mount.
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self.workers, thread_name_prefix="treefuse-prefetch"
+            )
+            self._pid = os.getpid()
+        return self._executor
+
+    def _prefetch(
+        self, path: str, content: TreeFuseContent, indexes: Iterable[int]
+    ) -> None:
+        """Start fetching the chunks at ``indexes`` of ``path``'s content."""
+        with self._lock:
+            for index in indexes:
+                key = (path, index)
+                if key in self._chunks:
+                    continue
+                if not self._make_room():
+                    return
+                chunk = _Chunk(
+                    self._ensure_executor().submit(
+                        self._fetch, content, index
+                    ),
+                    self.chunk_size,
+                )
+                self._chunks[key] = chunk
+                self._nbytes += chunk.nbytes
+                self.stats.prefetched += 1
+                chunk.future.add_done_callback(
+                    functools.partial(self._fetched, key, chunk)
+                )
+
+    def _fetch(self, content: TreeFuseContent, index: int) -> bytes:
+        # Copied, so that we don't hold views of the content's buffers
+        return bytes(content.read(index * self.chunk_size, self.chunk_size))
+
+    def _fetched(
+        self, key: _ChunkKey, chunk: _Chunk, future: "Future[bytes]"
+    ) -> None:
+        """Account for the completed fetch of ``chunk``, at ``key``."""
+        with self._lock:
+            if self._chunks.get(key) is not chunk:
+                # Invalidated (or evicted) while it was being fetched
+                return
+            if future.cancelled() or future.exception() is not None:
+                # Reads of it will read the content directly
+                self._remove(key)
+                return
+            nbytes = len(future.result())
+            self._nbytes += nbytes - chunk.nbytes
+            chunk.nbytes = nbytes
+
+    # Reading
+
+    def _take_chunk(self, path: str, index: int) -> Optional["Future[bytes]"]:
+        """Return the fetch of chunk ``index`` of ``path``, if it's held.
+
+        If it hasn't started yet, it's cancelled and ``None`` returned instead:
+        reading directly will be quicker than waiting for the fetches queued
+        before it.
+        """
+        with self._lock:
+            chunk = self._chunks.get((path, index))
+            if chunk is None:
+                return None
+            if not chunk.future.running() and chunk.future.cancel():
+                # (This has run _fetched, which has removed it)
+                return None
+            self._chunks.move_to_end((path, index))
+            return chunk.future
+
+    def _read_chunks(
+        self, path: str, offset: int, size: int
+    ) -> Optional[Buffer]:
+        """Read from prefetched chunks of ``path``, if they cover the range."""
+        first = offset // self.chunk_size
+        last = (offset + size - 1) // self.chunk_size
+        chunks = []
+        for index in range(first, last + 1):
+            future = self._take_chunk(path, index)
+            if future is None:
+                return None
+            try:
+                chunks.append(future.result())
+            except Exception:
+                # Read directly, so that the reader sees the error
+                return None
+            if len(chunks[-1]) < self.chunk_size:
+                # The end of the content
+                break
+        start = offset - first * self.chunk_size
+        joined = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+        return memoryview(joined)[start:start + size]
+
+    def _read(
+        self, path: str, content: TreeFuseContent, offset: int, size: int
+    ) -> Buffer:
+        """Read from ``content`` (at ``path``), via prefetched chunks."""
+        if size <= 0:
+            return b""
+        data = self._read_chunks(path, offset, size)
+        hit = data is not None
+        if data is None:
+            data = content.read(offset, size)
+
+        end = offset + memoryview(data).nbytes
+        with self._lock:
+            if hit:
+                self.stats.hits += 1
+                # Drop the chunks this read has reached the end of (including
+                # the last, if it reached the end of the content)
+                first = offset // self.chunk_size
+                reached = end // self.chunk_size
+                if end < offset + size:
+                    reached = -(-end // self.chunk_size)
+                for index in range(first, reached):
+                    if (path, index) in self._chunks:
+                        self._remove((path, index))
+            else:
+                self.stats.misses += 1
+            sequential = offset == 0 or self._positions.get(path) == offset
+            self._positions[path] = end
+            self._positions.move_to_end(path)
+            while len(self._positions) > _MAX_POSITIONS:
+                self._positions.popitem(last=False)
+        if sequential and end == offset + size and self.readahead:
+            # Not at the end of the content: read ahead of the reader
+            next_chunk = end // self.chunk_size
+            self._prefetch(
+                path, content, range(next_chunk, next_chunk + self.readahead)
+            )
+        return data
+
+    # TreeFuseProvider
+
+    def _wrap(self, path: str, node: TreeFuseNode) -> TreeFuseNode:
+        """Route reads of ``node``'s content through us, if we prefetch it."""
+        content = node._content
+        if not isinstance(content, TreeFuseContent) or isinstance(
+            content, FileContent
+        ):
+            return node
+        return dataclasses.replace(
+            node, _content=_PrefetchedContent(self, path, content)
+        )
+
+    def children_for(self, path: str) -> Iterable[TreeFuseNode]:
+        return [
+            self._wrap(os.path.join(path, child.name), child)
+            for child in self.provider.children_for(path)
+        ]
+
+    def _prefetch_start(self, node: TreeFuseNode) -> bool:
+        """Prefetch the first chunk of ``node``, if we prefetch its content."""
+        content = node._content
+        if not isinstance(content, _PrefetchedContent) or node.is_directory:
+            return False
+        self._prefetch(content.path, content.content, [0])
+        return True
+
+    def iter_children(
+        self, path: str, offset: int = 0
+    ) -> Iterator[TreeFuseNode]:
+        # Only as a listing starts: resumed listings' batches would otherwise
+        # each prefetch the next files' starts
+        siblings = self.max_siblings if offset == 0 else 0
+        for child in self.provider.iter_children(path, offset):
+            child = self._wrap(os.path.join(path, child.name), child)
+            if siblings and self._prefetch_start(child):
+                siblings -= 1
+            yield child
+
+    def stat_children(
+        self, path: str
+    ) -> Optional[Iterable[Tuple[str, TreeFuseStat]]]:
+        children = self.provider.stat_children(path)
+        if children is None or not self.max_siblings:
+            return children
+        children = list(children)
+        # Listings which use these don't see the children's content, so look
+        # up the files to prefetch the starts of
+        files = (
+            os.path.join(path, name)
+            for name, st in children
+            if stat.S_ISREG(st.st_mode)
+        )
+        siblings = self.max_siblings
+        for child_path in files:
+            if not siblings:
+                break
+            node = self.lookup_path(child_path)
+            if node is not None and self._prefetch_start(node):
+                siblings -= 1
+        return children
+
+    def is_directory(self, path: str) -> bool:
+        return self.provider.is_directory(path)
+
+    def lookup_path(self, path: str) -> Optional[TreeFuseNode]:
+        node = self.provider.lookup_path(path)
+        return None if node is None else self._wrap(path, node)
+
+    def size_of(self, path: str) -> int:
+        return self.provider.size_of(path)
+
+    def read_range(self, path: str, offset: int, size: int) -> Buffer:
+        return self.provider.read_range(path, offset, size)
@@ -0,0 +1,347 @@
+"""
+``Profiler``, which profiles the operations served by a ``TreeFuseFS``.
+"""
+import cProfile
+import collections
+import os
+import pstats
+import signal
+import sys
+import tempfile
+import threading
+import time
+from types import FrameType
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from .treefuse import _INSTRUMENTED_OPERATIONS
+
+MODES = ("cprofile", "sampling")
+
+
+class _Call:
+    """The profiling state of one call to an operation."""
+
+    def __init__(self, profiler: "Profiler", operation: str):
+        self.profiler = profiler
+        self.operation = operation
+        self.start = time.perf_counter()
+        self.running = False
+        # With a slow-call threshold, what's recorded for this call is kept
+        # here until we know whether it was slow enough to keep
+        self.profile: Optional[cProfile.Profile] = None
+        self.samples: List[str] = []
+
+    def resume(self) -> None:
+        self.profiler._resume(self)
+
+    def pause(self) -> None:
+        self.profiler._pause(self)
+
+    def finish(self) -> None:
+        self.profiler._finish(self, time.perf_counter() - self.start)
+
+
+class Profiler:
+    """Profiles the operations served by a ``TreeFuseFS``, while it's mounted.
+
+    Pass one to ``TreeFuseFS`` (or ``treefuse_main``) as ``profiler``.  The
+    profile is written to ``output`` when the filesystem is unmounted, and
+    whenever the serving process receives ``dump_signal``.
+
+    :param output:
+        The path to write the profile to.  In ``"cprofile"`` mode, this is a
+        ``pstats`` file (see :py:mod:`pstats`, or use a viewer such as
+        snakeviz); in ``"sampling"`` mode, it's a text file of "folded"
+        stacks, one per line with the number of samples taken in it (which
+        flame graph tools, such as speedscope, can read).
+    :param mode:
+        ``"cprofile"`` profiles every function call made while serving the
+        selected operations, deterministically.  ``"sampling"`` instead
+        records the stack of each thread serving one every
+        ``sample_interval`` seconds, which costs much less (but, being
+        statistical, needs longer runs).
+    :param operations:
+        The names of the ``TreeFuseFS`` operations to profile (e.g.
+        ``["read"]``); by default, all of them.
+    :param slow_threshold:
+        If given, only calls taking at least this long (in seconds) are
+        included in the profile.
+    :param sample_interval:
+        How often (in seconds) stacks are sampled, in ``"sampling"`` mode.
+    :param dump_signal:
+        The signal which makes the serving process write the profile so far,
+        or ``None`` to only write it on unmount.
+
+    In ``"cprofile"`` mode, Python 3.12+ only allows one thread to be
+    profiled at a time: calls which overlap a profiled call are served
+    without being profiled.  Use ``"sampling"`` mode (or pass
+    ``multithreaded=False`` to ``treefuse_main``) to profile every call.
+    """
+
+    def __init__(
+        self,
+        output: "os.PathLike[str] | str",
+        mode: str = "cprofile",
+        operations: Optional[Iterable[str]] = None,
+        slow_threshold: Optional[float] = None,
+        sample_interval: float = 0.005,
+        dump_signal: Optional[int] = signal.SIGUSR1,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        self.operations = (
+            set(_INSTRUMENTED_OPERATIONS)
+            if operations is None
+            else set(operations)
+        )
+        unknown = self.operations - set(_INSTRUMENTED_OPERATIONS)
+        if unknown:
+            raise ValueError(f"Unknown operations: {', '.join(unknown)}")
+        self.output = os.path.abspath(output)
+        self.mode = mode
+        self.slow_threshold = slow_threshold
+        self.sample_interval = sample_interval
+        self.dump_signal = dump_signal
+        #: The number of calls which couldn't be profiled, because another
+        #: profiler was active (see above)
+        self.skipped = 0
+
+        self._lock = threading.Lock()
+        # cprofile mode: a profile per thread, by thread ID (or, with a
+        # slow_threshold, the merged profiles of the slow calls).  Not a
+        # threading.local: python-fuse serves each call from a new Python
+        # thread state (on one of libfuse's threads), so that would be a new
+        # profile per call.
+        self._profiles: Dict[int, Tuple[threading.Lock, cProfile.Profile]] = {}
+        self._slow_stats: Optional[pstats.Stats] = None
+        # sampling mode: the calls in progress (by thread ID), and how many
+        # times each folded stack has been sampled
+        self._active: Dict[int, _Call] = {}
+        self._samples: "collections.Counter[str]" = collections.Counter()
+        self._stopped = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    # Hooks called by TreeFuseFS
+
+    def wrap_operation(
+        self, name: str, function: Callable[..., Any]
+    ) -> Callable[..., Any]:
+        """Wrap ``function`` to profile it, if ``name`` is to be profiled.
+
+        Iterator results (from ``readdir``) are profiled while they're being
+        iterated over, too.
+        """
+        if name not in self.operations:
+            return function
+
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            call = _Call(self, name)
+            call.resume()
+            try:
+                result = function(*args, **kwargs)
+            except BaseException:
+                call.pause()
+                call.finish()
+                raise
+            call.pause()
+            if isinstance(result, Iterator):
+                return self._profiled_iterator(call, result)
+            call.finish()
+            return result
+
+        return wrapper
+
+    def block_signal(self) -> None:
+        """Block ``dump_signal``, so that only our watcher thread receives it.
+
+        This must be called from the main thread before serving starts (so
+        that the threads which serve the filesystem inherit the mask).
+        """
+        if self.dump_signal is not None:
+            signal.pthread_sigmask(signal.SIG_BLOCK, {self.dump_signal})
+
+    def start(self) -> None:
+        """Start our threads, in the process serving the filesystem."""
+        if self.mode == "sampling":
+            self._sampler = threading.Thread(
+                target=self._sample_until_stopped,
+                name="treefuse-sampler",
+                daemon=True,
+            )
+            self._sampler.start()
+        if self.dump_signal is not None:
+            threading.Thread(
+                target=self._write_on_signal,
+                name="treefuse-profile-signal",
+                daemon=True,
+            ).start()
+
+    def stop(self) -> None:
+        """Stop profiling, and write the profile."""
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.write()
+
+    def write(self) -> None:
+        """Write the profile recorded so far to ``output``."""
+        directory, name = os.path.split(self.output)
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix=name)
+        os.close(fd)
+        try:
+            if self.mode == "cprofile":
+                self._stats().dump_stats(temporary)
+            else:
+                with open(temporary, "w") as output:
+                    for stack, count in sorted(self._sample_counts().items()):
+                        output.write(f"{stack} {count}\n")
+            os.replace(temporary, self.output)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    # cprofile and sampling mode implementations
+
+    def _thread_profile(self) -> Tuple[threading.Lock, cProfile.Profile]:
+        ident = threading.get_ident()
+        with self._lock:
+            entry = self._profiles.get(ident)
+            if entry is None:
+                entry = self._profiles[ident] = (
+                    threading.Lock(),
+                    cProfile.Profile(),
+                )
+        return entry
+
+    def _resume(self, call: _Call) -> None:
+        call.running = True
+        if self.mode == "sampling":
+            with self._lock:
+                self._active[threading.get_ident()] = call
+            return
+        if self.slow_threshold is None:
+            lock, profile = self._thread_profile()
+            # Released by _pause: this stops write() from reading the profile
+            # while it's enabled
+            lock.acquire()
+        else:
+            if call.profile is None:
+                call.profile = cProfile.Profile()
+            profile = call.profile
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active (on Python 3.12+)
+            call.running = False
+            with self._lock:
+                self.skipped += 1
+            if self.slow_threshold is None:
+                lock.release()
+
+    def _pause(self, call: _Call) -> None:
+        if not call.running:
+            return
+        call.running = False
+        if self.mode == "sampling":
+            with self._lock:
+                self._active.pop(threading.get_ident(), None)
+        elif self.slow_threshold is None:
+            lock, profile = self._thread_profile()
+            profile.disable()
+            lock.release()
+        else:
+            assert call.profile is not None
+            call.profile.disable()
+
+    def _finish(self, call: _Call, seconds: float) -> None:
+        if self.slow_threshold is None or seconds < self.slow_threshold:
+            return
+        with self._lock:
+            if self.mode == "sampling":
+                self._samples.update(call.samples)
+            elif call.profile is not None:
+                stats = pstats.Stats(call.profile)
+                if self._slow_stats is None:
+                    self._slow_stats = stats
+                else:
+                    self._slow_stats.add(stats)
+
+    def _profiled_iterator(
+        self, call: _Call, iterator: Iterator[Any]
+    ) -> Iterator[Any]:
+        try:
+            while True:
+                call.resume()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    call.pause()
+                yield item
+        finally:
+            call.finish()
+
+    def _stats(self) -> pstats.Stats:
+        """Merge what has been profiled so far into one ``pstats.Stats``."""
+        stats = pstats.Stats()
+        with self._lock:
+            profiles = list(self._profiles.values())
+            if self._slow_stats is not None:
+                stats.add(self._slow_stats)
+        for lock, profile in profiles:
+            with lock:
+                profile.create_stats()
+                if profile.stats:
+                    stats.add(profile)
+        return stats
+
+    def _sample_counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._samples)
+
+    def _sample_until_stopped(self) -> None:
+        while not self._stopped.wait(self.sample_interval):
+            self._sample()
+
+    def _sample(self) -> None:
+        frames = sys._current_frames()
+        with self._lock:
+            for thread_id, call in self._active.items():
+                frame = frames.get(thread_id)
+                if frame is None or not call.running:
+                    continue
+                stack = ";".join([call.operation] + _folded_frames(frame))
+                if self.slow_threshold is None:
+                    self._samples[stack] += 1
+                else:
+                    call.samples.append(stack)
+
+    def _write_on_signal(self) -> None:
+        assert self.dump_signal is not None
+        while not self._stopped.is_set():
+            signal.sigwait({self.dump_signal})
+            self.write()
+
+
+def _folded_frames(frame: Optional[FrameType]) -> List[str]:
+    """Return ``frame``'s stack, outermost first, as "file:function:line"."""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(
+            f"{os.path.basename(code.co_filename)}:{code.co_name}"
+            f":{frame.f_lineno}"
+        )
+        frame = frame.f_back
+    stack.reverse()
+    return stack
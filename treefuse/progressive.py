@@ -0,0 +1,291 @@
+"""
+``ProgressiveProvider``, which serves a tree while it's still being populated.
+"""
+import dataclasses
+import os
+import stat
+import threading
+import time
+from typing import Callable, Iterable, Iterator, Optional, Set
+
+import treelib
+
+from .blobs import BlobStore
+from .frozen import FrozenTreeEntry
+from .treefuse import TreeFuseNode, TreelibProvider
+
+
+class ProgressiveProvider(TreelibProvider):
+    """A ``TreelibProvider`` which is populated while it's being served.
+
+    The filesystem can be mounted as soon as this is constructed, with
+    whatever is in ``tree`` (by default, just the root directory), while
+    ``producer`` is consumed on a background thread, adding each of its
+    entries (paths, or ``(path, data)`` tuples, as for
+    ``FrozenTreeProvider``) to the tree as it's produced.  Directories are
+    created for each path's ancestors, so only the files need to be given.
+
+    Until a directory is known to be complete, lookups of paths in it which
+    don't exist yet wait (for up to ``wait_timeout`` seconds) for them to be
+    added, and listings of it wait (for up to ``listing_timeout`` seconds, by
+    default not at all) for it to be completed.  A directory is
+    complete once :py:meth:`mark_complete` has been called for it, and every
+    directory is once ``producer`` is exhausted.  Producers which produce a
+    directory at a time should call :py:meth:`mark_complete` as they finish
+    each one, so that lookups of paths which don't exist fail without waiting.
+
+    Alternatively (or as well), ``populate`` is called with the path of each
+    incomplete directory when it's first needed, and returns the entries to
+    add to it (with paths relative to it), after which it's complete.  Trees
+    can then be populated entirely on demand, by passing ``populate`` without
+    a ``producer``: subdirectories whose children aren't returned with them
+    must be given a directory's ``TreeFuseStat`` (e.g.
+    ``("subdirectory", (None, TreeFuseStat.for_directory()))``), so that
+    they're populated in turn.
+
+    Lookups which time out fail as though the path doesn't exist, and
+    listings which time out list the children added so far.  Existing nodes
+    are served immediately, without waiting: a node without children is a
+    file unless its ``TreeFuseStat`` is a directory's.  As each waiting
+    lookup holds one of the FUSE library's worker threads, at most
+    ``max_waiting`` wait at once: any others are served from the tree as it
+    is.
+
+    The producer thread is started by the first lookup, so that it runs in
+    the process serving the mount.  If ``producer`` raises an exception, it's
+    stored as :py:attr:`error`, and the tree is served as it is.
+
+    :param producer:
+        The entries to add to the tree.
+    :param tree:
+        The tree to start with.
+    :param wait_timeout:
+        The maximum time, in seconds, to wait for a path to be added.
+    :param listing_timeout:
+        The maximum time, in seconds, to wait for a directory to be completed
+        before listing it.
+    :param max_waiting:
+        The maximum number of lookups and listings to wait at once.
+    :param populate:
+        If given, called to populate incomplete directories on demand.
+    :param blob_store:
+        As for ``TreelibProvider``.
+    """
+
+    def __init__(
+        self,
+        producer: Iterable[FrozenTreeEntry] = (),
+        tree: Optional[treelib.Tree] = None,
+        wait_timeout: float = 5.0,
+        listing_timeout: float = 0.0,
+        max_waiting: int = 4,
+        populate: Optional[Callable[[str], Iterable[FrozenTreeEntry]]] = None,
+        blob_store: Optional[BlobStore] = None,
+    ):
+        if wait_timeout < 0:
+            raise ValueError("wait_timeout must not be negative")
+        if listing_timeout < 0:
+            raise ValueError("listing_timeout must not be negative")
+        if max_waiting < 0:
+            raise ValueError("max_waiting must not be negative")
+        if tree is None:
+            tree = treelib.Tree()
+            tree.create_node("root")
+        elif tree.root is None:
+            raise ValueError("Cannot populate an empty tree")
+        super().__init__(tree, blob_store)
+        self.producer = producer
+        self.wait_timeout = wait_timeout
+        self.listing_timeout = listing_timeout
+        self.max_waiting = max_waiting
+        self.populate = populate
+        #: The exception ``producer`` raised, if any
+        self.error: Optional[BaseException] = None
+        self._condition = threading.Condition()
+        self._complete: Set[str] = set()
+        self._populating: Set[str] = set()
+        # The number of threads waiting on _condition in _wait
+        self._waiting = 0
+        self._finished = False
+        # Set (under _condition) once lookups have nothing left to wait for,
+        # so that _wait can return without taking it
+        self._done = False
+        self._pid: Optional[int] = None
+
+    @property
+    def finished(self) -> bool:
+        """Has ``producer`` been exhausted (or failed)?"""
+        return self._finished
+
+    def notify_change(self, path: str) -> None:
+        super().notify_change(path)
+        # Wake lookups waiting for paths to be added
+        with self._condition:
+            self._condition.notify_all()
+
+    def _ensure_producer(self) -> None:
+        """Start consuming ``producer``, if we haven't in this process."""
+        if self._finished or self._pid == os.getpid():
+            return
+        with self._condition:
+            # As with ThreadPoolProvider, start the thread lazily so that it
+            # runs in the process serving the mount.
+            if self._finished or self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(
+                target=self._produce, name="treefuse-producer", daemon=True
+            ).start()
+
+    def _produce(self) -> None:
+        try:
+            for entry in self.producer:
+                self.add_entry(entry)
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._condition:
+                self._finished = True
+                self._done = self.populate is None
+                self._condition.notify_all()
+
+    def add_entry(self, entry: FrozenTreeEntry) -> None:
+        """Add ``entry`` (a path, or a ``(path, data)`` tuple) to the tree.
+
+        Directories are created for the path's ancestors.  If the path exists
+        already, ``data`` is only used if the node has none (e.g. a
+        directory's stat, given after its children): otherwise, the first
+        entry for a path wins.
+        """
+        if isinstance(entry, tuple):
+            path, data = entry
+        else:
+            path, data = entry, None
+        components = [part for part in path.split(os.path.sep) if part]
+        with self._condition:
+            parent_path = os.path.sep
+            for depth, name in enumerate(components):
+                is_leaf = depth == len(components) - 1
+                current_path = os.path.join(parent_path, name)
+                with self._lock.read_locked():
+                    node = self._lookup_path(current_path)
+                if node is None:
+                    self.add_node(parent_path, name, data if is_leaf else None)
+                elif is_leaf and node.data is None and data is not None:
+                    self.replace_node(current_path, data)
+                parent_path = current_path
+
+    def mark_complete(self, path: str) -> None:
+        """Record that every child of the directory ``path`` has been added.
+
+        Lookups of paths in it which don't exist then fail immediately, and
+        listings of it no longer wait.
+        """
+        with self._condition:
+            self._complete.add(self._normalise_path(path))
+            self._condition.notify_all()
+
+    def _is_directory_node(self, node: treelib.Node) -> bool:
+        if node.identifier == self._tree.root:
+            return True
+        if node.successors(self._tree.identifier):
+            return True
+        st = node.data[1] if isinstance(node.data, tuple) else None
+        if st is None or st.st_mode is None:
+            # Without a type, it's as TreelibProvider has it: childless, so
+            # a file
+            return False
+        return stat.S_ISDIR(st.st_mode)
+
+    def _pending_directory(self, path: str, listing: bool) -> Optional[str]:
+        """Return the directory whose children ``path`` is waiting for.
+
+        That's ``path`` itself if we're listing it, and otherwise its nearest
+        existing ancestor; ``None`` is returned if there's nothing to wait
+        for.  The condition must be held.
+        """
+        with self._lock.read_locked():
+            node = self._lookup_path(path)
+            if node is not None and not listing:
+                return None
+            directory = path
+            while node is None:
+                directory = os.path.dirname(directory)
+                node = self._lookup_path(directory)
+            if not self._is_directory_node(node):
+                # Files don't have children to wait for
+                return None
+        if directory in self._complete:
+            return None
+        if self._finished and self.populate is None:
+            return None
+        return directory
+
+    def _wait(self, path: str, listing: bool) -> None:
+        """Wait until ``path`` is added (or listed) or never will be."""
+        if self._done:
+            return
+        self._ensure_producer()
+        timeout = self.listing_timeout if listing else self.wait_timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._condition:
+                directory = self._pending_directory(path, listing)
+                if directory is None:
+                    return
+                if self.populate is None or directory in self._populating:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or self._waiting >= self.max_waiting:
+                        return
+                    self._waiting += 1
+                    try:
+                        self._condition.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                    continue
+                self._populating.add(directory)
+            self._populate_directory(directory)
+
+    def _populate_directory(self, directory: str) -> None:
+        """Populate ``directory`` with ``populate``, and mark it complete."""
+        assert self.populate is not None
+        try:
+            for entry in self.populate(directory):
+                if isinstance(entry, tuple):
+                    path, data = entry
+                    entry = (os.path.join(directory, path), data)
+                else:
+                    entry = os.path.join(directory, entry)
+                self.add_entry(entry)
+        finally:
+            with self._condition:
+                self._populating.discard(directory)
+                self._condition.notify_all()
+        self.mark_complete(directory)
+
+    def iter_children(
+        self, path: str, offset: int = 0
+    ) -> Iterator[TreeFuseNode]:
+        """As for ``TreelibProvider``, once ``path`` is complete (or the
+        ``listing_timeout`` has passed)."""
+        self._wait(self._normalise_path(path), listing=True)
+        return super().iter_children(path, offset)
+
+    def is_directory(self, path: str) -> bool:
+        node = self.lookup_path(path)
+        return node is not None and bool(node.is_directory)
+
+    def lookup_path(self, path: str) -> Optional[TreeFuseNode]:
+        """As for ``TreelibProvider``, once ``path`` has been added."""
+        self._wait(self._normalise_path(path), listing=False)
+        return super().lookup_path(path)
+
+    def _treelib_node_to_treefusenode(
+        self, node: treelib.Node
+    ) -> TreeFuseNode:
+        treefuse_node = super()._treelib_node_to_treefusenode(node)
+        if not treefuse_node.is_directory and self._is_directory_node(node):
+            treefuse_node = dataclasses.replace(
+                treefuse_node, is_directory=True
+            )
+        return treefuse_node
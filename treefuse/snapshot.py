@@ -0,0 +1,345 @@
+"""
+Snapshots: ``FrozenTreeProvider``\\ s compiled to a file, and mounted from it.
+"""
+import mmap
+import os
+import secrets
+import struct
+import sys
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import treelib
+
+from .content import FileContent
+from .frozen import FrozenTreeEntry, FrozenTreeProvider
+from .treefuse import TreeFuseContent, TreeFuseStat
+
+_MAGIC = b"TFSNAPSH"
+_VERSION = 1
+
+# The sections of a snapshot, in the order they're written.  The first eight
+# are FrozenTreeProvider's arrays and names.
+_SECTIONS = (
+    "first_child",
+    "child_count",
+    "name_ids",
+    "modes",
+    "sizes",
+    "offsets",
+    "name_offsets",
+    "names",
+    # _STAT_RECORDs for nodes whose stat couldn't be packed, by node index
+    "stats",
+    # _FILE_RECORDs for nodes whose content is a FileContent, by node index
+    "files",
+    # The paths of those FileContents' files, which _FILE_RECORDs point into
+    "file_paths",
+    "content",
+)
+
+# magic, version, whether the arrays are big-endian, then the number of nodes
+# and the (offset, length) of each section
+_HEADER = struct.Struct("<8sIB3xQ" + "QQ" * len(_SECTIONS))
+
+# index, st_mode, st_ino, st_dev, st_nlink, st_uid, st_gid, st_size,
+# keep_cache, direct_io, st_atime, st_mtime, st_ctime: -1 stands for None
+_STAT_RECORD = struct.Struct("<Qqqqqqqqqqddd")
+_STAT_INT_FIELDS = (
+    "st_mode",
+    "st_ino",
+    "st_dev",
+    "st_nlink",
+    "st_uid",
+    "st_gid",
+    "st_size",
+)
+_STAT_FLAGS = ("keep_cache", "direct_io")
+_STAT_TIME_FIELDS = ("st_atime", "st_mtime", "st_ctime")
+
+# index, offset, length (-1 for None), path offset, path length
+_FILE_RECORD = struct.Struct("<QQqQQ")
+
+# Sections start at multiples of this, so they can be cast to arrays
+_ALIGNMENT = 8
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file can't be read."""
+
+
+def _encode_stat(index: int, st: TreeFuseStat) -> bytes:
+    def or_minus_one(value: Optional[int]) -> int:
+        return -1 if value is None else int(value)
+
+    return _STAT_RECORD.pack(
+        index,
+        *(or_minus_one(getattr(st, name, 0)) for name in _STAT_INT_FIELDS),
+        *(or_minus_one(getattr(st, name, None)) for name in _STAT_FLAGS),
+        *(float(getattr(st, name, 0)) for name in _STAT_TIME_FIELDS),
+    )
+
+
+def _decode_stat(record: Tuple[Any, ...]) -> TreeFuseStat:
+    ints = record[1:1 + len(_STAT_INT_FIELDS)]
+    flags = record[1 + len(_STAT_INT_FIELDS):-len(_STAT_TIME_FIELDS)]
+    times = record[-len(_STAT_TIME_FIELDS):]
+    st = TreeFuseStat()
+    for name, value in zip(_STAT_INT_FIELDS, ints):
+        setattr(st, name, None if value == -1 else value)
+    for name, value in zip(_STAT_FLAGS, flags):
+        setattr(st, name, None if value == -1 else bool(value))
+    for name, value in zip(_STAT_TIME_FIELDS, times):
+        setattr(st, name, int(value) if value.is_integer() else value)
+    return st
+
+
+def _padding(length: int) -> bytes:
+    return bytes(-length % _ALIGNMENT)
+
+
+def _create_temporary(directory: str) -> Tuple[int, str]:
+    """Create a temporary file in ``directory``, returning its fd and path.
+
+    Unlike ``tempfile.mkstemp``'s (which are 0600), the file is created with
+    the mode ``open`` gives new files, as it's going to replace another.
+    """
+    while True:
+        temporary = os.path.join(directory, f"tmp{secrets.token_hex(8)}.tmp")
+        try:
+            fd = os.open(
+                temporary, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666
+            )
+        except FileExistsError:
+            continue
+        return fd, temporary
+
+
+def compile_snapshot(
+    source: Union[
+        FrozenTreeProvider, treelib.Tree, Iterable[FrozenTreeEntry]
+    ],
+    path: Union[str, "os.PathLike[str]"],
+) -> None:
+    """Compile ``source`` into a snapshot file at ``path``.
+
+    ``source`` is anything a ``FrozenTreeProvider`` can be built from (or a
+    ``FrozenTreeProvider`` itself).  ``bytes`` and other buffer content, and
+    the content of any ``TreeFuseContent`` other than ``FileContent``, is read
+    and stored in the snapshot; ``FileContent`` is stored as a reference to its
+    file, which must still exist when the snapshot is mounted.  Other content
+    raises ``TypeError``.
+
+    The snapshot is written to a temporary file which then replaces ``path``,
+    so that processes which have the previous snapshot mounted keep serving
+    it undisturbed.
+    """
+    frozen = (
+        source
+        if isinstance(source, FrozenTreeProvider)
+        else FrozenTreeProvider(source)
+    )
+    sizes = array("q", frozen._sizes)
+    offsets = array("Q", frozen._offsets)
+    # (Through the accessors which subclasses, e.g. ArchiveProvider, store
+    # them behind)
+    unpacked_stats = (
+        (index, frozen._unpacked_stat(index)) for index in range(len(frozen))
+    )
+    stats = b"".join(
+        _encode_stat(index, st)
+        for index, st in unpacked_stats
+        if st is not None
+    )
+
+    # Nodes whose content wasn't packed: pack it now, or refer to its file
+    extra_content: List[bytes] = []
+    content_offset = len(frozen._content)
+    files: List[bytes] = []
+    file_paths: List[bytes] = []
+    file_paths_offset = 0
+    for index, size in enumerate(frozen._sizes):
+        if size != -1:
+            continue
+        content = frozen._unpacked_content(index)
+        if isinstance(content, FileContent):
+            encoded = os.fsencode(content.path)
+            length = -1 if content.length is None else content.length
+            files.append(
+                _FILE_RECORD.pack(
+                    index,
+                    content.offset,
+                    length,
+                    file_paths_offset,
+                    len(encoded),
+                )
+            )
+            file_paths.append(encoded)
+            file_paths_offset += len(encoded)
+            continue
+        if isinstance(content, TreeFuseContent):
+            data = bytes(content.read(0, content.size))
+        else:
+            try:
+                data = memoryview(content).cast("B").tobytes()
+            except TypeError:
+                raise TypeError(
+                    f"Cannot store content of type {type(content).__name__}"
+                ) from None
+        sizes[index] = len(data)
+        offsets[index] = content_offset
+        extra_content.append(data)
+        content_offset += len(data)
+
+    sections: List[Union[bytes, memoryview]] = [
+        frozen._first_child.tobytes(),
+        frozen._child_count.tobytes(),
+        frozen._name_ids.tobytes(),
+        frozen._modes.tobytes(),
+        sizes.tobytes(),
+        offsets.tobytes(),
+        frozen._name_offsets.tobytes(),
+        frozen._names,
+        stats,
+        b"".join(files),
+        b"".join(file_paths),
+    ]
+    content = [frozen._content] + extra_content
+
+    table: List[int] = []
+    position = _HEADER.size + len(_padding(_HEADER.size))
+    for section in sections:
+        table += [position, len(section)]
+        position += len(section) + len(_padding(len(section)))
+    table += [position, content_offset]
+    header = _HEADER.pack(
+        _MAGIC, _VERSION, sys.byteorder == "big", len(frozen), *table
+    )
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary = _create_temporary(directory)
+    try:
+        with os.fdopen(fd, "wb") as snapshot:
+            snapshot.write(header + _padding(len(header)))
+            for section in sections:
+                snapshot.write(section)
+                snapshot.write(_padding(len(section)))
+            for chunk in content:
+                snapshot.write(chunk)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+class SnapshotProvider(FrozenTreeProvider):
+    """A ``FrozenTreeProvider`` which serves a snapshot file in place.
+
+    The snapshot (see :py:func:`compile_snapshot`) is ``mmap``-ed, and its
+    arrays are used directly from the mapping: nothing is decoded until a
+    lookup needs it, so this is ready to serve as soon as it's constructed,
+    however large the snapshot.  Content is served from views of the
+    mapping, so its pages are shared with the page cache and with any other
+    process serving the same snapshot.
+
+    :param path:
+        The path of the snapshot file.
+    """
+
+    def __init__(self, path: Union[str, "os.PathLike[str]"]):
+        with open(path, "rb") as snapshot:
+            if os.fstat(snapshot.fileno()).st_size < _HEADER.size:
+                raise SnapshotError(f"{path} is too short to be a snapshot")
+            self._mmap = mmap.mmap(
+                snapshot.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        view = memoryview(self._mmap)
+        magic, version, big_endian, count, *table = _HEADER.unpack_from(view)
+        if magic != _MAGIC:
+            raise SnapshotError(f"{path} is not a snapshot")
+        if version != _VERSION:
+            raise SnapshotError(f"{path} is a version {version} snapshot")
+        if big_endian != (sys.byteorder == "big"):
+            raise SnapshotError(f"{path} has the wrong byte order")
+
+        sections: Dict[str, memoryview] = {}
+        for number, name in enumerate(_SECTIONS):
+            offset, length = table[2 * number], table[2 * number + 1]
+            if offset + length > len(view):
+                raise SnapshotError(f"{path} is truncated")
+            sections[name] = view[offset:offset + length]
+        if len(sections["name_ids"]) != 4 * count:
+            raise SnapshotError(f"{path} is corrupt")
+
+        self._first_child = sections["first_child"].cast("I")
+        self._child_count = sections["child_count"].cast("I")
+        self._name_ids = sections["name_ids"].cast("I")
+        self._modes = sections["modes"].cast("H")
+        self._sizes = sections["sizes"].cast("q")
+        self._offsets = sections["offsets"].cast("Q")
+        self._name_offsets = sections["name_offsets"].cast("Q")
+        self._names = sections["names"]
+        self._stats_view = sections["stats"]
+        self._files_view = sections["files"]
+        self._file_paths = sections["file_paths"]
+        self._content = sections["content"]
+
+    def close(self) -> None:
+        """Unmap the snapshot; this provider can't be used afterwards.
+
+        If views of its content remain (e.g. in open file handles), the
+        mapping is instead closed once they have all been released.
+        """
+        for column in [
+            self._first_child,
+            self._child_count,
+            self._name_ids,
+            self._modes,
+            self._sizes,
+            self._offsets,
+            self._name_offsets,
+            self._names,
+            self._stats_view,
+            self._files_view,
+            self._file_paths,
+            self._content,
+        ]:
+            if isinstance(column, memoryview):
+                column.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+    @staticmethod
+    def _find_record(
+        records: memoryview, record: struct.Struct, index: int
+    ) -> Optional[Tuple[Any, ...]]:
+        """Binary search ``records`` for the one for node ``index``."""
+        low, high = 0, len(records) // record.size
+        while low < high:
+            middle = (low + high) // 2
+            fields = record.unpack_from(records, middle * record.size)
+            if fields[0] < index:
+                low = middle + 1
+            elif fields[0] > index:
+                high = middle
+            else:
+                return fields
+        return None
+
+    def _unpacked_stat(self, index: int) -> Optional[TreeFuseStat]:
+        fields = self._find_record(self._stats_view, _STAT_RECORD, index)
+        return None if fields is None else _decode_stat(fields)
+
+    def _unpacked_content(self, index: int) -> Any:
+        fields = self._find_record(self._files_view, _FILE_RECORD, index)
+        if fields is None:
+            raise SnapshotError(f"No content for node {index}")
+        _, offset, length, path_offset, path_length = fields
+        path = os.fsdecode(
+            bytes(self._file_paths[path_offset:path_offset + path_length])
+        )
+        return FileContent(
+            path, offset=offset, length=None if length == -1 else length
+        )
@@ -0,0 +1,632 @@
+"""
+``SQLiteProvider``, which serves a tree stored in an SQLite database.
+"""
+import contextlib
+import os
+import queue
+import sqlite3
+import threading
+import urllib.parse
+from collections import OrderedDict
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import treelib
+
+from .content import FileContent
+from .frozen import FrozenTreeEntry, _encode, _split_data
+from .snapshot import _create_temporary
+from .treefuse import (
+    Buffer,
+    TreeFuseContent,
+    TreeFuseNode,
+    TreeFuseProvider,
+    TreeFuseStat,
+    _stat_for,
+)
+
+# Stored as the database's user_version, to recognise databases we've written
+_VERSION = 2
+
+# Directories' children are read from the database in batches of this many
+_BATCH_SIZE = 1024
+
+# How much of the database each connection may map: mapped pages are shared
+# (via the page cache) between connections, rather than each connection
+# reading them into its own cache
+_MMAP_SIZE = 1 << 30
+
+# How many directories' IDs compile_sqlite remembers, while adding entries
+_MAX_DIRECTORY_IDS = 4096
+
+# The root's ID and parent; names are stored as (surrogateescape-d) UTF-8, so
+# that they sort as FrozenTreeProvider's do.
+_ROOT_ID = 1
+_NO_PARENT = 0
+
+_SCHEMA = """
+CREATE TABLE nodes (
+    id INTEGER PRIMARY KEY,
+    parent INTEGER NOT NULL,
+    name BLOB NOT NULL,
+    is_directory INTEGER NOT NULL DEFAULT 0,
+    -- The TreeFuseStat given for the node: NULL for fields it didn't set
+    st_mode INTEGER,
+    st_ino INTEGER,
+    st_dev INTEGER,
+    st_nlink INTEGER,
+    st_uid INTEGER,
+    st_gid INTEGER,
+    st_size INTEGER,
+    st_atime REAL,
+    st_mtime REAL,
+    st_ctime REAL,
+    keep_cache INTEGER,
+    direct_io INTEGER,
+    -- Files' content: a row of contents (or NULL if it's empty), or a
+    -- FileContent's file.  content_size and file_path are both NULL for
+    -- nodes added without any data.
+    content INTEGER,
+    content_size INTEGER,
+    file_path TEXT,
+    file_offset INTEGER,
+    file_length INTEGER
+);
+CREATE UNIQUE INDEX nodes_parent_name ON nodes (parent, name);
+-- Kept apart from nodes, so that lookups and listings read densely packed
+-- pages of nodes, and content is only read when it's read from
+CREATE TABLE contents (
+    id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL
+);
+"""
+
+# The columns of nodes which _NodeRow holds
+_STAT_COLUMNS = (
+    "st_mode",
+    "st_ino",
+    "st_dev",
+    "st_nlink",
+    "st_uid",
+    "st_gid",
+    "st_size",
+    "st_atime",
+    "st_mtime",
+    "st_ctime",
+    "keep_cache",
+    "direct_io",
+)
+_CONTENT_COLUMNS = (
+    "content",
+    "content_size",
+    "file_path",
+    "file_offset",
+    "file_length",
+)
+_NODE_COLUMNS = ", ".join(
+    ("id", "name", "is_directory") + _STAT_COLUMNS + _CONTENT_COLUMNS
+)
+
+# The statements we execute while serving: as their SQL is constant, sqlite3
+# prepares each once per connection and reuses it from its statement cache.
+_SELECT_NODE = f"SELECT {_NODE_COLUMNS} FROM nodes WHERE id = ?"
+_SELECT_CHILD = (
+    f"SELECT {_NODE_COLUMNS} FROM nodes WHERE parent = ? AND name = ?"
+)
+# Covered by nodes_parent_name, so this doesn't read nodes itself
+_SELECT_CHILD_ID = "SELECT id FROM nodes WHERE parent = ? AND name = ?"
+_SELECT_CHILDREN = (
+    f"SELECT {_NODE_COLUMNS} FROM nodes WHERE parent = ?"
+    " ORDER BY name LIMIT ? OFFSET ?"
+)
+# Subsequent batches seek past the last name of the previous batch, rather
+# than skipping an OFFSET which grows with each batch
+_SELECT_CHILDREN_AFTER = (
+    f"SELECT {_NODE_COLUMNS} FROM nodes WHERE parent = ? AND name > ?"
+    " ORDER BY name LIMIT ?"
+)
+# For stat_children, which needs every child at once
+_SELECT_ALL_CHILDREN = (
+    f"SELECT {_NODE_COLUMNS} FROM nodes WHERE parent = ? ORDER BY name"
+)
+_SELECT_CONTENT_RANGE = "SELECT substr(data, ?, ?) FROM contents WHERE id = ?"
+
+
+class _NodeRow(NamedTuple):
+    """A row of nodes, as ``_NODE_COLUMNS`` selects it."""
+
+    id: int
+    name: bytes
+    is_directory: int
+    st_mode: Optional[int]
+    st_ino: Optional[int]
+    st_dev: Optional[int]
+    st_nlink: Optional[int]
+    st_uid: Optional[int]
+    st_gid: Optional[int]
+    st_size: Optional[int]
+    st_atime: Optional[float]
+    st_mtime: Optional[float]
+    st_ctime: Optional[float]
+    keep_cache: Optional[int]
+    direct_io: Optional[int]
+    content: Optional[int]
+    content_size: Optional[int]
+    file_path: Optional[str]
+    file_offset: Optional[int]
+    file_length: Optional[int]
+
+
+class SQLiteTreeError(Exception):
+    """Raised when an SQLite database isn't one ``compile_sqlite`` wrote."""
+
+
+class _SQLiteContent(TreeFuseContent):
+    """Content stored in an ``SQLiteProvider``'s database."""
+
+    def __init__(self, provider: "SQLiteProvider", content_id: int, size: int):
+        self.provider = provider
+        self.content_id = content_id
+        self._size = size
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def read(self, offset: int, size: int) -> Buffer:
+        size = min(size, self._size - offset)
+        if size <= 0:
+            return b""
+        return self.provider._read_content(self.content_id, offset, size)
+
+
+class SQLiteProvider(TreeFuseProvider):
+    """A read-only ``TreeFuseProvider`` serving a tree from SQLite.
+
+    The tree is stored in a database written by :py:func:`compile_sqlite`:
+    nothing is loaded up front, and each lookup queries just the nodes on its
+    path, so memory use doesn't depend on the size of the tree (or of its
+    content).  Nodes are indexed on (parent, name), so that looking up a path
+    costs an index lookup per component, and directories are listed from the
+    index, in name order, in batches.  ``stat_children`` fetches the whole
+    directory with a single query, without reading the children's content.
+
+    Content is stored in the database as blobs, and read with incremental
+    blob I/O (on Python 3.11 and later), which reads only the pages holding
+    the range asked for.  ``FileContent`` is stored as a reference to its
+    file, which must still exist when the database is mounted.
+
+    Queries are made through a pool of at most ``max_connections``
+    connections, opened as they're needed (and reopened after a fork), which
+    each query takes for as long as it runs.  The database must not be
+    modified while it's mounted: :py:func:`compile_sqlite` replaces databases
+    atomically, so that mounts of the previous one carry on serving it.
+
+    :param path:
+        The path of the database.
+    :param max_connections:
+        The maximum number of connections to open: queries wait for one to be
+        free once this many are in use.
+    """
+
+    # Whether sqlite3 supports incremental blob I/O (Python 3.11+); without
+    # it, ranges are read with substr(), which reads the whole blob
+    _blob_io = hasattr(sqlite3.Connection, "blobopen")
+
+    def __init__(
+        self,
+        path: Union[str, "os.PathLike[str]"],
+        max_connections: int = 16,
+    ):
+        if max_connections < 1:
+            raise ValueError("max_connections must be at least 1")
+        self.path = os.path.abspath(path)
+        self.max_connections = max_connections
+        self._pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        # Every connection opened in this process, whether in use or not
+        self._connections: List[sqlite3.Connection] = []
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        # Check that this is a database we can serve now, rather than when
+        # the first lookup fails
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"No such database: {self.path}")
+        try:
+            with self._connection() as connection:
+                version = connection.execute("PRAGMA user_version")
+                version_number = version.fetchone()[0]
+        except sqlite3.DatabaseError as e:
+            raise SQLiteTreeError(f"{self.path}: {e}") from None
+        if version_number != _VERSION:
+            raise SQLiteTreeError(f"{self.path} is not a TreeFuse database")
+
+    def _open(self) -> sqlite3.Connection:
+        # The database is never written while it's served, so it can be
+        # opened immutable: SQLite then doesn't lock it for each query.
+        uri = "file:{}?mode=ro&immutable=1".format(
+            urllib.parse.quote(self.path)
+        )
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        connection.execute(f"PRAGMA mmap_size = {_MMAP_SIZE}")
+        return connection
+
+    @contextlib.contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        """Take a connection from the pool for the duration of a query.
+
+        (Threads can't keep their own: python-fuse serves each operation
+        from a new Python thread state, so thread-locals don't last beyond
+        it.)
+        """
+        connection = None
+        with self._lock:
+            if self._pid != os.getpid():
+                # The parent's connections mustn't be used (or closed) in a
+                # forked child
+                self._pool = queue.LifoQueue()
+                self._connections = []
+                self._pid = os.getpid()
+            pool = self._pool
+            try:
+                connection = pool.get_nowait()
+            except queue.Empty:
+                if len(self._connections) < self.max_connections:
+                    connection = self._open()
+                    self._connections.append(connection)
+        if connection is None:
+            connection = pool.get()
+        try:
+            yield connection
+        finally:
+            pool.put(connection)
+
+    def close(self) -> None:
+        """Close the pool's connections.
+
+        The provider can still be used afterwards: connections are reopened as
+        they're needed.  It mustn't be in use while this is called.
+        """
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._pool = queue.LifoQueue()
+        for connection in connections:
+            connection.close()
+
+    def _read_content(self, content_id: int, offset: int, size: int) -> bytes:
+        """Read ``size`` bytes from ``offset`` of the blob ``content_id``."""
+        with self._connection() as connection:
+            if self._blob_io:
+                with connection.blobopen(
+                    "contents", "data", content_id, readonly=True
+                ) as blob:
+                    blob.seek(offset)
+                    return blob.read(size)
+            row = connection.execute(
+                _SELECT_CONTENT_RANGE, (offset + 1, size, content_id)
+            ).fetchone()
+        return b"" if row is None else bytes(row[0])
+
+    def _find(self, path: str) -> Optional[_NodeRow]:
+        """Return the row of the node at ``path``, or ``None``."""
+        components = [
+            _encode(part) for part in path.split(os.path.sep) if part
+        ]
+        with self._connection() as connection:
+            if not components:
+                row = connection.execute(_SELECT_NODE, (_ROOT_ID,)).fetchone()
+                return None if row is None else _NodeRow._make(row)
+            parent = _ROOT_ID
+            for name in components[:-1]:
+                row = connection.execute(
+                    _SELECT_CHILD_ID, (parent, name)
+                ).fetchone()
+                if row is None:
+                    return None
+                parent = row[0]
+            row = connection.execute(
+                _SELECT_CHILD, (parent, components[-1])
+            ).fetchone()
+        return None if row is None else _NodeRow._make(row)
+
+    def _stat(self, row: _NodeRow) -> TreeFuseStat:
+        fields = {
+            column: getattr(row, column)
+            for column in _STAT_COLUMNS
+            if getattr(row, column) is not None
+        }
+        for flag in ("keep_cache", "direct_io"):
+            if flag in fields:
+                fields[flag] = bool(fields[flag])
+        if row.is_directory:
+            return TreeFuseStat.for_directory_stat(**fields)
+        if "st_size" not in fields and row.content_size is not None:
+            fields["st_size"] = row.content_size
+        return TreeFuseStat.for_file_stat(**fields)
+
+    def _node(self, row: _NodeRow) -> TreeFuseNode:
+        """Construct a ``TreeFuseNode`` from ``row``."""
+        name = row.name.decode("utf-8", "surrogateescape")
+        st = self._stat(row)
+        if row.is_directory:
+            return TreeFuseNode(name, None, st, is_directory=True)
+        content: Union[Buffer, TreeFuseContent]
+        if row.file_path is not None:
+            content = FileContent(
+                row.file_path,
+                offset=row.file_offset or 0,
+                length=row.file_length,
+            )
+        elif row.content is None:
+            content = b""
+        else:
+            content = _SQLiteContent(self, row.content, row.content_size or 0)
+        return TreeFuseNode(name, content, st, is_directory=False)
+
+    def _iter_children(self, parent: int, offset: int) -> Iterator[_NodeRow]:
+        # Each batch is fetched with whichever connection is free, as we may
+        # be resumed in another thread (and mustn't hold one in between)
+        with self._connection() as connection:
+            rows = connection.execute(
+                _SELECT_CHILDREN, (parent, _BATCH_SIZE, offset)
+            ).fetchall()
+        while rows:
+            yield from map(_NodeRow._make, rows)
+            if len(rows) < _BATCH_SIZE:
+                return
+            with self._connection() as connection:
+                rows = connection.execute(
+                    _SELECT_CHILDREN_AFTER, (parent, rows[-1][1], _BATCH_SIZE)
+                ).fetchall()
+
+    def children_for(self, path: str) -> Iterator[TreeFuseNode]:
+        return self.iter_children(path)
+
+    def iter_children(
+        self, path: str, offset: int = 0
+    ) -> Iterator[TreeFuseNode]:
+        row = self._find(path)
+        if row is None or not row.is_directory:
+            return iter(())
+        return map(self._node, self._iter_children(row.id, offset))
+
+    def stat_children(self, path: str) -> List[Tuple[str, TreeFuseStat]]:
+        row = self._find(path)
+        if row is None or not row.is_directory:
+            return []
+        with self._connection() as connection:
+            rows = connection.execute(
+                _SELECT_ALL_CHILDREN, (row.id,)
+            ).fetchall()
+        nodes = map(self._node, map(_NodeRow._make, rows))
+        return [
+            (node.name, _stat_for(node, bool(node.is_directory)))
+            for node in nodes
+        ]
+
+    def is_directory(self, path: str) -> bool:
+        row = self._find(path)
+        return row is not None and bool(row.is_directory)
+
+    def lookup_path(self, path: str) -> Optional[TreeFuseNode]:
+        row = self._find(path)
+        return None if row is None else self._node(row)
+
+    def size_of(self, path: str) -> int:
+        row = self._find(path)
+        if row is not None and row.content_size is not None:
+            return row.content_size
+        return super().size_of(path)
+
+
+class _Writer:
+    """Adds nodes to a database being written by ``compile_sqlite``."""
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+        # path -> ID, for the directories which entries were last added to
+        self._directory_ids: "OrderedDict[str, int]" = OrderedDict()
+
+    def _insert(self, table: str, values: Dict[str, Any]) -> int:
+        columns = ", ".join(values)
+        placeholders = ", ".join("?" * len(values))
+        cursor = self.connection.execute(
+            f"INSERT INTO {table} ({columns}) VALUES ({placeholders})",
+            list(values.values()),
+        )
+        assert cursor.lastrowid is not None
+        return cursor.lastrowid
+
+    def _columns(self, data: Any) -> Dict[str, Any]:
+        """Return the values of the stat and content columns for ``data``.
+
+        Content is stored (in contents) as a side effect.
+        """
+        content, st = _split_data(data)
+        values = {
+            column: None if st is None else getattr(st, column, None)
+            for column in _STAT_COLUMNS
+        }
+        if data is None:
+            # (So that data given for it later can be used)
+            return values
+        if isinstance(content, FileContent):
+            values.update(
+                content_size=content.length,
+                file_path=content.path,
+                file_offset=content.offset,
+                file_length=content.length,
+            )
+            return values
+        if content is None:
+            view = memoryview(b"")
+        elif isinstance(content, TreeFuseContent):
+            view = memoryview(content.read(0, content.size)).cast("B")
+        else:
+            try:
+                view = memoryview(content).cast("B")
+            except TypeError:
+                raise TypeError(
+                    f"Cannot store content of type {type(content).__name__}"
+                ) from None
+        values["content_size"] = view.nbytes
+        if view.nbytes:
+            values["content"] = self._insert("contents", {"data": view})
+        return values
+
+    def _child_id(self, parent: int, name: str) -> Optional[int]:
+        row = self.connection.execute(
+            _SELECT_CHILD_ID, (parent, _encode(name))
+        ).fetchone()
+        return None if row is None else int(row[0])
+
+    def add(self, parent: int, name: str, data: Any) -> Optional[int]:
+        """Add a node, returning its ID (or ``None`` if it already exists)."""
+        if self._child_id(parent, name) is not None:
+            # As with FrozenTreeProvider, the first of several children with
+            # the same name wins
+            return None
+        values = {"parent": parent, "name": _encode(name)}
+        values.update(self._columns(data))
+        return self._insert("nodes", values)
+
+    def add_root(self, name: str, data: Any) -> None:
+        _, st = _split_data(data)
+        values = {"id": _ROOT_ID, "parent": _NO_PARENT, "name": _encode(name)}
+        # (Only its stat: the root is a directory)
+        values.update(self._columns((None, st)))
+        self._insert("nodes", values)
+
+    def add_tree(self, tree: treelib.Tree) -> None:
+        """Add every node of ``tree``, depth first."""
+        if tree.root is None:
+            raise ValueError("Cannot store an empty tree")
+        root = tree[tree.root]
+        self.add_root(root.tag, root.data)
+        pending = [
+            (child, _ROOT_ID)
+            for child in reversed(tree.children(root.identifier))
+        ]
+        while pending:
+            node, parent = pending.pop()
+            node_id = self.add(parent, node.tag, node.data)
+            if node_id is None:
+                continue
+            pending.extend(
+                (child, node_id)
+                for child in reversed(tree.children(node.identifier))
+            )
+
+    def _directory(self, components: List[str]) -> int:
+        """Return the ID of the directory at ``components``.
+
+        It's added (as are its ancestors) if it doesn't exist yet.
+        """
+        if not components:
+            return _ROOT_ID
+        path = os.path.sep.join(components)
+        directory_id = self._directory_ids.get(path)
+        if directory_id is not None:
+            self._directory_ids.move_to_end(path)
+            return directory_id
+        parent = self._directory(components[:-1])
+        directory_id = self._child_id(parent, components[-1])
+        if directory_id is None:
+            directory_id = self._insert(
+                "nodes",
+                {"parent": parent, "name": _encode(components[-1])},
+            )
+        self._directory_ids[path] = directory_id
+        while len(self._directory_ids) > _MAX_DIRECTORY_IDS:
+            self._directory_ids.popitem(last=False)
+        return directory_id
+
+    def add_entries(self, entries: Iterable[FrozenTreeEntry]) -> None:
+        """Add ``entries``, and the directories containing them."""
+        self.add_root("", None)
+        for entry in entries:
+            if isinstance(entry, tuple):
+                path, data = entry
+            else:
+                path, data = entry, None
+            components = [part for part in path.split(os.path.sep) if part]
+            if not components:
+                continue
+            parent = self._directory(components[:-1])
+            if self.add(parent, components[-1], data) is not None:
+                continue
+            if data is None:
+                continue
+            # e.g. a directory's stat, given after its children: use it if
+            # the node was added without any data
+            row = self.connection.execute(
+                "SELECT id FROM nodes WHERE parent = ? AND name = ?"
+                " AND content_size IS NULL AND file_path IS NULL",
+                (parent, _encode(components[-1])),
+            ).fetchone()
+            if row is not None:
+                values = self._columns(data)
+                self.connection.execute(
+                    "UPDATE nodes SET {} WHERE id = ?".format(
+                        ", ".join(f"{column} = ?" for column in values)
+                    ),
+                    list(values.values()) + [row[0]],
+                )
+
+
+def compile_sqlite(
+    source: Union[treelib.Tree, Iterable[FrozenTreeEntry]],
+    path: Union[str, "os.PathLike[str]"],
+) -> None:
+    """Store ``source`` in an SQLite database at ``path``, for an
+    ``SQLiteProvider`` to serve.
+
+    ``source`` is either a ``treelib.Tree`` (with nodes' ``data`` interpreted
+    as for ``treefuse_main``), or an iterable of paths, or of ``(path,
+    data)`` tuples, as for ``FrozenTreeProvider``: the iterable is consumed
+    as it's stored, so inventories too large to hold in memory can be
+    streamed into the database.  ``bytes`` and other buffer content, and the
+    content of any ``TreeFuseContent`` other than ``FileContent``, is read and
+    stored in the database; ``FileContent`` is stored as a reference to its
+    file.  Other content raises ``TypeError``.
+
+    As with ``compile_snapshot``, the database is written to a temporary file
+    which then replaces ``path``.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary = _create_temporary(directory)
+    os.close(fd)
+    try:
+        connection = sqlite3.connect(temporary)
+        try:
+            # The file only replaces path once it's complete, so there's
+            # nothing for a journal to protect
+            connection.execute("PRAGMA journal_mode = OFF")
+            connection.execute("PRAGMA synchronous = OFF")
+            connection.executescript(_SCHEMA)
+            writer = _Writer(connection)
+            if isinstance(source, treelib.Tree):
+                writer.add_tree(source)
+            else:
+                writer.add_entries(source)
+            connection.execute(
+                "UPDATE nodes SET is_directory = 1"
+                " WHERE id = ? OR id IN (SELECT parent FROM nodes)",
+                (_ROOT_ID,),
+            )
+            connection.execute(f"PRAGMA user_version = {_VERSION}")
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
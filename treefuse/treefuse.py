@@ -5,22 +5,56 @@ It wraps python-fuse to provide a CLI entrypoint (`treefuse_main`) which takes
 a `tree` parameter and uses that to construct a directory tree and generate
 file content within the FUSE filesystem.
 """
+import asyncio
+import concurrent.futures
+import contextlib
+import dataclasses
 import errno
+import itertools
 import os.path
 import stat
 import sys
+import threading
+import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Any, Collection, Iterator, Optional, Type, TypeVar, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Coroutine,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 
 import fuse
 import treelib
 from fuse import Fuse
 
+if TYPE_CHECKING:
+    from .blobs import BlobStore
+    from .instrumentation import Instrumentation
+    from .profiling import Profiler
+
 fuse.fuse_python_api = (0, 2)
 
+_T = TypeVar("_T")
 _TFS = TypeVar("_TFS", bound="TreeFuseStat")
 
+# File content can be any object supporting the buffer protocol (e.g. mmap.mmap
+# or array.array, as well as these); typing has no way to spell that on the
+# Python versions we support, so this lists the common cases.
+Buffer = Union[bytes, bytearray, memoryview]
+
 
 class TreeFuseStat(fuse.Stat):
     """An object representing the stat struct for a TreeFuse node.
@@ -45,13 +79,56 @@ class TreeFuseStat(fuse.Stat):
     _DEFAULT_DIRECTORY_MODE = 0o755
     _DEFAULT_FILE_MODE = 0o444
 
+    # A stat is built for every getattr, so store the fields in slots rather
+    # than a per-instance __dict__.  (fuse.Stat has no __slots__, so other
+    # attributes can still be set.)
+    __slots__ = (
+        "st_mode",
+        "st_ino",
+        "st_dev",
+        "st_nlink",
+        "st_uid",
+        "st_gid",
+        "st_size",
+        "st_atime",
+        "st_mtime",
+        "st_ctime",
+        "keep_cache",
+        "direct_io",
+    )
+
     # mypy can't infer self.st_size's type, so be explicit
     st_size: Optional[int]
 
-    def ensure_st_size_from(self, content: bytes) -> None:
+    # Not part of the stat struct: whether the kernel may keep this file's
+    # content in its page cache between opens.  None means "use the mount-wide
+    # default" (see TreeFuseFS's kernel_cache parameter).
+    keep_cache: Optional[bool]
+
+    # Also not part of the stat struct: whether reads of this file should
+    # bypass the kernel's page cache (and so are not limited to st_size), for
+    # content which changes between opens.
+    direct_io: Optional[bool]
+
+    def __init__(self, **kwargs: Any):
+        self.keep_cache = None
+        self.direct_io = None
+        super().__init__(**kwargs)
+
+    def ensure_st_size_from(
+        self, content: Union[Buffer, "TreeFuseContent"]
+    ) -> None:
         """If ``self.st_size`` is not yet set, use ``content`` to set it."""
         if self.st_size is None:
-            self.st_size = len(content)
+            if isinstance(content, TreeFuseContent):
+                self.st_size = content.size
+                return
+            try:
+                self.st_size = memoryview(content).nbytes
+            except TypeError:
+                # Not a buffer, so it can't be read either; report its length
+                # regardless.
+                self.st_size = len(content)
 
     @classmethod
     def for_directory_stat(
@@ -114,68 +191,219 @@ class TreeFuseStat(fuse.Stat):
         )
 
     @classmethod
-    def for_file(cls: Type[_TFS], mode: int = _DEFAULT_FILE_MODE) -> _TFS:
+    def for_file(
+        cls: Type[_TFS],
+        mode: int = _DEFAULT_FILE_MODE,
+        keep_cache: Optional[bool] = None,
+        direct_io: Optional[bool] = None,
+    ) -> _TFS:
         """Construct a :py:class:`TreeFuseStat` for a file.
 
         :param mode:
             The mode to set on this file (defaults to 0o444).
+        :param keep_cache:
+            Whether the kernel may cache this file's content between opens of
+            it; this should only be set for content which won't change.  If
+            not given, the mount-wide default applies.
+        :param direct_io:
+            Whether reads of this file should bypass the kernel's page cache
+            entirely, so that they aren't truncated to the file's size as of
+            the last ``getattr``: set this for content which is generated when
+            the file is opened.
         """
-        return cls.for_file_stat(st_mode=stat.S_IFREG | mode)
+        return cls.for_file_stat(
+            st_mode=stat.S_IFREG | mode,
+            keep_cache=keep_cache,
+            direct_io=direct_io,
+        )
+
+
+class TreeFuseContent(ABC):
+    """Abstract base class for file content which is read on demand.
+
+    Instances can be used as the content of a ``TreeFuseNode`` in place of a
+    buffer, for content which shouldn't (or can't) be held in memory in its
+    entirety.
+    """
+
+    @property
+    @abstractmethod
+    def size(self) -> int:
+        """The size of the content in bytes.
+
+        This is used for ``st_size``, so should be cheap to determine.
+        """
+        pass
+
+    @abstractmethod
+    def read(self, offset: int, size: int) -> Buffer:
+        """Return up to ``size`` bytes of content, starting at ``offset``.
+
+        Fewer than ``size`` bytes should be returned only at the end of the
+        content (and none at all if ``offset`` is beyond the end).
+        """
+        pass
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, init=False)
 class TreeFuseNode:
     """An abstraction of a node in a TreeFuse filesystem.
 
     :param name:
         The name of the node in the filesystem (i.e. filename/directory name).
     :param _content:
-        The content of the node in the filesystem, if any.  Files will default
-        to b"" as their content if ``None`` is specified.  (This can be passed
-        for directories, but won't be used by TreeFuse.)
+        The content of the node in the filesystem, if any: either a buffer or
+        a ``TreeFuseContent``.  Files will default to b"" as their content if
+        ``None`` is specified.  (This can be passed for directories, but won't
+        be used by TreeFuse.)
     :param stat:
         The ``TreeFuseStat`` that should be used for this node: if not given,
-        TreeFuse will use a default (with ``TreeFuseProvider.is_directory``
-        determining whether to use the file or directory default).
+        TreeFuse will use a default (with :py:attr:`is_directory` determining
+        whether to use the file or directory default).
+    :param is_directory:
+        Whether this node is a directory.  Providers which can determine this
+        cheaply when constructing the node should set it: if it is ``None``,
+        TreeFuse will call ``TreeFuseProvider.is_directory`` to find out.
     """
+    # Nodes are built for every lookup, so avoid a per-instance __dict__.
+    # (Defaults for slots can't be class attributes, hence __init__.)
+    __slots__ = ("name", "_content", "stat", "is_directory")
+
     name: str
-    _content: Optional[bytes]
-    stat: Optional[TreeFuseStat] = None
+    _content: Optional[Union[Buffer, TreeFuseContent]]
+    stat: Optional[TreeFuseStat]
+    is_directory: Optional[bool]
+
+    def __init__(
+        self,
+        name: str,
+        _content: Optional[Union[Buffer, TreeFuseContent]],
+        stat: Optional[TreeFuseStat] = None,
+        is_directory: Optional[bool] = None,
+    ):
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "_content", _content)
+        object.__setattr__(self, "stat", stat)
+        object.__setattr__(self, "is_directory", is_directory)
+
+    def __getstate__(self) -> Tuple[Any, ...]:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state: Tuple[Any, ...]) -> None:
+        for name, value in zip(self.__slots__, state):
+            object.__setattr__(self, name, value)
 
     @property
-    def content(self) -> bytes:
+    def content(self) -> Union[Buffer, TreeFuseContent]:
         """Return self._content, or b"" if self._content is None.
 
         We do this instead of defaulting on initialisation so that we aren't
         throwing away provider input: 'this file has no data' and 'this file's
         data is b""' are not identical inputs.
         """
-        return self._content if self._content else b""
+        return self._content if self._content is not None else b""
+
 
+class _ChangeNotifier:
+    """Mixin for providers, to tell interested parties when their nodes change.
+
+    TreeFuse (and providers which wrap other providers) cache results from
+    providers, and register callbacks here to learn when to invalidate them.
+    """
+
+    def add_change_callback(self, callback: Callable[[str], None]) -> None:
+        """Call ``callback`` with the path of each node that changes.
+
+        See :py:meth:`notify_change`.
+        """
+        self.__dict__.setdefault("_change_callbacks", []).append(callback)
 
-class TreeFuseProvider(ABC):
-    """Abstract base class for TreeFuse providers."""
+    def notify_change(self, path: str) -> None:
+        """Tell registered callbacks that the node at ``path`` has changed.
+
+        Providers whose nodes can change while mounted must call this whenever
+        a node is added, removed or replaced; it applies to the node's
+        descendants (if any) too.
+        """
+        for callback in self.__dict__.get("_change_callbacks", ()):
+            callback(path)
+
+
+class TreeFuseProvider(_ChangeNotifier, ABC):
+    """Abstract base class for TreeFuse providers.
+
+    Providers whose nodes can change while mounted must report changes via
+    :py:meth:`notify_change`.
+    """
 
     @abstractmethod
-    def children_for(self, path: str) -> Collection[TreeFuseNode]:
+    def children_for(self, path: str) -> Iterable[TreeFuseNode]:
         """Return ``TreeFuseNode``s for each child of ``path``.
 
-        N.B. TreeFuse does not (yet) support empty directories, so returning an
-        empty ``Collection`` is used to indicate that ``path`` is a file.
+        This can be a lazy iterator, for large directories: TreeFuse consumes
+        it only as far as it needs to.  It must yield the children in the same
+        order each time it's called, as the kernel resumes directory listings
+        by position.
+
+        N.B. TreeFuse does not (yet) support empty directories, so returning no
+        children is used to indicate that ``path`` is a file.
         """
         pass
 
+    def iter_children(
+        self, path: str, offset: int = 0
+    ) -> Iterator[TreeFuseNode]:
+        """Iterate over the children of ``path``, skipping ``offset`` of them.
+
+        ``TreeFuseFS.readdir`` uses this to resume directory listings part of
+        the way through.  A default implementation is provided, which skips
+        through ``self.children_for``; providers which can seek to ``offset``
+        more cheaply should override it.
+        """
+        return itertools.islice(self.children_for(path), offset, None)
+
+    def stat_children(
+        self, path: str
+    ) -> Optional[Iterable[Tuple[str, TreeFuseStat]]]:
+        """Return the name and ``TreeFuseStat`` of every child of ``path``.
+
+        Listing a directory with ``ls -l`` (or ``find``, or a file manager)
+        is followed by a ``getattr`` of every entry in it, each of which
+        otherwise looks the entry up separately.  Providers which can fetch
+        the attributes of a whole directory at once much more cheaply (e.g.
+        with one query, or one request to a remote service) should override
+        this: ``TreeFuseFS.readdir`` calls it instead of
+        :py:meth:`iter_children`, and answers those ``getattr``\\ s from its
+        results for a short while (see its ``stat_children_ttl``).
+
+        Each stat must be complete, as ``getattr`` would report it: its
+        ``st_mode`` must include the type of the child (as
+        ``TreeFuseStat.for_directory`` and ``for_file`` set it), and files'
+        ``st_size`` must be set.  The children must be in the same order as
+        :py:meth:`children_for` yields them.  Unlike listings via
+        :py:meth:`iter_children`, the whole directory is held in memory while
+        it's listed, so this suits directories of thousands of entries rather
+        than millions.  Providers which hold their tree in memory, and so
+        look up each child cheaply, shouldn't implement this: listings via
+        :py:meth:`iter_children` only construct the entries the kernel reads.
+
+        The default implementation returns ``None``, meaning that this isn't
+        supported.
+        """
+        return None
+
     def is_directory(self, path: str) -> bool:
         """Is ``path`` a directory?
 
         This will only be called for paths for which ``lookup_path`` returns a
-        ``TreeFuseNode`` without a ``.stat`` set, to determine the appropriate
-        default to use.
+        ``TreeFuseNode`` without ``.is_directory`` set.
 
         A default implementation is provided, which checks that
-        ``self.children_for`` is not empty.
+        ``self.children_for`` is not empty.  As that may construct a
+        ``TreeFuseNode`` for every child, providers should either override
+        this or set ``.is_directory`` on the nodes they return.
         """
-        return bool(self.children_for(path))
+        return next(iter(self.children_for(path)), None) is not None
 
     @abstractmethod
     def lookup_path(self, path: str) -> Optional[TreeFuseNode]:
@@ -186,29 +414,404 @@ class TreeFuseProvider(ABC):
         """
         pass
 
+    def size_of(self, path: str) -> int:
+        """Return the size of the content of the file at ``path``.
+
+        Providers which generate content on demand should override this (and
+        :py:meth:`read_range`), and return nodes with a ``ProviderContent``
+        for ``path`` as their content: TreeFuse will then call this to
+        determine ``st_size``, without needing the content itself.
+
+        A default implementation is provided, which determines the size from
+        the content of the node returned by ``self.lookup_path``.
+        """
+        node = self.lookup_path(path)
+        if node is None:
+            return 0
+        content = node.content
+        if isinstance(content, TreeFuseContent):
+            return content.size
+        return memoryview(content).nbytes
+
+    def read_range(self, path: str, offset: int, size: int) -> Buffer:
+        """Return up to ``size`` bytes of ``path``'s content, from ``offset``.
+
+        See :py:meth:`size_of`: TreeFuse calls this for each read from a node
+        with a ``ProviderContent``, with the range that the kernel asked for.
+        Fewer than ``size`` bytes should be returned only at the end of the
+        content.
+
+        A default implementation is provided, which reads from the content of
+        the node returned by ``self.lookup_path``.
+        """
+        node = self.lookup_path(path)
+        if node is None:
+            return b""
+        content = node.content
+        if isinstance(content, TreeFuseContent):
+            return content.read(offset, size)
+        return memoryview(content).cast("B")[offset:offset + size]
+
+
+class ProviderContent(TreeFuseContent):
+    """Content which is generated on demand by a ``TreeFuseProvider``.
+
+    Its size and content are obtained from the provider's ``size_of`` and
+    ``read_range`` methods (which the provider must override), so only the
+    ranges which are actually read are ever generated.
+
+    :param provider:
+        The provider which serves this content.  (If this is an
+        ``AsyncTreeFuseProvider``, the content can only be read through an
+        ``AsyncProviderBridge``.)
+    :param path:
+        The path of the file whose content this is.
+    """
+
+    def __init__(
+        self,
+        provider: Union[TreeFuseProvider, "AsyncTreeFuseProvider"],
+        path: str,
+    ):
+        self.provider = provider
+        self.path = path
+
+    def _sync_provider(self) -> TreeFuseProvider:
+        if not isinstance(self.provider, TreeFuseProvider):
+            raise TypeError(
+                "Content from an AsyncTreeFuseProvider must be read through"
+                " an AsyncProviderBridge"
+            )
+        return self.provider
+
+    @property
+    def size(self) -> int:
+        return self._sync_provider().size_of(self.path)
+
+    def read(self, offset: int, size: int) -> Buffer:
+        return self._sync_provider().read_range(self.path, offset, size)
+
+
+def _rebind_provider_content(
+    node: TreeFuseNode,
+    provider: Union[TreeFuseProvider, "AsyncTreeFuseProvider"],
+    wrapper: TreeFuseProvider,
+) -> TreeFuseNode:
+    """Make ``node``'s content read through ``wrapper``, not ``provider``.
+
+    Providers which wrap another provider use this on the nodes it returns, so
+    that reads of its ``ProviderContent`` go through the wrapper too.
+    """
+    content = node._content
+    if isinstance(content, ProviderContent) and content.provider is provider:
+        node = dataclasses.replace(
+            node, _content=ProviderContent(wrapper, content.path)
+        )
+    return node
+
+
+def _stat_for(node: TreeFuseNode, is_directory: bool) -> TreeFuseStat:
+    """Return the ``TreeFuseStat`` which ``getattr`` reports for ``node``."""
+    st = node.stat
+    if is_directory:
+        if st is None:
+            st = TreeFuseStat.for_directory_stat()
+    else:
+        if st is None:
+            st = TreeFuseStat.for_file()
+        st.ensure_st_size_from(node.content)
+    return st
+
+
+class _ReadWriteLock:
+    """A lock which allows many concurrent readers, or a single writer.
+
+    Writers are preferred: once a writer is waiting, new readers wait until it
+    has finished, so a steady stream of reads can't starve mutations.
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextlib.contextmanager
+    def read_locked(self) -> Iterator[None]:
+        with self._condition:
+            while self._writer or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def write_locked(self) -> Iterator[None]:
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
 
 class TreelibProvider(TreeFuseProvider):
     """A ``TreeFuseProvider`` to wrap a ``treelib.Tree``.
 
+    On construction, we index every node in ``tree`` by its full path, and
+    every directory by the names of its children, so that path lookups do not
+    need to walk the tree.  This means that ``tree`` must not be modified
+    directly once it has been passed in: use :py:meth:`add_node`,
+    :py:meth:`remove_node`, :py:meth:`replace_node` and :py:meth:`swap_tree`
+    instead, which keep the indexes in sync and report each change via
+    ``notify_change``.  These can be called while the filesystem is mounted
+    (e.g. from a thread started by ``TreeFuseFS``'s ``on_mount`` callback),
+    so that it can be updated without remounting.
+
+    This is thread-safe: lookups run concurrently with one another, and
+    mutations wait for in-flight lookups to finish (and vice versa).
+
     :param tree:
         The tree to use as the source of the FUSE filesystem.
+    :param blob_store:
+        If given, a ``BlobStore`` to store nodes' buffer content in, so that
+        nodes with identical content share one copy of it.  The content of
+        the nodes in ``tree`` (and of those added later) is replaced by the
+        store's ``Blob``\\ s, which are released when the nodes are removed
+        or replaced.
     """
-    def __init__(self, tree: treelib.Tree):
+    def __init__(
+        self, tree: treelib.Tree, blob_store: Optional["BlobStore"] = None
+    ):
         self._tree = tree
+        self._blob_store = blob_store
+        self._lock = _ReadWriteLock()
+        # full path -> node, for every node in the tree
+        self._paths: Dict[str, treelib.Node] = {}
+        # directory path -> (child name -> child node)
+        self._children: Dict[str, Dict[str, treelib.Node]] = {}
+        # directory path -> its children, in order: built when it's first
+        # listed, so that resumed listings index into it rather than skip
+        # through (or copy) the rest of the directory.  Dropped when the
+        # directory's children change.
+        self._child_lists: Dict[str, List[treelib.Node]] = {}
+        if tree.root is not None:
+            self._index_subtree(os.path.sep, tree.get_node(tree.root))
+
+    @staticmethod
+    def _normalise_path(path: str) -> str:
+        """Return ``path`` in the form used as a key in our indexes."""
+        return os.path.sep + path.lstrip(os.path.sep)
+
+    def _index_subtree(self, path: str, node: treelib.Node) -> None:
+        """Add ``node`` (found at ``path``) and its descendants to our indexes.
+
+        If a directory contains multiple children with the same tag, the first
+        one wins (as it would have when walking the tree).
+        """
+        pending = [(path, node)]
+        while pending:
+            current_path, current_node = pending.pop()
+            self._paths[current_path] = current_node
+            if self._blob_store is not None:
+                current_node.data = self._store_data(current_node.data)
+            for child_node in self._tree.children(current_node.identifier):
+                siblings = self._children.setdefault(current_path, {})
+                if child_node.tag in siblings:
+                    continue
+                siblings[child_node.tag] = child_node
+                pending.append(
+                    (os.path.join(current_path, child_node.tag), child_node)
+                )
+
+    def _unindex_subtree(self, path: str) -> None:
+        """Remove ``path`` and everything beneath it from our indexes."""
+        pending = [path]
+        while pending:
+            current_path = pending.pop()
+            node = self._paths.pop(current_path, None)
+            if node is not None:
+                self._release_data(node.data)
+            children = self._children.pop(current_path, {})
+            self._child_lists.pop(current_path, None)
+            pending.extend(
+                os.path.join(current_path, name) for name in children
+            )
 
-    def children_for(self, path: str) -> Collection[TreeFuseNode]:
-        """Return ``TreeFuseNode``\ s for each child of ``path``.
+    def _store_data(self, data: Any) -> Any:
+        """Return ``data``, with its content replaced by a ``Blob``.
 
-        Specifically, we find the ``treelib.Node`` corresponding to ``path``,
-        and return a ``TreeFuseNode`` for each of its children in the tree.
+        (Content which isn't a buffer is left as it is.)
         """
-        node = self._lookup_path(path)
-        children = []
-        for treelib_child_node in self._tree.children(node.identifier):
-            children.append(
-                self._treelib_node_to_treefusenode(treelib_child_node)
-            )
-        return children
+        if self._blob_store is None:
+            return data
+        content, st = data if isinstance(data, tuple) else (data, None)
+        if content is None or isinstance(content, TreeFuseContent):
+            return data
+        try:
+            blob = self._blob_store.add(content)
+        except TypeError:
+            # Not a buffer: reads of it will fail, as they would have anyway
+            return data
+        return (blob, st) if isinstance(data, tuple) else blob
+
+    def _release_data(self, data: Any) -> None:
+        """Release the ``Blob`` (if any) ``_store_data`` put in ``data``."""
+        if self._blob_store is None:
+            return
+        # Imported here, as it builds on this module
+        from .blobs import Blob
+
+        content = data[0] if isinstance(data, tuple) else data
+        if isinstance(content, Blob):
+            self._blob_store.release(content)
+
+    def add_node(
+        self, parent_path: str, tag: str, data: Any = None
+    ) -> treelib.Node:
+        """Add a node named ``tag`` to the directory at ``parent_path``.
+
+        ``data`` is interpreted in the same way as for nodes in the tree
+        passed to ``__init__``.  The created ``treelib.Node`` is returned.
+        """
+        parent_path = self._normalise_path(parent_path)
+        data = self._store_data(data)
+        with self._lock.write_locked():
+            parent = self._paths.get(parent_path)
+            error = None
+            if parent is None:
+                error = f"No such parent path: {parent_path}"
+            elif tag in self._children.get(parent_path, {}):
+                error = f"{tag} already exists in {parent_path}"
+            if error is not None:
+                self._release_data(data)
+                raise ValueError(error)
+            node = self._tree.create_node(tag, parent=parent, data=data)
+            self._children.setdefault(parent_path, {})[tag] = node
+            self._child_lists.pop(parent_path, None)
+            path = os.path.join(parent_path, tag)
+            self._paths[path] = node
+        self.notify_change(path)
+        return node
+
+    def remove_node(self, path: str) -> None:
+        """Remove the node at ``path`` (and any descendants) from the tree."""
+        path = self._normalise_path(path)
+        with self._lock.write_locked():
+            node = self._paths.get(path)
+            if node is None:
+                raise ValueError(f"No such path: {path}")
+            if path == os.path.sep:
+                raise ValueError("Cannot remove the root node")
+            parent_path, name = os.path.split(path)
+            self._tree.remove_node(node.identifier)
+            self._unindex_subtree(path)
+            siblings = self._children[parent_path]
+            del siblings[name]
+            self._child_lists.pop(parent_path, None)
+            if not siblings:
+                del self._children[parent_path]
+        self.notify_change(path)
+
+    def replace_node(self, path: str, data: Any) -> None:
+        """Replace the data of the node at ``path`` with ``data``.
+
+        ``data`` is interpreted in the same way as for nodes in the tree
+        passed to ``__init__``.  The node's children (if any) are kept.
+        """
+        path = self._normalise_path(path)
+        data = self._store_data(data)
+        with self._lock.write_locked():
+            node = self._paths.get(path)
+            if node is None:
+                self._release_data(data)
+                raise ValueError(f"No such path: {path}")
+            self._release_data(node.data)
+            node.data = data
+        self.notify_change(path)
+
+    def swap_tree(self, tree: treelib.Tree) -> List[str]:
+        """Atomically replace the whole tree with ``tree``.
+
+        ``tree`` is indexed before the swap, so lookups are only blocked for
+        as long as it takes to swap the indexes over.  Changes are then
+        reported (via ``notify_change``) only for the paths which differ
+        between the two trees: those added or removed (but not their
+        descendants), and those whose ``data`` is not the same object.  (With
+        a ``blob_store``, ``data`` which is identical buffer content becomes
+        the same ``Blob``, so counts as unchanged.)
+
+        The paths reported are returned.
+        """
+        if tree.root is None:
+            raise ValueError("Cannot swap in an empty tree")
+        swapped = TreelibProvider(tree, self._blob_store)
+        with self._lock.write_locked():
+            old_paths, old_children = self._paths, self._children
+            self._tree = swapped._tree
+            self._paths = swapped._paths
+            self._children = swapped._children
+            self._child_lists = {}
+        new_paths, new_children = swapped._paths, swapped._children
+
+        changed = []
+        for path, node in new_paths.items():
+            old_node = old_paths.get(path)
+            if old_node is None:
+                if os.path.dirname(path) in old_paths:
+                    changed.append(path)
+            elif old_node.data is not node.data or (
+                (path in old_children) != (path in new_children)
+            ):
+                changed.append(path)
+        for path, node in old_paths.items():
+            self._release_data(node.data)
+            if path not in new_paths and os.path.dirname(path) in new_paths:
+                changed.append(path)
+        for path in changed:
+            self.notify_change(path)
+        return changed
+
+    def children_for(self, path: str) -> Iterator[TreeFuseNode]:
+        """Return ``TreeFuseNode``\\ s for each child of ``path``.
+
+        Specifically, we find the children of ``path`` in our index, and
+        lazily construct a ``TreeFuseNode`` for each of them.
+        """
+        return self.iter_children(path)
+
+    def iter_children(
+        self, path: str, offset: int = 0
+    ) -> Iterator[TreeFuseNode]:
+        """Iterate over the children of ``path``, skipping ``offset`` of them.
+
+        The ``TreeFuseNode``\\ s are constructed as they are consumed, and
+        only for children after ``offset``.
+        """
+        path = self._normalise_path(path)
+        with self._lock.read_locked():
+            children = self._child_lists.get(path)
+            if children is None:
+                children = list(self._children.get(path, {}).values())
+                if children:
+                    # (Mutations, which drop this, can't run concurrently)
+                    self._child_lists[path] = children
+        # The list is replaced rather than changed, so can be read unlocked
+        return map(
+            self._treelib_node_to_treefusenode,
+            map(children.__getitem__, range(offset, len(children))),
+        )
 
     def _lookup_path(self, path: str) -> Optional[treelib.Node]:
         """Look up the given ``path`` in our ``treelib.Tree``.
@@ -216,31 +819,22 @@ class TreelibProvider(TreeFuseProvider):
         This is the internal lookup function: it operates only in terms of
         treelib objects.
         """
-        path = path.lstrip(os.path.sep)
-        lookups = path.split(os.path.sep) if path else []
+        return self._paths.get(self._normalise_path(path))
 
-        current_node = self._tree.get_node(self._tree.root)
-        while lookups:
-            next_segment = lookups.pop(0)
-            for child_node_id in current_node.successors(
-                self._tree.identifier
-            ):
-                child_node = self._tree.get_node(child_node_id)
-                if child_node.tag == next_segment:
-                    current_node = child_node
-                    break
-            else:
-                return None
-        return current_node
+    def is_directory(self, path: str) -> bool:
+        """Is ``path`` a directory?  (i.e. does it have any children?)"""
+        with self._lock.read_locked():
+            return bool(self._children.get(self._normalise_path(path)))
 
     def lookup_path(self, path: str) -> Optional[TreeFuseNode]:
         """Find the node in ``self._tree`` corresponding to the given ``path``.
 
         Returns None if the path isn't present."""
-        maybe_treelib_node = self._lookup_path(path)
-        if maybe_treelib_node is not None:
-            return self._treelib_node_to_treefusenode(maybe_treelib_node)
-        return None
+        with self._lock.read_locked():
+            maybe_treelib_node = self._lookup_path(path)
+            if maybe_treelib_node is not None:
+                return self._treelib_node_to_treefusenode(maybe_treelib_node)
+            return None
 
     def _treelib_node_to_treefusenode(
         self, node: treelib.Node
@@ -250,89 +844,802 @@ class TreelibProvider(TreeFuseProvider):
         This consists of mapping ``node.data`` to ``TreeFuseNode.__init__``
         parameters.
         """
+        is_directory = bool(node.successors(self._tree.identifier))
         if isinstance(node.data, tuple):
             # We have a (content, stat) tuple.
-            treefuse_node = TreeFuseNode(node.tag, *node.data)
+            content, st = node.data
         else:
-            treefuse_node = TreeFuseNode(node.tag, node.data)
-        return treefuse_node
+            content, st = node.data, None
+        return TreeFuseNode(node.tag, content, st, is_directory=is_directory)
+
+
+class AsyncTreeFuseProvider(_ChangeNotifier, ABC):
+    """Abstract base class for asyncio-native TreeFuse providers.
+
+    This is the ``async`` equivalent of :py:class:`TreeFuseProvider`, for
+    providers whose lookups wait on I/O.  ``TreeFuseFS`` runs its coroutines on
+    a dedicated event loop thread (see :py:class:`AsyncProviderBridge`), so
+    concurrent FUSE operations overlap their waits instead of each blocking
+    the FUSE worker thread which called it.
+
+    Nodes returned with a ``ProviderContent`` should pass this provider to
+    it: their reads will be served by the ``async`` :py:meth:`read_range`.
+    """
+
+    @abstractmethod
+    async def children_for(self, path: str) -> Iterable[TreeFuseNode]:
+        """See :py:meth:`TreeFuseProvider.children_for`."""
+        pass
+
+    async def stat_children(
+        self, path: str
+    ) -> Optional[Iterable[Tuple[str, TreeFuseStat]]]:
+        """See :py:meth:`TreeFuseProvider.stat_children`."""
+        return None
+
+    async def is_directory(self, path: str) -> bool:
+        """See :py:meth:`TreeFuseProvider.is_directory`."""
+        children = await self.children_for(path)
+        return next(iter(children), None) is not None
+
+    @abstractmethod
+    async def lookup_path(self, path: str) -> Optional[TreeFuseNode]:
+        """See :py:meth:`TreeFuseProvider.lookup_path`."""
+        pass
+
+    async def size_of(self, path: str) -> int:
+        """See :py:meth:`TreeFuseProvider.size_of`."""
+        node = await self.lookup_path(path)
+        if node is None:
+            return 0
+        content = node.content
+        if isinstance(content, TreeFuseContent):
+            return content.size
+        return memoryview(content).nbytes
+
+    async def read_range(self, path: str, offset: int, size: int) -> Buffer:
+        """See :py:meth:`TreeFuseProvider.read_range`."""
+        node = await self.lookup_path(path)
+        if node is None:
+            return b""
+        content = node.content
+        if isinstance(content, TreeFuseContent):
+            return content.read(offset, size)
+        return memoryview(content).cast("B")[offset:offset + size]
+
+
+class AsyncProviderBridge(TreeFuseProvider):
+    """A ``TreeFuseProvider`` which runs an ``AsyncTreeFuseProvider``.
+
+    Each call is submitted to an event loop running in a dedicated thread,
+    and the calling thread waits for its result; calls from different FUSE
+    worker threads therefore run concurrently on the loop.
+
+    The thread is started on first use (rather than on construction), so that
+    it is started in the process which serves the mount: python-fuse forks
+    to daemonise, and threads don't survive a fork.
+
+    :param provider:
+        The ``AsyncTreeFuseProvider`` to run.
+    """
+
+    def __init__(self, provider: AsyncTreeFuseProvider):
+        self.provider = provider
+        provider.add_change_callback(self.notify_change)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever,
+                    name="treefuse-asyncio",
+                    daemon=True,
+                )
+                thread.start()
+                self._loop, self._thread = loop, thread
+                self._pid = os.getpid()
+            return self._loop
+
+    def _run(self, coro: Coroutine[Any, Any, _T]) -> _T:
+        """Run ``coro`` on our event loop, and wait for its result."""
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    def close(self) -> None:
+        """Stop the event loop and its thread, if they are running."""
+        with self._lock:
+            if self._loop is None or self._thread is None:
+                return
+            if self._pid == os.getpid():
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                self._thread.join()
+                self._loop.close()
+            self._loop = self._thread = None
+
+    def children_for(self, path: str) -> Iterable[TreeFuseNode]:
+        children = self._run(self.provider.children_for(path))
+        return [
+            _rebind_provider_content(child, self.provider, self)
+            for child in children
+        ]
+
+    def stat_children(
+        self, path: str
+    ) -> Optional[Iterable[Tuple[str, TreeFuseStat]]]:
+        return self._run(self.provider.stat_children(path))
+
+    def is_directory(self, path: str) -> bool:
+        return self._run(self.provider.is_directory(path))
+
+    def lookup_path(self, path: str) -> Optional[TreeFuseNode]:
+        node = self._run(self.provider.lookup_path(path))
+        if node is None:
+            return None
+        return _rebind_provider_content(node, self.provider, self)
+
+    def size_of(self, path: str) -> int:
+        return self._run(self.provider.size_of(path))
+
+    def read_range(self, path: str, offset: int, size: int) -> Buffer:
+        return self._run(self.provider.read_range(path, offset, size))
+
+
+class ThreadPoolProvider(TreeFuseProvider):
+    """A ``TreeFuseProvider`` which runs another on a bounded thread pool.
+
+    python-fuse serves each FUSE request on its own thread (unless ``-s`` is
+    passed), without any limit on how many run at once.  Wrapping a provider
+    whose calls block (e.g. on network I/O) in this bounds the number of
+    concurrent calls into it to ``max_workers``; further calls queue until a
+    worker is free.
+
+    :param provider:
+        The provider to run.  It must be thread-safe.
+    :param max_workers:
+        The maximum number of concurrent calls into ``provider``.
+    """
+
+    def __init__(self, provider: TreeFuseProvider, max_workers: int):
+        self.provider = provider
+        provider.add_change_callback(self.notify_change)
+        self.max_workers = max_workers
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _submit(self, fn: Callable[..., _T], *args: Any) -> _T:
+        with self._lock:
+            # As with AsyncProviderBridge, (re)create the pool lazily so its
+            # threads live in the process serving the mount.
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="treefuse-provider"
+                )
+                self._pid = os.getpid()
+            executor = self._executor
+        return executor.submit(fn, *args).result()
+
+    def close(self) -> None:
+        """Shut down the thread pool, if it has been started."""
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown()
+            self._executor = None
+
+    def children_for(self, path: str) -> Iterable[TreeFuseNode]:
+        # Consume the children on the pool, as iterating may block too.
+        children = self._submit(
+            lambda: list(self.provider.children_for(path))
+        )
+        return [
+            _rebind_provider_content(child, self.provider, self)
+            for child in children
+        ]
+
+    def iter_children(
+        self, path: str, offset: int = 0
+    ) -> Iterator[TreeFuseNode]:
+        children = self._submit(
+            lambda: list(self.provider.iter_children(path, offset))
+        )
+        return (
+            _rebind_provider_content(child, self.provider, self)
+            for child in children
+        )
+
+    def stat_children(
+        self, path: str
+    ) -> Optional[Iterable[Tuple[str, TreeFuseStat]]]:
+        def stat_children() -> Optional[List[Tuple[str, TreeFuseStat]]]:
+            children = self.provider.stat_children(path)
+            return None if children is None else list(children)
+
+        return self._submit(stat_children)
+
+    def is_directory(self, path: str) -> bool:
+        return self._submit(self.provider.is_directory, path)
+
+    def lookup_path(self, path: str) -> Optional[TreeFuseNode]:
+        node = self._submit(self.provider.lookup_path, path)
+        if node is None:
+            return None
+        return _rebind_provider_content(node, self.provider, self)
+
+    def size_of(self, path: str) -> int:
+        return self._submit(self.provider.size_of, path)
+
+    def read_range(self, path: str, offset: int, size: int) -> Buffer:
+        return self._submit(self.provider.read_range, path, offset, size)
+
+
+class _NegativeLookupCache:
+    """A bounded, least-recently-used set of paths known not to exist.
+
+    :param max_entries:
+        The maximum number of paths to remember.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        # Incremented by every invalidation, so that lookups made before one
+        # aren't remembered after it
+        self.generation = 0
+        self._paths: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def __contains__(self, path: object) -> bool:
+        with self._lock:
+            if path not in self._paths:
+                return False
+            assert isinstance(path, str)
+            self._paths.move_to_end(path)
+            self.hits += 1
+            return True
+
+    def add(self, path: str, generation: int) -> None:
+        """Remember that ``path`` doesn't exist.
+
+        ``generation`` is :py:attr:`generation` as it was before the lookup
+        which found that: if there has been an invalidation since, the lookup
+        may be stale, so it isn't remembered.
+        """
+        if not self.max_entries:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._paths[path] = None
+            self._paths.move_to_end(path)
+            while len(self._paths) > self.max_entries:
+                self._paths.popitem(last=False)
+
+    def invalidate(self, path: str) -> None:
+        """Forget ``path``, and any paths beneath it."""
+        prefix = path.rstrip(os.path.sep) + os.path.sep
+        with self._lock:
+            self.generation += 1
+            self._paths.pop(path, None)
+            for cached_path in [
+                p for p in self._paths if p.startswith(prefix)
+            ]:
+                del self._paths[cached_path]
+
+
+@dataclass
+class _ChildStats:
+    """The stats of a directory's children, as ``stat_children`` returned."""
+
+    children: List[Tuple[str, TreeFuseStat]]
+    by_name: Dict[str, TreeFuseStat]
+    expires: float
+
+
+class _ChildStatCache:
+    """A bounded, least-recently-used cache of directories' children's stats.
+
+    :param ttl:
+        How long (in seconds) to keep each directory's stats for.
+    :param max_directories:
+        The maximum number of directories to keep the stats of.
+    """
+
+    def __init__(self, ttl: float, max_directories: int = 64):
+        self.ttl = ttl
+        self.max_directories = max_directories
+        self.hits = 0
+        # As for _NegativeLookupCache: stats fetched before an invalidation
+        # aren't cached after it
+        self.generation = 0
+        self._directories: "OrderedDict[str, _ChildStats]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._directories)
+
+    def _get(self, path: str) -> Optional[_ChildStats]:
+        """Return the unexpired stats of ``path``; the lock must be held."""
+        child_stats = self._directories.get(path)
+        if child_stats is None:
+            return None
+        if child_stats.expires <= time.monotonic():
+            del self._directories[path]
+            return None
+        self._directories.move_to_end(path)
+        return child_stats
+
+    def children(self, path: str) -> Optional[List[Tuple[str, TreeFuseStat]]]:
+        """Return the children of the directory at ``path``, if cached."""
+        with self._lock:
+            child_stats = self._get(path)
+            return None if child_stats is None else child_stats.children
+
+    def stat(self, path: str) -> Optional[TreeFuseStat]:
+        """Return the stat of ``path``, if its directory's are cached."""
+        with self._lock:
+            child_stats = self._get(os.path.dirname(path))
+            if child_stats is None:
+                return None
+            st = child_stats.by_name.get(os.path.basename(path))
+            if st is not None:
+                self.hits += 1
+            return st
+
+    def add(
+        self,
+        path: str,
+        children: List[Tuple[str, TreeFuseStat]],
+        generation: int,
+    ) -> None:
+        """Cache ``children``, the stats of the children of ``path``.
+
+        They aren't cached if there has been an invalidation since
+        ``generation`` (:py:attr:`generation` before they were fetched).
+        """
+        child_stats = _ChildStats(
+            children, dict(children), time.monotonic() + self.ttl
+        )
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._directories[path] = child_stats
+            self._directories.move_to_end(path)
+            while len(self._directories) > self.max_directories:
+                self._directories.popitem(last=False)
+
+    def invalidate(self, path: str) -> None:
+        """Forget the stats of ``path``, its parent and anything beneath it."""
+        prefix = path.rstrip(os.path.sep) + os.path.sep
+        with self._lock:
+            self.generation += 1
+            self._directories.pop(path, None)
+            self._directories.pop(os.path.dirname(path), None)
+            for cached_path in [
+                p for p in self._directories if p.startswith(prefix)
+            ]:
+                del self._directories[cached_path]
+
+
+class TreeFuseFileHandle:
+    """The state that TreeFuse keeps for an open file.
+
+    ``TreeFuseFS.open`` returns one of these, and python-fuse passes it back to
+    us for every subsequent operation on the same file descriptor, so we only
+    have to resolve the path once per ``open``.
+
+    Reads are served from a ``memoryview`` of the node's content, so they
+    don't copy it: python-fuse copies straight from the view into the kernel's
+    buffer.  ``TreeFuseContent`` is read from on demand instead.
+
+    python-fuse reads ``keep_cache`` and ``direct_io`` from the handle to set
+    the corresponding flags for the open file.
+
+    :param node:
+        The ``TreeFuseNode`` which was resolved when the file was opened.
+    :param keep_cache:
+        Whether the kernel may keep this file's content in its page cache
+        after it is closed, rather than dropping it on the next open.
+    :param direct_io:
+        Whether reads should bypass the kernel's page cache.
+    """
+
+    def __init__(
+        self,
+        node: TreeFuseNode,
+        keep_cache: bool = False,
+        direct_io: bool = False,
+    ):
+        self.node = node
+        self.content = node.content
+        self.keep_cache = keep_cache
+        self.direct_io = direct_io
+        self._view: Optional[memoryview] = None
+        if not isinstance(self.content, TreeFuseContent):
+            try:
+                self._view = memoryview(self.content).cast("B")
+            except TypeError:
+                # Not a (contiguous) buffer: reads will fail with EILSEQ.
+                pass
+
+    def read(self, size: int, offset: int) -> Union[int, Buffer]:
+        """Read ``size`` bytes from this file, starting at ``offset``."""
+        if self._view is None:
+            if isinstance(self.content, TreeFuseContent):
+                return self.content.read(offset, size)
+            return -errno.EILSEQ
+        # Slicing a memoryview clamps to its bounds, and doesn't copy.
+        return self._view[offset:offset + size]
+
+    def release(self) -> None:
+        """Release our view of the content, so it can be resized or freed."""
+        if self._view is not None:
+            self._view.release()
+
+
+# The TreeFuseFS methods which an Instrumentation records calls to (and which
+# a Profiler can profile)
+_INSTRUMENTED_OPERATIONS = (
+    "getattr",
+    "open",
+    "read",
+    "flush",
+    "release",
+    "readdir",
+)
 
 
 class TreeFuseFS(Fuse):
-    """Implementation of a FUSE filesystem based on a treelib.Tree instance."""
+    """Implementation of a FUSE filesystem based on a treelib.Tree instance.
+
+    Unless ``-s`` is passed on the command line, python-fuse calls these
+    methods concurrently from multiple threads, so the provider must be
+    thread-safe.  (``TreelibProvider`` is.)
+
+    :param provider:
+        The provider for the filesystem's content.  An
+        ``AsyncTreeFuseProvider`` will be run via an ``AsyncProviderBridge``.
+    :param provider_workers:
+        If given, calls into ``provider`` are run on a thread pool of this
+        size (see ``ThreadPoolProvider``).
+    :param attr_timeout:
+        How long (in seconds) the kernel may cache the attributes returned by
+        ``getattr`` before asking for them again.
+    :param entry_timeout:
+        How long (in seconds) the kernel may cache the result of looking up a
+        name in a directory.
+    :param negative_timeout:
+        How long (in seconds) the kernel may cache the non-existence of a
+        name in a directory.
+    :param kernel_cache:
+        Whether the kernel may keep files' content in its page cache between
+        opens, by default.  (``TreeFuseStat.for_file``'s ``keep_cache``
+        parameter overrides this for individual files.)
+    :param negative_cache_size:
+        The number of paths which TreeFuse remembers don't exist, so that
+        repeated lookups of them (e.g. of ``.git`` or ``__pycache__`` by tools
+        probing for them) don't reach the provider.  Entries are invalidated
+        when the provider reports changes via ``notify_change``.  Set to 0 to
+        disable.  (This is separate from the kernel's own negative lookup
+        cache, which ``negative_timeout`` enables.)
+    :param stat_children_ttl:
+        How long (in seconds) the stats which ``readdir`` fetches from the
+        provider's ``stat_children`` (if it supports it) are used to answer
+        ``getattr``\\ s of the directory's children, such as those of
+        ``ls -l``.  Set to 0 to never call ``stat_children``.
+    :param on_mount:
+        If given, called (with no arguments) once the filesystem has been
+        mounted, in the process which serves it.  Use this to start any
+        threads which update the provider while it's mounted: threads started
+        before mounting don't survive python-fuse daemonising.
+    :param instrumentation:
+        If given, an ``Instrumentation`` which records every operation (and
+        every call into the provider): their counts, errors, latencies and
+        bytes served.  Without one, operations are not wrapped at all.
+    :param stats_file:
+        Whether to serve what ``instrumentation`` records, as JSON, from the
+        file ``/.treefuse/stats`` within the mount.  (An ``Instrumentation``
+        is created if one isn't given.)
+    :param profiler:
+        If given, a ``Profiler`` which profiles the operations served while
+        the filesystem is mounted, and writes the profile when it's unmounted
+        (or signalled).
+
+    The timeouts default to FUSE's defaults (one second for attributes and
+    entries; negative lookups are not cached).  They should only be raised
+    for filesystems which won't change while they're mounted.  Options given
+    on the command line (e.g. ``-o attr_timeout=1``) take precedence.
+
+    When the provider reports a change to a path via ``notify_change``, we
+    drop what we know about it, ask the kernel to do the same (via
+    python-fuse's ``Invalidate``), and have the kernel discard any cached
+    content for it when it is next opened.  Note that with libfuse 2,
+    ``Invalidate`` is a no-op, so the kernel may still serve stale attributes
+    and entries for up to ``attr_timeout``/``entry_timeout`` after a change.
+    """
 
-    def __init__(self, *args: Any, provider: TreeFuseProvider, **kwargs: Any):
+    def __init__(
+        self,
+        *args: Any,
+        provider: Union[TreeFuseProvider, AsyncTreeFuseProvider],
+        provider_workers: Optional[int] = None,
+        attr_timeout: Optional[float] = None,
+        entry_timeout: Optional[float] = None,
+        negative_timeout: Optional[float] = None,
+        kernel_cache: bool = False,
+        negative_cache_size: int = 4096,
+        stat_children_ttl: float = 1.0,
+        on_mount: Optional[Callable[[], None]] = None,
+        instrumentation: Optional["Instrumentation"] = None,
+        stats_file: bool = False,
+        profiler: Optional["Profiler"] = None,
+        **kwargs: Any
+    ):
+        if isinstance(provider, AsyncTreeFuseProvider):
+            provider = AsyncProviderBridge(provider)
+        if provider_workers is not None:
+            provider = ThreadPoolProvider(provider, provider_workers)
+        if stats_file or instrumentation is not None:
+            # Imported here, as it builds on this module
+            from . import instrumentation as instrumentation_module
+
+            if instrumentation is None:
+                instrumentation = instrumentation_module.Instrumentation()
+            provider = instrumentation_module.InstrumentedProvider(
+                provider, instrumentation
+            )
+            if stats_file:
+                provider = instrumentation_module.StatsFileProvider(
+                    provider, instrumentation
+                )
+            for operation in _INSTRUMENTED_OPERATIONS:
+                setattr(
+                    self,
+                    operation,
+                    instrumentation.wrap_operation(
+                        operation, getattr(self, operation)
+                    ),
+                )
+        if profiler is not None:
+            for operation in _INSTRUMENTED_OPERATIONS:
+                setattr(
+                    self,
+                    operation,
+                    profiler.wrap_operation(
+                        operation, getattr(self, operation)
+                    ),
+                )
+        self.instrumentation = instrumentation
+        self.profiler = profiler
         self._provider = provider
+        self._kernel_cache = kernel_cache
+        self._negative_cache = _NegativeLookupCache(negative_cache_size)
+        self._child_stats = _ChildStatCache(stat_children_ttl)
+        self._on_mount = on_mount
+        self._mounted = False
+        # Paths which have changed since they were last opened, whose content
+        # the kernel must not keep from before the change
+        self._changed_content: Set[str] = set()
+        provider.add_change_callback(self._provider_changed)
         super().__init__(*args, **kwargs)
+        for option, timeout in [
+            ("attr_timeout", attr_timeout),
+            ("entry_timeout", entry_timeout),
+            ("negative_timeout", negative_timeout),
+        ]:
+            if timeout is not None:
+                self.fuse_args.add(option, str(timeout))
+
+    def fsinit(self) -> None:
+        """Called by python-fuse once the filesystem has been mounted."""
+        self._mounted = True
+        if self.profiler is not None:
+            self.profiler.start()
+        if self._on_mount is not None:
+            self._on_mount()
+
+    def main(self, *args: Any, **kwargs: Any) -> Any:
+        """Serve the filesystem until it's unmounted."""
+        if self.profiler is None:
+            return super().main(*args, **kwargs)
+        # In the main thread, before python-fuse starts its threads
+        self.profiler.block_signal()
+        try:
+            return super().main(*args, **kwargs)
+        finally:
+            self.profiler.stop()
+
+    def _provider_changed(self, path: str) -> None:
+        """Forget what we (and the kernel) know about ``path``."""
+        self._negative_cache.invalidate(path)
+        self._child_stats.invalidate(path)
+        self._changed_content.add(path)
+        if self._mounted:
+            try:
+                # Best effort: this fails (or does nothing) with libfuse 2
+                self.Invalidate(path)
+            except Exception:
+                pass
+
+    def _lookup(self, path: str) -> Optional[TreeFuseNode]:
+        """Look ``path`` up, unless we already know it doesn't exist."""
+        if path in self._negative_cache:
+            return None
+        generation = self._negative_cache.generation
+        node = self._provider.lookup_path(path)
+        if node is None:
+            self._negative_cache.add(path, generation)
+        return node
+
+    def _is_directory(self, path: str, node: TreeFuseNode) -> bool:
+        """Is ``node`` (which was found at ``path``) a directory?
+
+        This only calls into the provider if ``node`` does not tell us.
+        """
+        if node.is_directory is not None:
+            return node.is_directory
+        return self._provider.is_directory(path)
 
     def getattr(self, path: str) -> Union[TreeFuseStat, int]:
-        """Return a TreeFuseStat for the given `path` (or an error code)."""
-        node = self._provider.lookup_path(path)
+        """Return a TreeFuseStat for the given `path` (or an error code).
+
+        If `path`'s directory has just been listed, this is answered from the
+        stats which the listing fetched.
+        """
+        st = self._child_stats.stat(path)
+        if st is not None:
+            return st
+        node = self._lookup(path)
         if node is None:
             return -errno.ENOENT
+        return _stat_for(node, self._is_directory(path, node))
 
-        content, st = node.content, node.stat
+    def open(
+        self, path: str, flags: int
+    ) -> Union[TreeFuseFileHandle, int]:
+        """Check permissions for `path` and `flags`, and return a handle.
 
-        if self._provider.is_directory(path):
-            if st is None:
-                st = TreeFuseStat.for_directory_stat()
-        else:
-            if st is None:
-                st = TreeFuseStat.for_file()
-            st.ensure_st_size_from(content)
-        return st
-
-    def open(self, path: str, flags: int) -> Optional[int]:
-        """Perform permission checking for the given `path` and `flags`."""
-        # TODO: Distinguish between getting a node object, and checking for path existence
-        node = self._provider.lookup_path(path)
+        The returned ``TreeFuseFileHandle`` holds the resolved node, so reads
+        from it don't need to go back to the provider.
+        """
+        node = self._lookup(path)
         if node is None:
             return -errno.ENOENT
         accmode = os.O_RDONLY | os.O_WRONLY | os.O_RDWR
         if (flags & accmode) != os.O_RDONLY:
             return -errno.EACCES
-        return None
-
-    def read(self, path: str, size: int, offset: int) -> Union[int, bytes]:
-        """Read `size` bytes from `path`, starting at `offset`."""
-        node = self._provider.lookup_path(path)
-        if node is None:
-            return -errno.ENOENT
-        if self._provider.is_directory(path):
-            return -errno.EISDIR
+        keep_cache = getattr(node.stat, "keep_cache", None)
+        if keep_cache is None:
+            keep_cache = self._kernel_cache
+        if path in self._changed_content:
+            # Opening without keep_cache drops the kernel's cached content
+            self._changed_content.discard(path)
+            keep_cache = False
+        direct_io = bool(getattr(node.stat, "direct_io", None))
+        return TreeFuseFileHandle(
+            node, keep_cache=keep_cache, direct_io=direct_io
+        )
 
-        content = node.content
-        if not isinstance(content, bytes):
-            return -errno.EILSEQ
+    def read(
+        self,
+        path: str,
+        size: int,
+        offset: int,
+        fh: Optional[TreeFuseFileHandle] = None,
+    ) -> Union[int, Buffer]:
+        """Read `size` bytes from `path`, starting at `offset`.
 
-        slen = len(content)
-        if offset < slen:
-            if offset + size > slen:
-                size = slen - offset
-            buf = content[offset:offset + size]
-        else:
-            buf = b""
-        return buf
+        If `fh` is given, it is used instead of looking `path` up again.
+        """
+        if fh is None:
+            node = self._lookup(path)
+            if node is None:
+                return -errno.ENOENT
+            if self._is_directory(path, node):
+                return -errno.EISDIR
+            fh = TreeFuseFileHandle(node)
+        return fh.read(size, offset)
+
+    def flush(
+        self, path: str, fh: Optional[TreeFuseFileHandle] = None
+    ) -> int:
+        """Flush `fh`; as TreeFuse is read-only, this is a no-op."""
+        return 0
+
+    def release(
+        self, path: str, flags: int, fh: Optional[TreeFuseFileHandle] = None
+    ) -> int:
+        """Release `fh`, the handle for `path`, once it has been closed."""
+        if fh is not None:
+            fh.release()
+        return 0
 
     def readdir(
         self, path: str, offset: int
     ) -> Union[Iterator[fuse.Direntry], int]:
-        """Return `fuse.Direntry`s for the directory at `path`."""
-        dir_node = self._provider.lookup_path(path)
+        """Return `fuse.Direntry`s for the directory at `path`.
+
+        Each entry carries its position in the listing as its ``offset``, so
+        the kernel can resume a listing which doesn't fit into one buffer from
+        `offset`, and its type, so that listing doesn't require a ``getattr``
+        per entry to find out which entries are directories.
+        """
+        dir_node = self._lookup(path)
         if dir_node is None:
             return -errno.ENOENT
-        children = self._provider.children_for(path)
-        if not children:
+        if not self._is_directory(path, dir_node):
             # TODO: Support empty directories.
             return -errno.ENOTDIR
-        dir_entries = [".", ".."]
+        return self._direntries(path, offset)
+
+    def _direntries(self, path: str, offset: int) -> Iterator[fuse.Direntry]:
+        """Generate the `fuse.Direntry`s for `path`, starting at `offset`."""
+        dot_entries = [".", ".."]
+        for position in range(offset, len(dot_entries)):
+            yield fuse.Direntry(
+                dot_entries[position], type=stat.S_IFDIR, offset=position + 1
+            )
+        position = max(offset, len(dot_entries))
+        child_stats = self._stat_children(path, offset <= len(dot_entries))
+        if child_stats is not None:
+            for name, st in child_stats[position - len(dot_entries):]:
+                position += 1
+                yield fuse.Direntry(
+                    name, type=stat.S_IFMT(st.st_mode), offset=position
+                )
+            return
+        children = self._provider.iter_children(
+            path, position - len(dot_entries)
+        )
         for child in children:
-            dir_entries.append(child.name)
-        for entry in dir_entries:
-            yield fuse.Direntry(entry)
+            position += 1
+            yield fuse.Direntry(
+                child.name, type=self._direntry_type(child), offset=position
+            )
+
+    def _stat_children(
+        self, path: str, refresh: bool
+    ) -> Optional[List[Tuple[str, TreeFuseStat]]]:
+        """Return the stats of ``path``'s children, if the provider has them.
 
+        If ``refresh`` (i.e. a listing is starting), they're fetched afresh;
+        listings which are resumed use those fetched when they started, if
+        they're still cached, so that they see the same children.
+        """
+        if not self._child_stats.ttl:
+            return None
+        if not refresh:
+            return self._child_stats.children(path)
+        generation = self._child_stats.generation
+        children = self._provider.stat_children(path)
+        if children is None:
+            return None
+        children = list(children)
+        self._child_stats.add(path, children, generation)
+        return children
 
-def _treefuse_main(provider: TreeFuseProvider) -> None:
+    @staticmethod
+    def _direntry_type(node: TreeFuseNode) -> int:
+        """Return the ``stat.S_IF*`` type of ``node``, or 0 if unknown."""
+        if node.stat is not None and node.stat.st_mode:
+            return stat.S_IFMT(node.stat.st_mode)
+        if node.is_directory is not None:
+            return stat.S_IFDIR if node.is_directory else stat.S_IFREG
+        return 0
+
+
+def _treefuse_main(
+    provider: Union[TreeFuseProvider, AsyncTreeFuseProvider],
+    multithreaded: bool = True,
+    **options: Any
+) -> None:
     # XXX: docs
     usage = (
         f"Mount a {sys.argv[0]} filesystem (powered by TreeFuse)\n"
@@ -343,13 +1650,20 @@ def _treefuse_main(provider: TreeFuseProvider) -> None:
         usage=usage,
         dash_s_do="setsingle",
         provider=provider,
+        **options,
     )
+    # -s on the command line will still force single-threaded mode
+    server.multithreaded = multithreaded
 
     server.parse(errex=1)
     server.main()
 
 
-def treefuse_main(tree: treelib.Tree) -> None:
+def treefuse_main(
+    tree: Union[treelib.Tree, TreeFuseProvider, AsyncTreeFuseProvider],
+    multithreaded: bool = True,
+    **options: Any
+) -> None:
     """Parse command-line options to mount a FUSE filesystem for ``tree``.
 
     The :py:class:`treelib.Tree` instance passed as ``tree`` is interpreted as
@@ -364,8 +1678,10 @@ def treefuse_main(tree: treelib.Tree) -> None:
           one child node (i.e. file) to the root node
     * The ``.data`` attribute provided by :py:class:`treelib.Node`, if set,
       will be read for metadata and content, in one of two ways:
-        * If a ``bytes`` instance is set as ``node.data``, it is used as the
-          content for file nodes; it is ignored for directory nodes.
+        * If a ``bytes`` instance (or any other object supporting the buffer
+          protocol, such as ``bytearray``, ``memoryview`` or ``mmap.mmap``) is
+          set as ``node.data``, it is used as the content for file nodes; it is
+          ignored for directory nodes.
         * If a tuple of ``(bytes, TreeFuseStat)`` is set as ``node.data``:
             * The first element is used as the content for file nodes; it is
               ignored for directory nodes.
@@ -377,8 +1693,11 @@ def treefuse_main(tree: treelib.Tree) -> None:
     .. note::
 
         In both forms of ``node.data``, file content *must* be specified as
-        ``bytes``: users will receive EILSEQ when reading from a file with
-        non-``bytes`` content.
+        ``bytes`` (or another buffer), or as a :py:class:`TreeFuseContent`
+        (e.g. :py:class:`treefuse.FileContent`, to serve content from a file
+        on disk without loading it into memory): users will receive EILSEQ
+        when reading from a file with any other content.  Reads are served
+        from views of the content, without copying it.
 
     See :ref:`examples` for detailed examples.
 
@@ -386,10 +1705,34 @@ def treefuse_main(tree: treelib.Tree) -> None:
     command-line options available to users will depend on the version of
     python-fuse (published on PyPI as ``fuse-python``) which they have
     installed.  See help output for full details.
+
+    A :py:class:`TreeFuseProvider` (or :py:class:`AsyncTreeFuseProvider`) can
+    be passed as ``tree`` instead, for filesystems which aren't backed by a
+    :py:class:`treelib.Tree` (e.g. those whose content is generated on demand:
+    see :py:meth:`TreeFuseProvider.read_range`).  To mount a tree before
+    it's complete, populating it as it's served, pass a
+    :py:class:`treefuse.ProgressiveProvider`.
+
+    By default, the filesystem is served by multiple threads, so providers
+    must be thread-safe; pass ``multithreaded=False`` (or ``-s`` on the
+    command line) to serve it from a single thread.
+
+    Any other keyword arguments are passed to :py:class:`TreeFuseFS`: e.g.
+    ``provider_workers`` bounds the number of concurrent calls into the
+    provider, and ``attr_timeout``, ``entry_timeout``, ``negative_timeout``
+    and ``kernel_cache`` let the kernel cache the filesystem's metadata and
+    content, ``on_mount`` can start threads which update the provider
+    while it's mounted (see :py:meth:`TreelibProvider.swap_tree`),
+    ``instrumentation`` and ``stats_file`` record (and serve) statistics about
+    the operations served, and ``profiler`` profiles them.  See its
+    documentation for details.
     """
+    if isinstance(tree, (TreeFuseProvider, AsyncTreeFuseProvider)):
+        _treefuse_main(tree, multithreaded, **options)
+        return
     if tree.root is None:
         raise Exception("Cannot handle empty Tree objects")
     if len(tree) < 2:
         raise Exception("No support for empty directories, even /")
     provider = TreelibProvider(tree)
-    _treefuse_main(provider)
+    _treefuse_main(provider, multithreaded, **options)